@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
 application = get_asgi_application()
+
+# โหลดโมเดล AI ล่วงหน้าเฉพาะ Web Worker ที่ต้องการ (ตั้ง RAG_WARMUP=1) เหมือนใน wsgi.py
+if os.environ.get('RAG_WARMUP', '0') == '1':
+    from plotcraft.rag_service import rag_service
+    rag_service.warmup()
@@ -94,6 +94,9 @@ DATABASES = {
     }
 }
 
+# MySQL ไม่รองรับ UniqueConstraint แบบมีเงื่อนไข (ChatSession แชททั่วไป) -> ข้ามไป ส่วน rag_memory.get_session รับมือแถวซ้ำเอง
+SILENCED_SYSTEM_CHECKS = ['models.W036']
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -151,3 +154,111 @@ LOGOUT_REDIRECT_URL = 'plotcraft:landing'
 # django-tailwind settings
 TAILWIND_APP_NAME = 'theme'
 TAILWIND_CSS_PATH = 'css/dist/styles.css'
+
+# ==================== RAG / AI ====================
+# คิว Index (RagOutbox) ที่ `manage.py rag_worker` ทยอยทำ
+RAG_WORKER_BATCH_SIZE = int(os.getenv('RAG_WORKER_BATCH_SIZE', '50'))
+RAG_WORKER_POLL_SECONDS = float(os.getenv('RAG_WORKER_POLL_SECONDS', '2'))
+RAG_WORKER_MAX_ATTEMPTS = int(os.getenv('RAG_WORKER_MAX_ATTEMPTS', '8'))
+RAG_WORKER_BACKOFF_SECONDS = int(os.getenv('RAG_WORKER_BACKOFF_SECONDS', '5'))
+RAG_WORKER_MAX_BACKOFF_SECONDS = int(os.getenv('RAG_WORKER_MAX_BACKOFF_SECONDS', '600'))
+# Debounce: รอให้หยุดแก้ (เช่น autosave) เงียบไปกี่วินาทีค่อย Embed และหน่วงได้นานสุดเท่าไหร่
+RAG_INDEX_QUIET_SECONDS = int(os.getenv('RAG_INDEX_QUIET_SECONDS', '30'))
+RAG_INDEX_MAX_DELAY_SECONDS = int(os.getenv('RAG_INDEX_MAX_DELAY_SECONDS', '300'))
+# ขนาดชิ้นเนื้อหา (token โดยประมาณ) ก่อน Embed — MiniLM รับได้ ~128 token ต่อชิ้น
+RAG_CHUNK_MAX_TOKENS = int(os.getenv('RAG_CHUNK_MAX_TOKENS', '110'))
+RAG_CHUNK_OVERLAP_TOKENS = int(os.getenv('RAG_CHUNK_OVERLAP_TOKENS', '20'))
+
+# Embedding Model + แคชเวกเตอร์ (SQLite ที่ทุก worker ใช้ร่วมกัน ตั้งค่าว่างเพื่อปิด)
+RAG_EMBEDDING_MODEL = os.getenv('RAG_EMBEDDING_MODEL', 'sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2')
+# Backend ของ Embedding: 'torch' (sentence-transformers) หรือ 'onnx' (ไฟล์จาก rag_export_onnx, int8 = เล็กและเร็วกว่า แต่ควร rag_reindex)
+RAG_EMBEDDING_BACKEND = os.getenv('RAG_EMBEDDING_BACKEND', 'torch')
+RAG_ONNX_MODEL_DIR = os.getenv('RAG_ONNX_MODEL_DIR', str(BASE_DIR / 'rag_cache' / 'onnx'))
+RAG_ONNX_INT8 = os.getenv('RAG_ONNX_INT8', '0') == '1'
+RAG_ONNX_THREADS = int(os.getenv('RAG_ONNX_THREADS', '0'))
+# Embedding Server กลาง (rag_embed_server): ตั้ง path ของ Unix socket แล้วทุก worker จะขอเวกเตอร์จากที่นั่นแทนโหลดโมเดลเอง
+RAG_EMBED_SERVER_SOCKET = os.getenv('RAG_EMBED_SERVER_SOCKET', '')
+RAG_EMBED_SERVER_TIMEOUT = float(os.getenv('RAG_EMBED_SERVER_TIMEOUT', '30'))
+RAG_EMBED_SERVER_MAX_BATCH = int(os.getenv('RAG_EMBED_SERVER_MAX_BATCH', '64'))
+RAG_EMBED_SERVER_MAX_WAIT_MS = float(os.getenv('RAG_EMBED_SERVER_MAX_WAIT_MS', '5'))
+RAG_EMBEDDING_CACHE_PATH = os.getenv('RAG_EMBEDDING_CACHE_PATH', str(BASE_DIR / 'rag_cache' / 'embeddings.sqlite3'))
+RAG_EMBEDDING_CACHE_MAX_MB = int(os.getenv('RAG_EMBEDDING_CACHE_MAX_MB', '256'))
+RAG_EMBEDDING_CACHE_LRU_SIZE = int(os.getenv('RAG_EMBEDDING_CACHE_LRU_SIZE', '2048'))
+
+# Vector Store: 'chroma' (ChromaDB ผ่าน HTTP) หรือ 'local' (NumPy + ไฟล์ในเครื่อง ไม่ต้องมี service แยก)
+RAG_VECTOR_BACKEND = os.getenv('RAG_VECTOR_BACKEND', 'chroma')
+RAG_LOCAL_STORE_PATH = os.getenv('RAG_LOCAL_STORE_PATH', str(BASE_DIR / 'rag_cache' / 'vectors'))
+
+# บริบทใน Prompt ของพี่บก.: ดึงตัวเลือกกี่ชิ้น, ใส่ได้กี่ท่อน, งบ token รวม, λ ของ MMR (1 = เน้นตรงคำถาม, 0 = เน้นหลากหลาย)
+RAG_CONTEXT_CANDIDATES = int(os.getenv('RAG_CONTEXT_CANDIDATES', '8'))
+RAG_CONTEXT_MAX_DOCS = int(os.getenv('RAG_CONTEXT_MAX_DOCS', '6'))
+RAG_CONTEXT_MAX_TOKENS = int(os.getenv('RAG_CONTEXT_MAX_TOKENS', '900'))
+RAG_CONTEXT_MMR_LAMBDA = float(os.getenv('RAG_CONTEXT_MMR_LAMBDA', '0.7'))
+RAG_CONTEXT_DEDUP_THRESHOLD = float(os.getenv('RAG_CONTEXT_DEDUP_THRESHOLD', '0.85'))
+
+# ดัชนีคำ BM25 (ค้นชื่อเฉพาะตรงตัว) รวมกับผล Vector ด้วย RRF — ตั้งค่า path ว่างเพื่อปิด
+RAG_LEXICAL_INDEX_PATH = os.getenv('RAG_LEXICAL_INDEX_PATH', str(BASE_DIR / 'rag_cache' / 'lexical.sqlite3'))
+RAG_LEXICAL_CANDIDATES = int(os.getenv('RAG_LEXICAL_CANDIDATES', '8'))
+RAG_RRF_K = int(os.getenv('RAG_RRF_K', '60'))
+
+# คำถามที่เอ่ยชื่อตัวละคร/สถานที่/ไอเทม: ค้นเพิ่มในตอน/ฉากที่เอ่ยถึงชื่อนั้น (บ่อยสุด) ไม่เกินกี่อัน (ดู rag_mentions)
+RAG_MENTION_MAX_SOURCES = int(os.getenv('RAG_MENTION_MAX_SOURCES', '20'))
+
+# จำนวน thread สำหรับงาน sync (Embed, Chroma, ORM) ที่ async view ของ AI ส่งไปทำ
+RAG_BLOCKING_WORKERS = int(os.getenv('RAG_BLOCKING_WORKERS', '8'))
+
+# deadline ต่อคำสั่ง (วินาที) + circuit breaker ของ Chroma และ Gemini (ดู rag_resilience)
+RAG_CHROMA_TIMEOUT = float(os.getenv('RAG_CHROMA_TIMEOUT', '5'))
+RAG_LLM_TIMEOUT = float(os.getenv('RAG_LLM_TIMEOUT', '60'))
+RAG_LLM_MAX_RETRIES = int(os.getenv('RAG_LLM_MAX_RETRIES', '1'))
+RAG_BREAKER_FAILURES = int(os.getenv('RAG_BREAKER_FAILURES', '5'))
+RAG_BREAKER_RESET_SECONDS = float(os.getenv('RAG_BREAKER_RESET_SECONDS', '30'))
+
+# กันคำขอ AI ล้น (ดู rag_limits): โควตาต่อผู้ใช้แบบ token bucket + จำนวนที่ทำพร้อมกันทั้งระบบ + คิวรอสั้นๆ
+RAG_AI_USER_BURST = int(os.getenv('RAG_AI_USER_BURST', '5'))
+RAG_AI_USER_RATE_PER_MINUTE = float(os.getenv('RAG_AI_USER_RATE_PER_MINUTE', '12'))
+RAG_AI_MAX_CONCURRENCY = int(os.getenv('RAG_AI_MAX_CONCURRENCY', '16'))
+RAG_AI_QUEUE_SIZE = int(os.getenv('RAG_AI_QUEUE_SIZE', '32'))
+RAG_AI_QUEUE_WAIT_SECONDS = float(os.getenv('RAG_AI_QUEUE_WAIT_SECONDS', '3'))
+RAG_AI_SLOT_LEASE_SECONDS = int(os.getenv('RAG_AI_SLOT_LEASE_SECONDS', '300'))
+
+# ความจำแชทพี่บก. (ดู rag_memory): turn ล่าสุดใส่ Prompt เต็มๆ ที่เก่ากว่านั้นย่อรวมเป็นสรุปเมื่อเกิน trigger
+RAG_CHAT_RECENT_TURNS = int(os.getenv('RAG_CHAT_RECENT_TURNS', '6'))
+RAG_CHAT_TURN_MAX_TOKENS = int(os.getenv('RAG_CHAT_TURN_MAX_TOKENS', '400'))
+RAG_CHAT_SUMMARY_TRIGGER_TOKENS = int(os.getenv('RAG_CHAT_SUMMARY_TRIGGER_TOKENS', '600'))
+RAG_CHAT_SUMMARY_MAX_TOKENS = int(os.getenv('RAG_CHAT_SUMMARY_MAX_TOKENS', '300'))
+
+# คัมภีร์นิยาย (ดู rag_bible): บริบทหลักที่ประกอบไว้ใน DB ให้พี่บก./ร่างฉาก อ่านแถวเดียว
+RAG_BIBLE_MAX_TOKENS = int(os.getenv('RAG_BIBLE_MAX_TOKENS', '450'))
+RAG_BIBLE_MAX_CHARACTERS = int(os.getenv('RAG_BIBLE_MAX_CHARACTERS', '8'))
+RAG_BIBLE_MAX_LOCATIONS = int(os.getenv('RAG_BIBLE_MAX_LOCATIONS', '5'))
+RAG_BIBLE_RECENT_CHAPTERS = int(os.getenv('RAG_BIBLE_RECENT_CHAPTERS', '3'))
+
+# สรุปเนื้อเรื่องเป็นชั้น (ดู rag_summaries): ตอน -> ช่วงละ N ตอน -> ทั้งเรื่อง (token โดยประมาณต่อสรุป)
+RAG_SUMMARY_CHAPTER_TOKENS = int(os.getenv('RAG_SUMMARY_CHAPTER_TOKENS', '120'))
+RAG_SUMMARY_ARC_CHAPTERS = int(os.getenv('RAG_SUMMARY_ARC_CHAPTERS', '10'))
+RAG_SUMMARY_ARC_TOKENS = int(os.getenv('RAG_SUMMARY_ARC_TOKENS', '200'))
+RAG_SUMMARY_NOVEL_TOKENS = int(os.getenv('RAG_SUMMARY_NOVEL_TOKENS', '300'))
+# จำนวนตอนสูงสุดที่สรุปต่องานคิวหนึ่งงาน (ที่เหลือลงคิวต่อ)
+RAG_SUMMARY_BATCH = int(os.getenv('RAG_SUMMARY_BATCH', '20'))
+
+# /metrics (Prometheus): แต่ละ process เขียนตัวเลขลงโฟลเดอร์นี้ให้ /metrics รวมกัน (ว่าง = เห็นแค่ process ที่ตอบ)
+RAG_METRICS_DIR = os.getenv('RAG_METRICS_DIR', str(BASE_DIR / 'rag_cache' / 'metrics'))
+# ให้ Prometheus ส่ง Authorization: Bearer <token> (ว่าง = staff ที่ login เท่านั้น)
+RAG_METRICS_TOKEN = os.getenv('RAG_METRICS_TOKEN', '')
+
+# แคชผลค้นหาบริบทของพี่บก. (ไฟล์ ใช้ร่วมกันทุก worker) หมดอายุเองเมื่อนิยายถูก Index ใหม่
+RAG_RETRIEVAL_CACHE_TTL = int(os.getenv('RAG_RETRIEVAL_CACHE_TTL', '600'))
+# แคชผลงานเจน (ร่างฉาก, JSON ตัวละคร) ไว้สั้นๆ กันกดซ้ำแล้วเสียค่า LLM ซ้ำ
+RAG_GENERATION_CACHE_TTL = int(os.getenv('RAG_GENERATION_CACHE_TTL', '300'))
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'rag': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.getenv('RAG_RETRIEVAL_CACHE_PATH', str(BASE_DIR / 'rag_cache' / 'retrieval')),
+        'TIMEOUT': RAG_RETRIEVAL_CACHE_TTL,
+        'OPTIONS': {'MAX_ENTRIES': 5000},
+    },
+}
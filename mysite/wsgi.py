@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mysite.settings')
 
 application = get_wsgi_application()
+
+# โหลดโมเดล AI ล่วงหน้าเฉพาะ Web Worker ที่ต้องการ (ตั้ง RAG_WARMUP=1) งานอย่าง migrate จะไม่โดนโหลดด้วย
+if os.environ.get('RAG_WARMUP', '0') == '1':
+    from plotcraft.rag_service import rag_service
+    rag_service.warmup()
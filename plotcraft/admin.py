@@ -3,7 +3,7 @@ from django.contrib.auth.admin import UserAdmin
 from django.utils.html import format_html
 from .models import (
     User, Profile, Novel, Chapter, Character, Location, Item,
-    Scene, Timeline, TimelineEvent, Bookmark
+    Scene, Timeline, TimelineEvent, Bookmark, RagOutbox
 )
 
 # ============================================
@@ -114,4 +114,12 @@ class ProfileAdmin(admin.ModelAdmin):
     # แก้ไข: ตัด pen_name และ created_at ออก (ตาม Error Log)
     # Profile มักจะลิงก์กับ User โดยตรง ให้โชว์แค่ User ก็พอ
     list_display = ('user',) 
-    search_fields = ('user__username', 'user__email')
\ No newline at end of file
+    search_fields = ('user__username', 'user__email')
+
+
+@admin.register(RagOutbox)
+class RagOutboxAdmin(admin.ModelAdmin):
+    list_display = ('model_name', 'object_id', 'op', 'attempts', 'available_at', 'updated_at')
+    list_filter = ('model_name', 'op')
+    search_fields = ('object_id', 'last_error')
+    readonly_fields = ('created_at', 'updated_at')
@@ -0,0 +1,173 @@
+import json
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from plotcraft.rag_bench import run_benchmark
+
+
+# ค่าที่ใช้เทียบกับ --baseline: (path ในผล JSON, ยิ่งมากยิ่งดีไหม)
+HEADLINES = [
+    ("indexing.docs_per_second", True),
+    ("indexing.reindex_unchanged_seconds", False),
+    ("retrieval.latency_ms.p50", False),
+    ("retrieval.latency_ms.p95", False),
+    ("retrieval.latency_ms.p99", False),
+    ("prompt.tokens.p50", False),
+    ("prompt.tokens.max", False),
+    ("prompt.build_ms.p95", False),
+]
+
+# settings ที่มีผลกับตัวเลข (บันทึกไว้ในผล จะได้รู้ว่าเทียบกันได้ไหม)
+SETTINGS = [
+    'RAG_CHUNK_MAX_TOKENS', 'RAG_CHUNK_OVERLAP_TOKENS', 'RAG_CONTEXT_MAX_TOKENS', 'RAG_CONTEXT_MAX_DOCS',
+    'RAG_CONTEXT_CANDIDATES', 'RAG_LEXICAL_CANDIDATES', 'RAG_MENTION_MAX_SOURCES', 'RAG_BIBLE_MAX_TOKENS',
+]
+
+
+def _lookup(result, path):
+    for key in path.split('.'):
+        if not isinstance(result, dict) or key not in result:
+            return None
+        result = result[key]
+    return result
+
+
+def _commit():
+    try:
+        proc = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                              capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return proc.stdout.strip() or None
+
+
+class Command(BaseCommand):
+    help = (
+        "วัดประสิทธิภาพ RAG แบบออฟไลน์ด้วยนิยายสังเคราะห์ + Embedding/LLM ปลอม "
+        "(Index throughput, latency การค้นบริบท, ขนาด Prompt, recall@k) ข้อมูลที่สร้างใน DB ถูก rollback ตอนจบ"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2, help="จำนวนผู้ใช้")
+        parser.add_argument('--novels', type=int, default=2, help="จำนวนนิยายต่อผู้ใช้")
+        parser.add_argument('--chapters', type=int, default=30, help="จำนวนตอนต่อนิยาย")
+        parser.add_argument('--characters', type=int, default=8, help="จำนวนตัวละครต่อนิยาย")
+        parser.add_argument('--chapter-chars', type=int, default=6000, help="ความยาวเฉลี่ยของตอน (ตัวอักษร)")
+        parser.add_argument('--questions', type=int, default=40, help="จำนวนคำถามที่รู้คำตอบ")
+        parser.add_argument('--k', default='1,3,6', help="ค่า k ของ recall@k คั่นด้วย ,")
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--dim', type=int, default=384, help="จำนวนมิติของ HashingEmbeddings")
+        parser.add_argument('--llm-latency-ms', type=float, default=0, help="เวลาที่ FakeLLM หน่วงต่อการเรียก")
+        parser.add_argument('--no-lexical', action='store_true', help="ปิดดัชนีคำ (BM25) วัด Vector อย่างเดียว")
+        parser.add_argument('--summaries', action='store_true', help="วัดการสรุปตอน/ช่วง/ทั้งเรื่องด้วย (ใช้ FakeLLM)")
+        parser.add_argument('--json', action='store_true', help="พิมพ์ผลเป็น JSON")
+        parser.add_argument('--output', help="บันทึกผล JSON ลงไฟล์นี้ด้วย")
+        parser.add_argument('--baseline', help="ไฟล์ JSON จากรอบก่อน (เช่น commit ก่อนหน้า) ไว้เทียบค่าหลัก")
+        parser.add_argument('--verbose-service', action='store_true', help="แสดง log ของ RAGService ทาง stderr")
+
+    def handle(self, *args, **options):
+        try:
+            ks = sorted({int(k) for k in options['k'].split(',') if k.strip()})
+        except ValueError:
+            raise CommandError("--k ต้องเป็นตัวเลขคั่นด้วย , เช่น 1,3,6")
+        if min(options['users'], options['novels'], options['chapters'], options['characters']) < 1 or not ks:
+            raise CommandError("--users, --novels, --chapters, --characters และ --k ต้องมีอย่างน้อย 1")
+
+        baseline = None
+        if options['baseline']:
+            try:
+                with open(options['baseline'], encoding='utf-8') as f:
+                    baseline = json.load(f)
+            except (OSError, ValueError) as e:
+                raise CommandError(f"อ่าน baseline ไม่ได้: {e}")
+
+        params = {
+            'users': options['users'], 'novels': options['novels'], 'chapters': options['chapters'],
+            'characters': options['characters'], 'chapter_chars': options['chapter_chars'],
+            'questions': options['questions'], 'seed': options['seed'], 'ks': ks, 'dim': options['dim'],
+            'llm_latency_ms': options['llm_latency_ms'], 'lexical': not options['no_lexical'],
+            'summaries': options['summaries'],
+        }
+        self.stderr.write(f"⏱️ Benchmarking RAG: {options['users']} users x {options['novels']} novels x "
+                          f"{options['chapters']} chapters, {options['questions']} questions ...")
+        result = run_benchmark(
+            users=params['users'], novels=params['novels'], chapters=params['chapters'],
+            characters=params['characters'], chapter_chars=params['chapter_chars'], questions=params['questions'],
+            seed=params['seed'], ks=ks, dim=params['dim'], llm_latency=params['llm_latency_ms'] / 1000,
+            lexical=params['lexical'], summaries=params['summaries'],
+            log=sys.stderr if options['verbose_service'] else None,
+        )
+        report = {
+            'meta': {
+                'commit': _commit(),
+                'created_at': timezone.now().isoformat(),
+                'params': params,
+                'settings': {name: getattr(settings, name, None) for name in SETTINGS},
+            },
+            **result,
+        }
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+            self.stderr.write(f"💾 Saved: {options['output']}")
+
+        if options['json']:
+            self.stdout.write(json.dumps(report, indent=2, ensure_ascii=False))
+        else:
+            self._print_report(report, ks)
+        if baseline is not None:
+            self._print_comparison(baseline, report, ks, self.stderr if options['json'] else self.stdout)
+
+    def _print_report(self, r, ks):
+        corpus, indexing, retrieval, prompt = r['corpus'], r['indexing'], r['retrieval'], r['prompt']
+        self.stdout.write(
+            f"📚 Corpus: {corpus['novels']} novels, {corpus['chapters']} chapters "
+            f"(~{corpus['chapter_chars_mean']:.0f} chars each), {corpus['characters']} characters, "
+            f"{corpus['questions']} questions"
+        )
+        self.stdout.write(
+            f"📥 Indexing: {indexing['docs']} docs in {indexing['seconds']:.2f}s "
+            f"({indexing['docs_per_second']:.1f} docs/s), unchanged re-index {indexing['reindex_unchanged_seconds']:.2f}s, "
+            f"mentions {indexing['mentions_seconds']:.2f}s, bible {indexing['bible_seconds']:.2f}s"
+        )
+        if 'summaries_seconds' in indexing:
+            self.stdout.write(f"📝 Summaries: {indexing['summaries_seconds']:.2f}s, "
+                              f"{indexing['summaries_llm_calls']} LLM calls")
+
+        latency = retrieval['latency_ms']
+        self.stdout.write(
+            f"🔎 Retrieval ms: p50 {latency['p50']:.2f}  p95 {latency['p95']:.2f}  p99 {latency['p99']:.2f}  "
+            f"(scoped by mentions: {retrieval['mention_scoped']}/{corpus['questions']})"
+        )
+        self.stdout.write("   " + "  ".join(f"{name} {ms:.2f}" for name, ms in retrieval['stages_ms'].items()))
+        self.stdout.write(
+            f"🧾 Prompt tokens: p50 {prompt['tokens']['p50']:.0f}  p95 {prompt['tokens']['p95']:.0f}  "
+            f"max {prompt['tokens']['max']:.0f}  (context p50 {prompt['context_tokens']['p50']:.0f})"
+        )
+        self.stdout.write(f"🤖 LLM ms: p50 {r['llm']['latency_ms']['p50']:.2f}  p95 {r['llm']['latency_ms']['p95']:.2f}")
+
+        recall = r['recall']
+        self.stdout.write("🎯 Recall: " + "  ".join(f"@{k} {recall[f'at_{k}']:.2f}" for k in ks))
+        for kind, row in recall['by_kind'].items():
+            self.stdout.write(f"   {kind:<10} ({row['questions']:>3}) " +
+                              "  ".join(f"@{k} {row[f'at_{k}']:.2f}" for k in ks))
+
+    def _print_comparison(self, baseline, report, ks, out):
+        commit = (baseline.get('meta') or {}).get('commit') or '?'
+        if (baseline.get('meta') or {}).get('params') != report['meta']['params']:
+            out.write(self.style.WARNING("⚠️ Baseline ใช้พารามิเตอร์ต่างกัน ตัวเลขอาจเทียบกันตรงๆ ไม่ได้"))
+
+        out.write(f"{'metric':<38} {'base ' + commit:>14} {'now':>10} {'change':>8}")
+        for path, higher_is_better in HEADLINES + [(f"recall.at_{k}", True) for k in ks]:
+            before, after = _lookup(baseline, path), _lookup(report, path)
+            if not isinstance(before, (int, float)) or not isinstance(after, (int, float)):
+                continue
+            change = (after - before) / before * 100 if before else 0.0
+            line = f"{path:<38} {before:>14.2f} {after:>10.2f} {change:>+7.1f}%"
+            worse = change < 0 if higher_is_better else change > 0
+            out.write(self.style.ERROR(line) if worse and abs(change) >= 10 else line)
@@ -0,0 +1,122 @@
+import json
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from plotcraft.rag_service import load_embedding_model
+
+
+# ชื่อที่ใช้ใน --backends -> (RAG_EMBEDDING_BACKEND, RAG_ONNX_INT8)
+BACKENDS = {
+    'torch': ('torch', '0'),
+    'onnx': ('onnx', '0'),
+    'onnx-int8': ('onnx', '1'),
+}
+
+FRAGMENTS = [
+    "มิราชักดาบออกจากฝัก", "หมอกลงจัดเหนือตลาดน้ำ", "เสียงระฆังดังมาจากวัดริมคลอง", "เขาไม่เคยเล่าเรื่องคืนนั้นให้ใครฟัง",
+    "จดหมายฉบับสุดท้ายถูกเผาทิ้ง", "ประตูเมืองปิดลงก่อนพระอาทิตย์ตก", "นางเอกตัดสินใจออกเดินทางคนเดียว",
+    "แผนที่เก่าชี้ไปยังเกาะที่ไม่มีใครรู้จัก", "พ่อค้าเร่ยิ้มอย่างมีเลศนัย", "ฝนตกหนักตลอดทั้งคืน",
+]
+
+
+def _rss_mb():
+    # ru_maxrss บน Linux เป็น KB (ค่าสูงสุดของ process นี้)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _texts(count, words, seed):
+    rng = random.Random(seed)
+    return [" ".join(rng.choice(FRAGMENTS) for _ in range(rng.randint(*words))) for _ in range(count)]
+
+
+class Command(BaseCommand):
+    help = "เทียบความเร็ว/หน่วยความจำของ Embedding Backend (ต่อคำถาม, ต่อชุด, RSS) แต่ละตัวรันใน process แยก"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--backends', default=','.join(BACKENDS), help=f"คั่นด้วย , (มี: {', '.join(BACKENDS)})")
+        parser.add_argument('--queries', type=int, default=100, help="จำนวนคำถาม (embed_query ทีละข้อ)")
+        parser.add_argument('--docs', type=int, default=512, help="จำนวนเอกสารสำหรับวัด throughput")
+        parser.add_argument('--batch', type=int, default=64, help="ขนาดชุดของ embed_documents")
+        parser.add_argument('--json', action='store_true', help="พิมพ์ผลเป็น JSON")
+        parser.add_argument('--child', help="(ใช้ภายใน) วัด backend นี้ใน process ปัจจุบันแล้วพิมพ์ JSON")
+
+    def handle(self, *args, **options):
+        if options['child']:
+            self.stdout.write(json.dumps(self._measure(options)))
+            return
+
+        names = [name.strip() for name in options['backends'].split(',') if name.strip()]
+        unknown = set(names) - set(BACKENDS)
+        if unknown:
+            raise CommandError(f"ไม่รู้จัก backend: {', '.join(sorted(unknown))}")
+
+        results = [self._run_child(name, options) for name in names]
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+
+        self.stdout.write(f"{'backend':<10} {'load s':>7} {'p50 ms':>8} {'p95 ms':>8} {'docs/s':>8} {'RSS MB':>8}")
+        for r in results:
+            if 'error' in r:
+                self.stdout.write(self.style.ERROR(f"{r['backend']:<10} ❌ {r['error']}"))
+                continue
+            self.stdout.write(
+                f"{r['backend']:<10} {r['load_seconds']:>7.2f} {r['query_p50_ms']:>8.2f} {r['query_p95_ms']:>8.2f} "
+                f"{r['docs_per_second']:>8.1f} {r['rss_mb']:>8.0f}"
+            )
+
+    def _run_child(self, name, options):
+        """ process ใหม่ต่อ backend: RSS ไม่ปนกัน และ import torch ของตัวหนึ่งไม่ถูกนับให้อีกตัว """
+        backend, int8 = BACKENDS[name]
+        env = dict(os.environ, RAG_EMBEDDING_BACKEND=backend, RAG_ONNX_INT8=int8)
+        command = [
+            sys.executable, os.path.join(settings.BASE_DIR, 'manage.py'), 'rag_embed_bench', '--child', name,
+            '--queries', str(options['queries']), '--docs', str(options['docs']), '--batch', str(options['batch']),
+        ]
+        self.stderr.write(f"⏱️ Benchmarking {name} ...")
+        proc = subprocess.run(command, env=env, capture_output=True, text=True)
+        if proc.returncode != 0:
+            return {'backend': name, 'error': (proc.stderr.strip().splitlines() or ['failed'])[-1]}
+        return json.loads(proc.stdout.strip().splitlines()[-1])
+
+    def _measure(self, options):
+        rss_before = _rss_mb()
+        started = time.perf_counter()
+        model, _ = load_embedding_model()
+        load_seconds = time.perf_counter() - started
+
+        queries = _texts(options['queries'], (1, 3), seed=1)
+        docs = _texts(options['docs'], (4, 12), seed=2)
+
+        # warm-up (graph optimization / lazy init ครั้งแรก ไม่นับ)
+        model.embed_documents(queries[:4])
+
+        latencies = []
+        for query in queries:
+            started = time.perf_counter()
+            model.embed_query(query)
+            latencies.append((time.perf_counter() - started) * 1000)
+        latencies.sort()
+
+        started = time.perf_counter()
+        for start in range(0, len(docs), options['batch']):
+            model.embed_documents(docs[start:start + options['batch']])
+        batch_seconds = time.perf_counter() - started
+
+        return {
+            'backend': options['child'],
+            'load_seconds': load_seconds,
+            'query_p50_ms': statistics.median(latencies),
+            'query_p95_ms': latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+            'docs_per_second': len(docs) / batch_seconds,
+            'rss_mb': _rss_mb(),
+            'rss_model_mb': _rss_mb() - rss_before,
+        }
@@ -0,0 +1,39 @@
+import asyncio
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from plotcraft.rag_embed_server import EmbeddingServer, report_stats
+from plotcraft.rag_service import load_embedding_model
+
+
+class Command(BaseCommand):
+    help = "Embedding Server กลาง (Unix socket): โหลดโมเดลครั้งเดียวให้ทุก worker ใช้ร่วมกัน พร้อมรวมคำขอเป็น micro-batch"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=getattr(settings, 'RAG_EMBED_SERVER_SOCKET', ''),
+                            help="path ของ Unix socket (ค่าเริ่มต้น: RAG_EMBED_SERVER_SOCKET)")
+        parser.add_argument('--max-batch', type=int, default=getattr(settings, 'RAG_EMBED_SERVER_MAX_BATCH', 64),
+                            help="จำนวนข้อความสูงสุดต่อการ Embed หนึ่งครั้ง")
+        parser.add_argument('--max-wait-ms', type=float, default=getattr(settings, 'RAG_EMBED_SERVER_MAX_WAIT_MS', 5),
+                            help="รอรวมคำขอได้นานสุดกี่มิลลิวินาทีหลังคำขอแรกของชุด")
+        parser.add_argument('--stats-interval', type=int, default=60, help="พิมพ์สถิติทุกกี่วินาที (0 = ปิด)")
+
+    def handle(self, *args, **options):
+        if not options['socket']:
+            raise CommandError("ต้องระบุ --socket หรือตั้ง RAG_EMBED_SERVER_SOCKET")
+
+        # โหลดโมเดลจริงใน process นี้ (ไม่ผ่าน RAGService ที่จะกลายเป็น client ของตัวเอง)
+        model, _ = load_embedding_model()
+        server = EmbeddingServer(model, options['socket'], options['max_batch'], options['max_wait_ms'])
+
+        if options['stats_interval']:
+            threading.Thread(target=report_stats, args=(server, options['stats_interval']), daemon=True).start()
+
+        self.stdout.write(f"🧠 Embedding server listening on {options['socket']} "
+                          f"(batch ≤ {options['max_batch']}, wait ≤ {options['max_wait_ms']} ms)")
+        try:
+            asyncio.run(server.serve())
+        except KeyboardInterrupt:
+            self.stdout.write("👋 Embedding server stopped")
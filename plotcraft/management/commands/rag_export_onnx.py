@@ -0,0 +1,50 @@
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from plotcraft.rag_onnx import OnnxEmbeddings, export_onnx
+from plotcraft.rag_service import load_embedding_model
+
+
+# ประโยคตัวอย่างสำหรับเทียบเวกเตอร์กับโมเดลเดิม (ไทย/อังกฤษ/ยาว/สั้น)
+VERIFY_TEXTS = [
+    "ชื่อ: มิรา อาชีพ: นักดาบ นิสัย: ใจร้อนแต่ซื่อสัตย์",
+    "ฉาก: ตลาดน้ำยามเช้า หมอกลงจัด เสียงพายเรือกระทบน้ำ",
+    "เขาก้าวเข้าไปในห้องสมุดเก่า ฝุ่นลอยคลุ้งในแสงที่ลอดผ่านหน้าต่าง และหนังสือเล่มนั้นก็ยังวางอยู่ที่เดิม",
+    "พี่บก. ช่วยดูหน่อยว่าตัวละครนี้มีแรงจูงใจพอไหม",
+    "The old lighthouse keeper never spoke about the night of the storm.",
+    "ดาบ",
+]
+
+
+class Command(BaseCommand):
+    help = "Export Embedding Model เป็น ONNX (และ int8) สำหรับ RAG_EMBEDDING_BACKEND=onnx"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output', default=settings.RAG_ONNX_MODEL_DIR, help="โฟลเดอร์ปลายทาง")
+        parser.add_argument('--int8', action='store_true', help="ทำ dynamic int8 quantization เพิ่ม (model_int8.onnx)")
+        parser.add_argument('--verify', action='store_true', help="เทียบ cosine กับ backend torch เดิมหลัง export")
+
+    def handle(self, *args, **options):
+        model_name = settings.RAG_EMBEDDING_MODEL
+        self.stdout.write(f"📦 Exporting {model_name} -> {options['output']} ...")
+        path = export_onnx(model_name, options['output'], int8=options['int8'])
+        self.stdout.write(self.style.SUCCESS(f"✅ Saved {path}"))
+
+        if options['verify']:
+            self._verify(options['output'], options['int8'])
+
+    def _verify(self, model_dir, int8):
+        """ cosine ระหว่างเวกเตอร์ ONNX กับ torch: ≈1.0 = ใช้กับเวกเตอร์ที่เก็บไว้แล้วได้, ต่ำกว่า ~0.99 = ควร rag_reindex """
+        reference, _ = load_embedding_model("torch")
+        expected = np.array(reference.embed_documents(VERIFY_TEXTS))
+        actual = np.array(OnnxEmbeddings(model_dir, int8=int8).embed_documents(VERIFY_TEXTS))
+
+        cosine = (expected * actual).sum(axis=1) / (
+            np.linalg.norm(expected, axis=1) * np.linalg.norm(actual, axis=1)
+        )
+        line = f"🔍 cosine vs torch: min {cosine.min():.5f}, mean {cosine.mean():.5f}"
+        if cosine.min() < 0.99:
+            self.stdout.write(self.style.WARNING(f"{line} — run rag_reindex after switching backends"))
+        else:
+            self.stdout.write(self.style.SUCCESS(f"{line} — compatible with stored vectors"))
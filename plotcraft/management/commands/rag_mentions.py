@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from plotcraft.models import Novel
+from plotcraft.rag_mentions import rebuild_novel
+
+
+class Command(BaseCommand):
+    help = "สร้างดัชนีการเอ่ยชื่อ (ตัวละคร/สถานที่/ไอเทม ในตอนและฉาก) ใหม่ทั้งนิยาย"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--novel', type=int, help="เฉพาะนิยาย id นี้")
+        parser.add_argument('--user', type=int, help="เฉพาะนิยายของ User id นี้")
+
+    def handle(self, *args, **options):
+        novels = Novel.objects.order_by('pk')
+        if options['novel']:
+            novels = novels.filter(pk=options['novel'])
+        if options['user']:
+            novels = novels.filter(author=options['user'])
+
+        total = 0
+        for novel in novels.iterator():
+            count = rebuild_novel(novel)
+            total += count
+            self.stdout.write(f"🏷️ {novel.title}: scanned {count} chapters/scenes")
+        self.stdout.write(self.style.SUCCESS(f"🏁 Done — {total} documents scanned"))
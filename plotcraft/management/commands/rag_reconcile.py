@@ -0,0 +1,160 @@
+from collections import Counter
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from plotcraft.management.commands.rag_reindex import REINDEX_TYPES
+from plotcraft.models import RagDocument
+from plotcraft.rag_service import rag_service, record_documents, forget_documents, content_fingerprint
+
+
+class Command(BaseCommand):
+    help = ("ตรวจว่า Vector Store / ดัชนีคำ ตรงกับข้อมูลใน DB ไหม (ทีละเจ้าของ) แล้วซ่อมเฉพาะส่วนที่ต่าง "
+            "— Embed ใหม่แค่เอกสารที่หายหรือเนื้อหาเปลี่ยน")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help="เฉพาะข้อมูลของ User id นี้")
+        parser.add_argument('--novel', type=int, help="เฉพาะนิยาย id นี้")
+        parser.add_argument('--batch', type=int, default=128, help="จำนวนเอกสารต่อการซ่อมหนึ่งครั้ง (Embed/upsert/delete)")
+        parser.add_argument('--page', type=int, default=1000, help="จำนวน id ต่อการอ่านจาก Vector Store หนึ่งครั้ง")
+        parser.add_argument('--dry-run', action='store_true', help="รายงานอย่างเดียว ไม่แก้อะไร")
+
+    def handle(self, *args, **options):
+        self.service = rag_service
+        self.options = options
+        if self.service.collection is None:
+            raise CommandError("เชื่อมต่อ Vector Store ไม่ได้")
+
+        totals = Counter()
+        for owner_id in self._owners(options):
+            counts = self._reconcile_owner(owner_id, options['novel'])
+            totals.update(counts)
+
+        summary = ", ".join(f"{key} {value}" for key, value in sorted(totals.items())) or "nothing to do"
+        prefix = "🔎 Dry run" if options['dry_run'] else "🏁 Reconciled"
+        self.stdout.write(self.style.SUCCESS(f"{prefix}: {summary}"))
+
+    def _owners(self, options):
+        """ เจ้าของทุกคนที่ควรมีหรือเคยมีเอกสาร (รวม owner ที่ถูกลบไปแล้วแต่ยังมีแถวค้างใน RagDocument) """
+        if options['user']:
+            return [str(options['user'])]
+        owners = {str(pk) for pk in get_user_model().objects.values_list('pk', flat=True)}
+        owners |= set(RagDocument.objects.values_list('owner_id', flat=True).distinct())
+        return sorted(owner for owner in owners if owner)
+
+    # ==================== สามฝั่งของหนึ่งเจ้าของ ====================
+
+    def _expected(self, owner_id, novel_id):
+        """ เอกสารที่ DB บอกว่าควรมี {doc_id: (fingerprint, doc)} — สร้างข้อความใหม่ แต่ไม่ Embed """
+        expected = {}
+        if not owner_id.isdigit():
+            return expected
+        for type_name, (model, builder, owner_field, novel_field, related, prefetch) in REINDEX_TYPES.items():
+            queryset = model.objects.filter(**{owner_field: owner_id}).select_related(*related).prefetch_related(*prefetch)
+            if type_name == 'chapter':
+                queryset = queryset.exclude(content='')
+            if novel_id:
+                queryset = queryset.filter(**{novel_field: novel_id})
+            for obj in queryset.iterator(chunk_size=500):
+                _, docs = getattr(self.service, builder)(obj)
+                for doc in docs:
+                    expected[doc[0]] = (content_fingerprint(doc[1], doc[2]), doc)
+        return expected
+
+    def _stored(self, owner_id, novel_id):
+        """ id ที่อยู่ใน Vector Store จริง {doc_id: novel_id} (อ่านทีละหน้า ไม่ดึงเวกเตอร์/ข้อความ) """
+        where = {"owner_id": owner_id}
+        if novel_id:
+            where = {"$and": [where, {"novel_id": str(novel_id)}]}
+        stored, offset = {}, 0
+        while True:
+            page = self.service.collection.get(where=where, limit=self.options['page'], offset=offset,
+                                               include=["metadatas"])
+            for doc_id, metadata in zip(page['ids'], page['metadatas']):
+                stored[doc_id] = (metadata or {}).get("novel_id", "")
+            if len(page['ids']) < self.options['page']:
+                return stored
+            offset += self.options['page']
+
+    def _reconcile_owner(self, owner_id, novel_id):
+        expected = self._expected(owner_id, novel_id)
+        stored = self._stored(owner_id, novel_id)
+        registry_rows = RagDocument.objects.filter(owner_id=owner_id)
+        if novel_id:
+            registry_rows = registry_rows.filter(novel_id=str(novel_id))
+        registry = dict(registry_rows.values_list('doc_id', 'fingerprint'))
+
+        # ไม่มีใน Store = ต้อง Embed ใหม่ / มีแต่ fingerprint ไม่ตรง = เนื้อหาเปลี่ยนไปแล้วแต่ Store ยังเก่า
+        missing = [doc for doc_id, (_, doc) in expected.items() if doc_id not in stored]
+        stale = [doc for doc_id, (fingerprint, doc) in expected.items()
+                 if doc_id in stored and registry.get(doc_id) != fingerprint]
+        orphans = [doc_id for doc_id in stored if doc_id not in expected]
+        ghosts = [doc_id for doc_id in registry if doc_id not in expected and doc_id not in stored]
+
+        # ดัชนีคำ: นับเฉพาะที่การซ่อม Vector Store ข้างบนไม่ได้แก้ให้อยู่แล้ว
+        lexical = self.service.lexical
+        lexical_missing, lexical_orphans = [], []
+        if lexical:
+            indexed = lexical.doc_ids(owner_id, novel_id)
+            rewritten = {doc[0] for doc in missing + stale}
+            lexical_missing = [doc for doc_id, (_, doc) in expected.items()
+                               if doc_id not in indexed and doc_id not in rewritten]
+            lexical_orphans = [doc_id for doc_id in indexed if doc_id not in expected and doc_id not in stored]
+
+        counts = Counter({
+            'missing': len(missing), 'stale': len(stale), 'orphans': len(orphans), 'ghost_rows': len(ghosts),
+            'lexical_missing': len(lexical_missing), 'lexical_orphans': len(lexical_orphans),
+        })
+        counts = +counts   # ตัดตัวที่เป็น 0 ทิ้ง
+        if not counts:
+            return counts
+
+        self._report(owner_id, expected, stored, missing, stale, orphans, counts)
+        if self.options['dry_run']:
+            return counts
+
+        batch = self.options['batch']
+        for start in range(0, len(missing) + len(stale), batch):
+            self._upsert((missing + stale)[start:start + batch])
+        for start in range(0, len(orphans), batch):
+            self._delete(orphans[start:start + batch])
+        if ghosts:
+            forget_documents(RagDocument.objects.filter(doc_id__in=ghosts))
+        if lexical_missing:
+            lexical.upsert(lexical_missing)   # ข้อความมีอยู่แล้ว ไม่ต้อง Embed
+        if lexical_orphans:
+            lexical.delete(ids=lexical_orphans)
+        return counts
+
+    def _report(self, owner_id, expected, stored, missing, stale, orphans, counts):
+        """ สรุปต่อเจ้าของ แยกตามนิยาย """
+        per_novel = Counter()
+        for _, _, metadata in missing + stale:
+            per_novel[metadata.get("novel_id", "")] += 1
+        for doc_id in orphans:
+            per_novel[stored[doc_id]] += 1
+        novels = ", ".join(f"novel {novel or '-'}: {n}" for novel, n in per_novel.most_common(5))
+        detail = ", ".join(f"{key} {value}" for key, value in sorted(counts.items()))
+        self.stdout.write(f"👤 owner {owner_id} ({len(expected)} expected, {len(stored)} stored) — {detail}"
+                          + (f" [{novels}]" if novels else ""))
+
+    # ==================== ซ่อม ====================
+
+    def _upsert(self, docs):
+        """ Embed + เขียนลง Store ทีละชุด (ผ่านแคช Embedding: ข้อความเดิมไม่ต้องรันโมเดลซ้ำ) """
+        vectors = self.service.embeddings.embed_documents([content for _, content, _ in docs])
+        self.service.collection.upsert(
+            ids=[doc_id for doc_id, _, _ in docs],
+            documents=[content for _, content, _ in docs],
+            embeddings=vectors,
+            metadatas=[metadata for _, _, metadata in docs],
+        )
+        if self.service.lexical:
+            self.service.lexical.upsert(docs)
+        record_documents(docs)
+
+    def _delete(self, ids):
+        self.service.collection.delete(ids=ids)
+        if self.service.lexical:
+            self.service.lexical.delete(ids=ids)
+        forget_documents(RagDocument.objects.filter(doc_id__in=ids))
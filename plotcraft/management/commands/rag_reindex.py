@@ -0,0 +1,183 @@
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from plotcraft.models import Novel, Character, Chapter, Scene, StorySummary, RagDocument
+from plotcraft.rag_service import rag_service, record_documents, forget_documents, source_q, content_fingerprint
+
+
+# type -> (Model, builder ใน rag_service, field เจ้าของ, field นิยาย, select_related, prefetch_related)
+REINDEX_TYPES = {
+    'novel': (Novel, 'build_novel_documents', 'author', 'pk', ('author',), ()),
+    'character': (Character, 'build_character_documents', 'created_by', 'project', (), ()),
+    'chapter': (Chapter, 'build_chapter_documents', 'novel__author', 'novel', ('novel',), ()),
+    'scene': (Scene, 'build_scene_documents', 'created_by', 'project', ('pov_character', 'location'), ('characters',)),
+    'summary': (StorySummary, 'build_summary_documents', 'novel__author', 'novel', ('novel', 'chapter'), ()),
+}
+
+
+class Command(BaseCommand):
+    help = "สร้าง Index ของ AI ใหม่ทั้งก้อน (Embed เป็นชุดใหญ่ + upsert ขนานกัน) พร้อม checkpoint ให้ทำต่อได้"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', type=int, help="เฉพาะข้อมูลของ User id นี้")
+        parser.add_argument('--novel', type=int, help="เฉพาะนิยาย id นี้")
+        parser.add_argument('--types', default=','.join(REINDEX_TYPES),
+                            help=f"ประเภทที่จะทำ คั่นด้วย , (ค่าเริ่มต้น: {','.join(REINDEX_TYPES)})")
+        parser.add_argument('--chunk-size', type=int, default=500, help="จำนวนแถวต่อการดึงจาก DB (iterator)")
+        parser.add_argument('--embed-batch', type=int, default=256, help="จำนวนเอกสารต่อการ Embed หนึ่งครั้ง")
+        parser.add_argument('--workers', type=int, default=4, help="จำนวน thread สำหรับ upsert ลง Vector Store")
+        parser.add_argument('--only-changed', action='store_true',
+                            help="ข้ามเอกสารที่ fingerprint ตรงกับที่บันทึกไว้ (ไม่ใช้หลังล้าง Vector Store)")
+        parser.add_argument('--resume', action='store_true', help="ทำต่อจาก checkpoint ล่าสุด")
+        parser.add_argument('--checkpoint', default=os.path.join(settings.BASE_DIR, 'rag_cache', 'reindex_checkpoint.json'))
+
+    # ==================== Checkpoint ====================
+
+    def _load_checkpoint(self, path, scope):
+        if not os.path.exists(path):
+            return {}
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        if data.get('scope') != scope:
+            raise CommandError("checkpoint นี้เป็นของการสั่งงานชุดอื่น (user/novel/types ไม่ตรง) ลบไฟล์หรือสั่งใหม่โดยไม่ใส่ --resume")
+        return data.get('done', {})
+
+    def _save_checkpoint(self, path, scope, done):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.tmp"
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump({'scope': scope, 'done': done}, f)
+        os.replace(tmp, path)
+
+    # ==================== Main ====================
+
+    def handle(self, *args, **options):
+        types = [t.strip() for t in options['types'].split(',') if t.strip()]
+        unknown = set(types) - set(REINDEX_TYPES)
+        if unknown:
+            raise CommandError(f"ไม่รู้จักประเภท: {', '.join(sorted(unknown))}")
+
+        scope = {'user': options['user'], 'novel': options['novel'], 'types': types}
+        checkpoint_path = options['checkpoint']
+        done = self._load_checkpoint(checkpoint_path, scope) if options['resume'] else {}
+
+        self.service = rag_service
+        self.options = options
+        self.stats = {'objects': 0, 'docs': 0, 'embedded': 0, 'skipped': 0}
+        started = time.monotonic()
+
+        # งาน upsert ที่ส่งเข้า thread pool ไปแล้ว เรียงตามลำดับ (future, type, pk สุดท้ายของชุด)
+        self.inflight = deque()
+        self.max_inflight = options['workers'] * 2
+
+        with ThreadPoolExecutor(max_workers=options['workers']) as pool:
+            self.pool = pool
+            for type_name in types:
+                queryset = self._queryset(type_name, options, after_pk=done.get(type_name))
+                self.stdout.write(f"🔁 Reindexing {type_name} ...")
+
+                batch, batch_sources = [], []
+                last_pk = None
+                for obj in queryset.iterator(chunk_size=options['chunk_size']):
+                    source, docs = getattr(self.service, REINDEX_TYPES[type_name][1])(obj)
+                    batch.extend(docs)
+                    batch_sources.append(source)
+                    last_pk = obj.pk
+                    self.stats['objects'] += 1
+
+                    if len(batch) >= options['embed_batch']:
+                        self._flush(batch, batch_sources, type_name, last_pk, done, checkpoint_path, scope)
+                        batch, batch_sources = [], []
+                        self._report(started)
+
+                if batch:
+                    self._flush(batch, batch_sources, type_name, last_pk, done, checkpoint_path, scope)
+                self._drain(done, checkpoint_path, scope, wait_all=True)
+
+        if os.path.exists(checkpoint_path):
+            os.remove(checkpoint_path)
+        self._report(started, final=True)
+
+    def _queryset(self, type_name, options, after_pk=None):
+        model, _, owner_field, novel_field, related, prefetch = REINDEX_TYPES[type_name]
+        queryset = model.objects.select_related(*related).prefetch_related(*prefetch).order_by('pk')
+        if type_name == 'chapter':
+            queryset = queryset.exclude(content='')
+        if options['user']:
+            queryset = queryset.filter(**{owner_field: options['user']})
+        if options['novel']:
+            queryset = queryset.filter(**{novel_field: options['novel']})
+        if after_pk:
+            queryset = queryset.filter(pk__gt=after_pk)
+        return queryset
+
+    def _flush(self, batch, sources, type_name, last_pk, done, checkpoint_path, scope):
+        """ Embed ทั้งชุดในครั้งเดียว แล้วส่ง upsert ไปทำใน thread pool (ระหว่างนั้น thread หลัก Embed ชุดถัดไปต่อได้) """
+        self.stats['docs'] += len(batch)
+
+        # ชิ้นเก่าของ Object ในชุดนี้ที่ไม่มีแล้ว (เช่น ตอนสั้นลง)
+        produced = {doc_id for doc_id, _, _ in batch}
+        stale_q = source_q(sources[0])
+        for source in sources[1:]:
+            stale_q |= source_q(source)
+        stale = [d for d in RagDocument.objects.filter(stale_q).values_list('doc_id', flat=True) if d not in produced]
+
+        if self.options['only_changed']:
+            known = dict(RagDocument.objects.filter(doc_id__in=produced).values_list('doc_id', 'fingerprint'))
+            todo = [doc for doc in batch if known.get(doc[0]) != content_fingerprint(doc[1], doc[2])]
+            self.stats['skipped'] += len(batch) - len(todo)
+        else:
+            todo = batch
+
+        vectors = self.service.embeddings.embed_documents([content for _, content, _ in todo]) if todo else []
+        self.stats['embedded'] += len(todo)
+
+        future = self.pool.submit(self._upsert, todo, vectors, stale)
+        self.inflight.append((future, todo, stale, type_name, last_pk))
+        self._drain(done, checkpoint_path, scope)
+
+    def _upsert(self, docs, vectors, stale):
+        """ ทำใน thread pool: แตะแค่ Vector Store + ดัชนีคำ ไม่แตะ DB ของ Django """
+        collection = self.service.collection
+        if collection is None:
+            raise CommandError("เชื่อมต่อ Vector Store ไม่ได้")
+        lexical = self.service.lexical
+        if stale:
+            collection.delete(ids=stale)
+            if lexical:
+                lexical.delete(ids=stale)
+        if docs:
+            collection.upsert(
+                ids=[doc_id for doc_id, _, _ in docs],
+                documents=[content for _, content, _ in docs],
+                embeddings=vectors,
+                metadatas=[metadata for _, _, metadata in docs],
+            )
+            if lexical:
+                lexical.upsert(docs)
+
+    def _drain(self, done, checkpoint_path, scope, wait_all=False):
+        """ เก็บงานที่เสร็จแล้วตามลำดับ -> บันทึก fingerprint + เลื่อน checkpoint (เฉพาะเมื่อชุดก่อนหน้าเสร็จหมดแล้ว) """
+        while self.inflight and (wait_all or self.inflight[0][0].done() or len(self.inflight) > self.max_inflight):
+            future, docs, stale, type_name, last_pk = self.inflight.popleft()
+            future.result()   # ถ้า upsert พังจะโยน Exception ออกมาตรงนี้ checkpoint จะค้างที่ชุดก่อนหน้า
+            if stale:
+                forget_documents(RagDocument.objects.filter(doc_id__in=stale))
+            if docs:
+                record_documents(docs)
+            done[type_name] = last_pk
+            self._save_checkpoint(checkpoint_path, scope, done)
+
+    def _report(self, started, final=False):
+        elapsed = max(time.monotonic() - started, 1e-6)
+        s = self.stats
+        line = (f"{'🏁 Done' if final else '⏱️'} {s['objects']} objects, {s['docs']} docs "
+                f"({s['embedded']} embedded, {s['skipped']} unchanged) in {elapsed:.1f}s "
+                f"— {s['docs'] / elapsed:.1f} docs/sec")
+        self.stdout.write(self.style.SUCCESS(line) if final else line)
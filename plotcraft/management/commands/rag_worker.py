@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from plotcraft.rag_queue import process_batch
+
+
+class Command(BaseCommand):
+    help = "ทยอยทำงานในคิว RagOutbox (อัปเดต/ลบข้อมูลในสมอง AI) แบบเป็นชุด พร้อม retry"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'RAG_WORKER_BATCH_SIZE', 50))
+        parser.add_argument('--sleep', type=float, default=getattr(settings, 'RAG_WORKER_POLL_SECONDS', 2.0),
+                            help="เวลารอ (วินาที) เมื่อคิวว่าง")
+        parser.add_argument('--once', action='store_true', help="ทำรอบเดียวแล้วจบ (เหมาะกับ cron)")
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        self.stdout.write(f"🧵 RAG worker started (batch={batch_size})")
+
+        while True:
+            done, failed = process_batch(batch_size)
+            if done or failed:
+                self.stdout.write(f"✅ indexed {done}  ❌ failed {failed}")
+
+            if options['once']:
+                break
+            # ได้งานเต็มชุด = น่าจะยังมีงานค้าง ทำต่อทันที
+            if done + failed < batch_size:
+                time.sleep(options['sleep'])
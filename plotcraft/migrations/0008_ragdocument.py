@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 04:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plotcraft', '0007_ragoutbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RagDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('doc_id', models.CharField(max_length=100, unique=True)),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('novel_id', models.CharField(blank=True, db_index=True, max_length=20)),
+                ('owner_id', models.CharField(blank=True, db_index=True, max_length=20)),
+                ('indexed_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plotcraft', '0009_ragversion'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EntityMention',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('count', models.PositiveIntegerField(default=1)),
+                ('first_offset', models.PositiveIntegerField(default=0)),
+                ('chapter', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='mentions', to='plotcraft.chapter')),
+                ('character', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='mentions', to='plotcraft.character')),
+                ('item', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='mentions', to='plotcraft.item')),
+                ('location', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='mentions', to='plotcraft.location')),
+                ('novel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mentions', to='plotcraft.novel')),
+                ('scene', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='mentions', to='plotcraft.scene')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['character', 'chapter'], name='plotcraft_e_charact_04b7a7_idx'), models.Index(fields=['location', 'chapter'], name='plotcraft_e_locatio_1727a3_idx'), models.Index(fields=['item', 'chapter'], name='plotcraft_e_item_id_d9b1c2_idx')],
+            },
+        ),
+    ]
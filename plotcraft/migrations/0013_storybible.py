@@ -0,0 +1,24 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:25
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plotcraft', '0012_chatsession_chatturn'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StoryBible',
+            fields=[
+                ('novel', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='story_bible', serialize=False, to='plotcraft.novel')),
+                ('text', models.TextField()),
+                ('fingerprint', models.CharField(max_length=64)),
+                ('tokens', models.PositiveIntegerField(default=0)),
+                ('built_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
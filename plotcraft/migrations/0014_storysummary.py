@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:28
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plotcraft', '0013_storybible'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StorySummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('level', models.CharField(choices=[('chapter', 'สรุปตอน'), ('arc', 'สรุปช่วงเรื่อง'), ('novel', 'สรุปทั้งเรื่อง')], max_length=10)),
+                ('arc', models.PositiveIntegerField(default=0)),
+                ('source_fingerprint', models.CharField(max_length=64)),
+                ('text', models.TextField()),
+                ('tokens', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('chapter', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='story_summaries', to='plotcraft.chapter')),
+                ('novel', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='story_summaries', to='plotcraft.novel')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['novel', 'level'], name='plotcraft_s_novel_i_a0738f_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.18 on 2026-10-18 05:48
+
+from django.db import migrations, models
+
+
+def merge_duplicate_sessions(apps, schema_editor):
+    """ รวม ChatSession ที่ซ้ำ (user, novel) เข้าแถวแรกก่อนใส่ unique constraint """
+    ChatSession = apps.get_model('plotcraft', 'ChatSession')
+    ChatTurn = apps.get_model('plotcraft', 'ChatTurn')
+    keep = {}
+    for session in ChatSession.objects.order_by('pk'):
+        key = (session.user_id, session.novel_id)
+        if key not in keep:
+            keep[key] = session
+            continue
+        first = keep[key]
+        ChatTurn.objects.filter(session_id=session.pk).update(session_id=first.pk)
+        if session.summary:
+            first.summary = "\n".join(part for part in (first.summary, session.summary) if part)
+        # turn ที่ย่อแล้วถูกลบไปแล้ว ที่เหลือคือ turn ที่ยังไม่ย่อของทั้งสองแถว
+        first.summarized_until = 0
+        first.save(update_fields=['summary', 'summarized_until'])
+        session.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('plotcraft', '0014_storysummary'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicate_sessions, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='chatsession',
+            constraint=models.UniqueConstraint(fields=('user', 'novel'), name='chat_session_user_novel'),
+        ),
+        migrations.AddConstraint(
+            model_name='chatsession',
+            constraint=models.UniqueConstraint(condition=models.Q(('novel__isnull', True)), fields=('user',), name='chat_session_user_general'),
+        ),
+        migrations.RemoveIndex(
+            model_name='chatsession',
+            name='plotcraft_c_user_id_4c1758_idx',
+        ),
+    ]
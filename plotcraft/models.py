@@ -1,6 +1,7 @@
 from django.contrib.auth.models import AbstractUser, Group, Permission
 from django.db import models
 from django.conf import settings
+from django.utils import timezone
 from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.contrib.contenttypes.fields import GenericForeignKey
@@ -379,3 +380,221 @@ class Bookmark(models.Model):
         ordering = ['-created_at']
         # ห้าม User คนเดิม Bookmark ของชิ้นเดิมซ้ำ
         unique_together = ('user', 'content_type', 'object_id')
+
+
+# ==================== RAG OUTBOX (คิวงาน Index ให้ AI) ====================
+class RagOutbox(models.Model):
+    """
+    คิวงานสำหรับอัปเดตสมอง AI (ChromaDB) แบบไม่บล็อกการบันทึก
+    Signal แค่เขียนแถวลงตารางนี้หลัง commit แล้ว `manage.py rag_worker` จะมาทยอยทำ
+    1 Object มีได้แค่ 1 แถว (enqueue ซ้ำ = อัปเดตแถวเดิม) งานซ้ำๆ จึงถูกยุบรวมเอง
+    """
+    OP_UPSERT = 'upsert'
+    OP_DELETE = 'delete'
+    OP_CHOICES = [
+        (OP_UPSERT, 'เพิ่ม/แก้ไข'),
+        (OP_DELETE, 'ลบ'),
+    ]
+
+    model_name = models.CharField(max_length=50)   # เช่น 'novel', 'chapter' (ตาม _meta.model_name)
+    object_id = models.PositiveBigIntegerField()
+    op = models.CharField(max_length=10, choices=OP_CHOICES, default=OP_UPSERT)
+
+    # เพิ่มขึ้นทุกครั้งที่ enqueue ซ้ำ -> worker จะลบแถวได้ก็ต่อเมื่อไม่มีงานใหม่แทรกระหว่างทำ
+    seq = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveIntegerField(default=0)
+    available_at = models.DateTimeField(default=timezone.now, db_index=True)
+    last_error = models.TextField(blank=True)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['available_at']
+        unique_together = ('model_name', 'object_id')
+
+    def __str__(self):
+        return f"{self.op} {self.model_name}#{self.object_id}"
+
+
+class RagDocument(models.Model):
+    """
+    ทะเบียนเอกสารที่อยู่ในสมอง AI แล้ว พร้อม fingerprint ของข้อความที่ถูก Embed
+    ใช้เช็คว่าเนื้อหาเปลี่ยนจริงไหม ก่อนจะเสีย CPU Embed ซ้ำ
+    """
+    doc_id = models.CharField(max_length=100, unique=True)   # เช่น 'chap_12', 'novel_3'
+    fingerprint = models.CharField(max_length=64)             # sha256 hex
+    novel_id = models.CharField(max_length=20, blank=True, db_index=True)
+    owner_id = models.CharField(max_length=20, blank=True, db_index=True)
+    indexed_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.doc_id
+
+
+class RagVersion(models.Model):
+    """
+    เลขเวอร์ชันของข้อมูล RAG ต่อขอบเขต ('novel:12', 'owner:5')
+    ทุกครั้งที่ Index/ลบเอกสารของนิยายนั้น เลขจะเพิ่ม -> แคชผลค้นหาเก่าใช้ไม่ได้เอง
+    'names:owner:5' = ชื่อตัวละคร/สถานที่/ไอเทมของผู้แต่งคนนี้เปลี่ยน -> automaton ของ rag_mentions สร้างใหม่
+    """
+    scope = models.CharField(max_length=50, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.scope} v{self.version}"
+
+
+class StoryBible(models.Model):
+    """
+    บริบทหลักของนิยายที่ประกอบไว้ล่วงหน้า (เรื่องย่อ, ตัวละครหลัก, สถานที่สำคัญ, ตอนล่าสุด) ดู rag_bible
+    Prompt ของพี่บก./ร่างฉาก อ่านแถวเดียวด้วย primary key แทนการไปถาม Vector Store
+    rag_worker สร้างใหม่เมื่อนิยาย/ตัวละคร/สถานที่/ตอนเปลี่ยน และเขียนทับเฉพาะเมื่อข้อความเปลี่ยนจริง
+    """
+    novel = models.OneToOneField(Novel, on_delete=models.CASCADE, primary_key=True, related_name='story_bible')
+    text = models.TextField()
+    fingerprint = models.CharField(max_length=64)   # sha256 hex ของ text
+    tokens = models.PositiveIntegerField(default=0)
+    built_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"bible of novel {self.novel_id} (~{self.tokens} tokens)"
+
+
+class StorySummary(models.Model):
+    """
+    สรุปเนื้อเรื่องเป็นชั้นๆ (ดู rag_summaries): สรุปต่อตอน -> สรุปต่อช่วง (arc) -> สรุปทั้งเรื่อง
+    source_fingerprint = fingerprint ของสิ่งที่ถูกสรุป (เนื้อหาตอน / สรุปชั้นล่าง) ไม่เปลี่ยน = ไม่ต้องสรุปใหม่
+    """
+    LEVEL_CHAPTER = 'chapter'
+    LEVEL_ARC = 'arc'
+    LEVEL_NOVEL = 'novel'
+    LEVEL_CHOICES = [
+        (LEVEL_CHAPTER, 'สรุปตอน'),
+        (LEVEL_ARC, 'สรุปช่วงเรื่อง'),
+        (LEVEL_NOVEL, 'สรุปทั้งเรื่อง'),
+    ]
+
+    key = models.CharField(max_length=100, unique=True)   # = doc id ใน Vector Store เช่น 'chapsum_12', 'arcsum_3_0'
+    novel = models.ForeignKey(Novel, on_delete=models.CASCADE, related_name='story_summaries')
+    chapter = models.ForeignKey(Chapter, on_delete=models.CASCADE, null=True, blank=True, related_name='story_summaries')
+    level = models.CharField(max_length=10, choices=LEVEL_CHOICES)
+    arc = models.PositiveIntegerField(default=0)   # ช่วงที่เท่าไหร่ (เริ่ม 0) ของสรุประดับ arc
+
+    source_fingerprint = models.CharField(max_length=64)
+    text = models.TextField()
+    tokens = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['novel', 'level'])]
+
+    def __str__(self):
+        return self.key
+
+
+# ==================== MENTION INDEX (ใครถูกเอ่ยถึงในตอน/ฉากไหน) ====================
+class EntityMention(models.Model):
+    """
+    ดัชนีการเอ่ยชื่อ: ตัวละคร/สถานที่/ไอเทม (ชื่อ + ชื่อเล่น) ปรากฏในตอนหรือฉากไหน กี่ครั้ง
+    1 แถว = 1 คู่ (สิ่งที่ถูกเอ่ยถึง, ตอนหรือฉาก) — อัปเดตทีละตอน/ฉากตอนบันทึก (ดู rag_mentions)
+    """
+    novel = models.ForeignKey(Novel, on_delete=models.CASCADE, related_name='mentions')
+
+    # สิ่งที่ถูกเอ่ยถึง (มีค่าแค่ช่องเดียว)
+    character = models.ForeignKey(Character, on_delete=models.CASCADE, null=True, blank=True, related_name='mentions')
+    location = models.ForeignKey(Location, on_delete=models.CASCADE, null=True, blank=True, related_name='mentions')
+    item = models.ForeignKey(Item, on_delete=models.CASCADE, null=True, blank=True, related_name='mentions')
+
+    # เอกสารที่เอ่ยถึง (มีค่าแค่ช่องเดียว)
+    chapter = models.ForeignKey(Chapter, on_delete=models.CASCADE, null=True, blank=True, related_name='mentions')
+    scene = models.ForeignKey(Scene, on_delete=models.CASCADE, null=True, blank=True, related_name='mentions')
+
+    count = models.PositiveIntegerField(default=1)
+    first_offset = models.PositiveIntegerField(default=0)   # ตำแหน่งแรกที่เจอในข้อความ (ไว้ตัดข้อความตัวอย่าง)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['character', 'chapter']),
+            models.Index(fields=['location', 'chapter']),
+            models.Index(fields=['item', 'chapter']),
+        ]
+
+    def __str__(self):
+        entity = self.character or self.location or self.item
+        document = self.chapter or self.scene
+        return f"{entity} @ {document} ×{self.count}"
+
+
+# ==================== AI RATE LIMIT (ใช้ร่วมกันทุก worker ผ่าน DB) ====================
+class AiRateBucket(models.Model):
+    """
+    Token bucket ของผู้ใช้แต่ละคนสำหรับ API ของ AI (ดู rag_limits)
+    ทุกคำขอใช้ 1 token, token เติมคืนตามเวลา (RAG_AI_USER_RATE_PER_MINUTE) สะสมได้ไม่เกิน RAG_AI_USER_BURST
+    """
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='ai_rate_bucket')
+    tokens = models.FloatField()
+    updated_at = models.DateTimeField()
+
+    def __str__(self):
+        return f"{self.user_id}: {self.tokens:.2f}"
+
+
+class AiSlot(models.Model):
+    """
+    ช่องเรียก AI พร้อมกันทั้งระบบ (RAG_AI_MAX_CONCURRENCY แถว) คำขอที่กำลังทำงานจองไว้หนึ่งช่อง
+    leased_until กันช่องค้าง: worker ตายกลางทางแล้วไม่ได้คืน ช่องจะว่างเองเมื่อหมดเวลา
+    """
+    holder = models.CharField(max_length=64, blank=True)
+    leased_until = models.DateTimeField(null=True, blank=True, db_index=True)
+
+    def __str__(self):
+        return f"slot {self.pk}: {self.holder or '-'}"
+
+
+# ==================== EDITOR CHAT MEMORY ====================
+class ChatSession(models.Model):
+    """
+    บทสนทนากับพี่บก. ของผู้ใช้ต่อนิยาย (novel ว่าง = คุยทั่วไป)
+    turn ล่าสุดเก็บเต็มๆ ใน ChatTurn ส่วน turn เก่ากว่านั้นถูกย่อรวมไว้ใน summary (ดู rag_memory)
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='chat_sessions')
+    novel = models.ForeignKey(Novel, on_delete=models.CASCADE, null=True, blank=True, related_name='chat_sessions')
+    summary = models.TextField(blank=True)
+    summarized_until = models.PositiveBigIntegerField(default=0)   # id ของ ChatTurn ล่าสุดที่ถูกย่อเข้า summary แล้ว
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            # ผู้ใช้หนึ่งคนมีบทสนทนาเดียวต่อนิยาย
+            models.UniqueConstraint(fields=['user', 'novel'], name='chat_session_user_novel'),
+            # NULL ไม่ถือว่าซ้ำกัน จึงต้องกันแชททั่วไปแยก (MySQL ไม่รองรับ constraint แบบมีเงื่อนไข -> get_session เลือกอันแรกเสมอ)
+            models.UniqueConstraint(fields=['user'], condition=models.Q(novel__isnull=True),
+                                    name='chat_session_user_general'),
+        ]
+
+    def __str__(self):
+        return f"{self.user} @ {self.novel or '-'}"
+
+
+class ChatTurn(models.Model):
+    ROLE_USER = 'user'
+    ROLE_EDITOR = 'editor'
+    ROLE_CHOICES = [
+        (ROLE_USER, 'นักเขียน'),
+        (ROLE_EDITOR, 'พี่บก.'),
+    ]
+
+    session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='turns')
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES)
+    content = models.TextField()
+    tokens = models.PositiveIntegerField(default=0)   # ประมาณการ (rag_chunking.estimate_tokens)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def __str__(self):
+        return f"{self.get_role_display()}: {self.content[:30]}"
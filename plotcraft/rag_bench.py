@@ -0,0 +1,433 @@
+# rag_bench.py
+"""
+วัดประสิทธิภาพ RAGService แบบออฟไลน์ (ไม่ต้องมี Gemini API Key / ChromaDB / โมเดล Embed จริง)
+
+- สร้างนิยายสังเคราะห์ภาษาไทย: ผู้ใช้ N คน x นิยาย x ตอน (ยาวพอๆ กับตอนจริง) + ตัวละคร + สถานที่
+  ฝัง "ข้อเท็จจริง" ไว้ในบางตอน แล้วตั้งคำถามที่รู้คำตอบ (ใช้วัด recall@k)
+- ตัวแทนโมเดลที่ผลออกมาเหมือนเดิมทุกครั้ง: HashingEmbeddings (hash n-gram ตัวอักษร) และ FakeLLM (ทวนท้าย Prompt
+  หลังหน่วงเวลาตามที่กำหนด)
+- Vector Store / ดัชนีคำ ใช้ LocalVectorStore / LexicalIndex ในโฟลเดอร์ชั่วคราว ข้อมูลใน DB สร้างใน transaction
+  แล้ว rollback ทิ้งตอนจบ (คิว/Signal ที่รอ on_commit ไม่ถูกเรียก) -> รันกับ DB ที่มีข้อมูลจริงได้โดยไม่ทิ้งอะไรไว้
+- ผลเป็น dict (คำสั่ง rag_bench พิมพ์/บันทึกเป็น JSON ไว้เทียบข้าม commit)
+"""
+import asyncio
+import contextlib
+import math
+import os
+import random
+import statistics
+import tempfile
+import time
+import zlib
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.test.utils import override_settings
+
+from .models import Chapter, Character, Location, Novel, RagDocument
+from .rag_chunking import estimate_tokens
+from .rag_lexical import LexicalIndex
+from .rag_mentions import rebuild_novel as rebuild_mentions
+from .rag_metrics import start_timings
+from .rag_service import RAGService
+from .rag_vector_store import LocalVectorStore
+
+# ==================== คลังคำของนิยายสังเคราะห์ ====================
+
+NAME_HEADS = [
+    "อรุณ", "กานต์", "ภูมิ", "ธารา", "พิม", "เมฆา", "ราชัน", "ลลิน", "วายุ", "ศศิ", "นภา", "ตะวัน",
+    "ไพลิน", "ปราณ", "อัคนี", "จันทร์", "พิรุณ", "มณี", "สายฟ้า", "เพลิง", "ดาริน", "กมล", "ธีร", "รวี",
+]
+NAME_TAILS = ["รัตน์", "วดี", "พล", "นที", "ชนก", "ภัทร", "ลดา", "เทพ", "ศักดิ์", "พร", "ดา", "ยศ"]
+ROLES = ["ตัวเอก", "นางเอก", "ตัวร้าย", "พระรอง", "ที่ปรึกษา", "ผู้พิทักษ์", "พ่อค้า", "นักดาบ", "หมอยา", "โจรสลัด"]
+TRAITS = [
+    "ใจเย็น", "ขี้ระแวง", "พูดน้อย", "รักพวกพ้อง", "ดื้อรั้น", "เจ้าเล่ห์", "ซื่อตรง", "ขี้อาย",
+    "ทะเยอทะยาน", "อ่อนโยน", "หัวร้อน", "ช่างสังเกต", "ขี้เหงา", "มองโลกในแง่ดี",
+]
+PLACE_HEADS = ["ตลาดน้ำ", "หอคอย", "ป่า", "วัง", "หมู่บ้าน", "ท่าเรือ", "ถ้ำ", "เมือง", "หุบเขา", "วิหาร"]
+PLACE_TAILS = ["จันทรา", "หมอกเงิน", "ศิลาดำ", "ลมหนาว", "ทองคำ", "เงาไม้", "สายน้ำ", "ดาวตก", "ผลึก", "เพลิงแดง"]
+OBJECTS = ["กุญแจ", "จดหมาย", "แหวน", "ดาบ", "แผนที่", "ตะเกียง", "กล่องไม้", "ขลุ่ย", "เข็มทิศ", "ผ้าคลุม", "ตำรา", "จี้หยก"]
+OBJECT_TRAITS = ["ทองเหลือง", "สีเงิน", "โบราณ", "ต้องสาป", "ของแม่", "ไร้ชื่อ", "เปื้อนเลือด", "แกะสลัก", "สีคราม", "หักครึ่ง"]
+TIMES = ["ก่อนรุ่งสาง", "กลางดึก", "ตอนพระอาทิตย์ตก", "ในคืนพระจันทร์เต็มดวง", "หลังพายุสงบ", "ตอนเที่ยงวัน"]
+CATEGORIES = ["FANTASY", "ROMANCE", "ACTION", "HORROR", "SCIFI"]
+
+SENTENCES = [
+    "{a}เดินผ่าน{place}{time} โดยไม่หันกลับไปมองอีกเลย",
+    "{time} {a}นั่งคุยกับ{b}ถึงเรื่องที่ยังค้างคาใจ",
+    "เสียงระฆังจาก{place}ดังขึ้น ทำให้{a}ตื่นจากภวังค์",
+    "{b}เล่าว่าเคยเห็น{obj}ที่{place}เมื่อหลายปีก่อน",
+    "{a}ไม่เข้าใจว่าทำไม{b}ถึงเปลี่ยนไปมากขนาดนี้",
+    "ลมหนาวพัดผ่าน{place} ทุกคนรู้ดีว่าอีกไม่นานจะมีเรื่องใหญ่",
+    "{a}กำมือแน่น พยายามข่มความโกรธไม่ให้ใครเห็น",
+    "{b}ยื่น{obj}ให้{a}พร้อมรอยยิ้มที่อ่านไม่ออก",
+    "ผู้คนใน{place}ลือกันว่า{a}คือคนที่ถูกเลือก",
+    "{a}กับ{b}ตกลงกันว่าจะออกเดินทาง{time}",
+    "ไม่มีใครใน{place}รู้ความลับที่{a}เก็บไว้",
+    "แสงตะเกียงริบหรี่ ขณะที่{a}อ่านบันทึกเก่าของ{b}",
+    "{a}นึกถึงคำสัญญาที่ให้ไว้กับ{b}ตอนยังเด็ก",
+    "ทหารยามแห่ง{place}ตรวจค้นทุกคนที่ผ่านเข้าออก",
+    "{b}หัวเราะเบาๆ ก่อนจะหายไปในฝูงชน",
+    "ฝนตกหนักตลอดทั้งคืน {a}นอนฟังเสียงน้ำกระทบหลังคา",
+    "{a}พบ{obj}วางอยู่บนโต๊ะโดยไม่มีใครรู้ว่าใครเอามาไว้",
+    "ข่าวลือเรื่อง{b}แพร่ไปทั่ว{place}ภายในวันเดียว",
+]
+
+# ข้อเท็จจริงที่ฝังไว้ในตอน (ไม่มีช่องว่าง = ไม่ถูกตัดแบ่งประโยค) + คำถามที่คำตอบคือประโยคนั้น
+FACT = "{a}ซ่อน{item}ไว้ที่{place}{time}"
+FACT_QUESTIONS = [
+    ("fact", "{item}ถูกซ่อนไว้ที่ไหน"),
+    ("fact", "ใครเป็นคนซ่อน{item}"),
+    ("mention", "{a}ซ่อนอะไรไว้ที่{place}บ้าง"),
+]
+CHARACTER_QUESTION = ("character", "{name}เป็นคนนิสัยแบบไหน")
+
+LOCATIONS_PER_NOVEL = 4
+
+
+def _unique_names(rng, heads, tails, count):
+    """ ชื่อไม่ซ้ำ และไม่มีชื่อไหนเป็นส่วนหนึ่งของอีกชื่อ (ไม่งั้นการเอ่ยชื่อ/ดัชนี mention จะปนกัน) """
+    names = []
+    pairs = [(head, tail) for head in heads for tail in tails]
+    rng.shuffle(pairs)
+    for head, tail in pairs:
+        name = head + tail
+        if not any(name in other or other in name for other in names):
+            names.append(name)
+        if len(names) == count:
+            break
+    return names
+
+
+def _sentence(rng, cast, places):
+    a, b = rng.sample(cast, 2) if len(cast) > 1 else (cast[0], cast[0])
+    return rng.choice(SENTENCES).format(
+        a=a, b=b, place=rng.choice(places), time=rng.choice(TIMES), obj=rng.choice(OBJECTS)
+    )
+
+
+def _paragraphs(rng, cast, places, target_chars):
+    paragraphs, length = [], 0
+    while length < target_chars:
+        paragraph = " ".join(_sentence(rng, cast, places) for _ in range(rng.randint(3, 6)))
+        paragraphs.append(paragraph)
+        length += len(paragraph)
+    return paragraphs
+
+
+# ==================== ตัวแทนโมเดล ====================
+
+class HashingEmbeddings:
+    """
+    Embedding ที่ได้ผลเดิมทุกครั้ง: นับ n-gram ตัวอักษร (ใช้กับภาษาไทยที่ไม่เว้นวรรคได้) hash ลงเวกเตอร์ dim มิติ
+    ด้วย crc32 (เครื่องหมายจากบิตบนสุด) แล้ว normalize -> ข้อความที่ใช้คำร่วมกันมากจะอยู่ใกล้กัน
+    """
+
+    def __init__(self, dim=384, ngrams=(2, 3)):
+        self.dim = dim
+        self.ngrams = ngrams
+
+    def _embed(self, text):
+        text = " ".join((text or "").lower().split())
+        counts = {}
+        for n in self.ngrams:
+            for i in range(len(text) - n + 1):
+                gram = text[i:i + n]
+                counts[gram] = counts.get(gram, 0) + 1
+
+        vector = [0.0] * self.dim
+        for gram, count in counts.items():
+            h = zlib.crc32(gram.encode("utf-8"))
+            vector[h % self.dim] += (1.0 + math.log(count)) * (-1.0 if h & 0x80000000 else 1.0)
+        norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+        return [x / norm for x in vector]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+    def embed_documents(self, texts):
+        return [self._embed(text) for text in texts]
+
+
+class FakeLLM:
+    """
+    LLM ปลอม: หน่วงเวลา latency วินาที แล้วตอบด้วยท้าย Prompt echo_chars ตัวอักษร (ใช้ได้ทั้งแชท/สรุป)
+    มี invoke / ainvoke / stream / astream เหมือน LLM ของ LangChain ที่ RAGService เรียก
+    """
+
+    def __init__(self, latency=0.0, echo_chars=200, chunk_chars=40):
+        self.latency = latency
+        self.echo_chars = echo_chars
+        self.chunk_chars = chunk_chars
+        self.calls = 0
+
+    def _reply(self, prompt):
+        self.calls += 1
+        return " ".join(str(prompt).split())[-self.echo_chars:]
+
+    def _chunks(self, reply):
+        return [reply[i:i + self.chunk_chars] for i in range(0, len(reply), self.chunk_chars)]
+
+    def invoke(self, prompt, *args, **kwargs):
+        time.sleep(self.latency)
+        return self._reply(prompt)
+
+    async def ainvoke(self, prompt, *args, **kwargs):
+        await asyncio.sleep(self.latency)
+        return self._reply(prompt)
+
+    def stream(self, prompt, *args, **kwargs):
+        time.sleep(self.latency)
+        yield from self._chunks(self._reply(prompt))
+
+    async def astream(self, prompt, *args, **kwargs):
+        await asyncio.sleep(self.latency)
+        for chunk in self._chunks(self._reply(prompt)):
+            yield chunk
+
+
+# ==================== สร้างนิยายสังเคราะห์ ====================
+
+def generate_corpus(users=2, novels=2, chapters=30, characters=8, chapter_chars=6000, questions=40, seed=1):
+    """
+    สร้างข้อมูลลง DB (ควรเรียกใน transaction ที่จะ rollback) คืนค่า (รายการนิยาย, คำถาม)
+    คำถาม = [{'kind', 'novel_id', 'user_id', 'question', 'answer'}, ...] answer คือข้อความที่ต้องอยู่ในบริบท
+    """
+    rng = random.Random(seed)
+    User = get_user_model()
+    tag = f"{seed}-{rng.getrandbits(32):08x}"
+
+    created, facts, profiles = [], [], []
+    for u in range(users):
+        user = User.objects.create(username=f"ragbench-{tag}-{u}")
+        for n in range(novels):
+            places = _unique_names(rng, PLACE_HEADS, PLACE_TAILS, LOCATIONS_PER_NOVEL)
+            cast = _unique_names(rng, NAME_HEADS, NAME_TAILS, max(characters, 2))
+            novel = Novel.objects.create(
+                title=f"ตำนาน{places[0]} เล่ม {n + 1}",
+                synopsis=" ".join(_sentence(rng, cast, places) for _ in range(rng.randint(4, 7))),
+                category=rng.choice(CATEGORIES),
+                author=user,
+            )
+            for place in places:
+                Location.objects.create(
+                    project=novel, created_by=user, name=place, world_type="แฟนตาซี",
+                    terrain=" ".join(_sentence(rng, cast, places) for _ in range(3)),
+                )
+            for name in cast[:characters]:
+                traits = rng.sample(TRAITS, 3)
+                personality = f"{traits[0]}และ{traits[1]} แต่จะ{traits[2]}ทุกครั้งที่อยู่ใกล้{rng.choice(places)}"
+                char = Character.objects.create(
+                    project=novel, created_by=user, name=name, role=rng.choice(ROLES), age=rng.randint(16, 70),
+                    personality=personality,
+                    background=" ".join(_sentence(rng, cast, places) for _ in range(rng.randint(4, 8))),
+                    goals=_sentence(rng, cast, places),
+                )
+                profiles.append((novel, user, char.name, personality))
+
+            # ของที่ถูกซ่อน ไม่ซ้ำกันในนิยายเดียวกัน
+            items = [noun + trait for noun in OBJECTS for trait in OBJECT_TRAITS]
+            rng.shuffle(items)
+            for order in range(1, chapters + 1):
+                paragraphs = _paragraphs(rng, cast, places, int(chapter_chars * rng.uniform(0.6, 1.4)))
+                if items and rng.random() < 0.5:
+                    fact = {"a": rng.choice(cast[:characters]), "item": items.pop(), "place": rng.choice(places),
+                            "time": rng.choice(TIMES)}
+                    paragraphs.insert(rng.randrange(len(paragraphs) + 1), FACT.format(**fact))
+                    facts.append((novel, user, fact))
+                Chapter.objects.create(
+                    novel=novel, order=order, title=f"บทที่ {order} {rng.choice(TIMES)}",
+                    content="".join(f"<p>{paragraph}</p>" for paragraph in paragraphs),
+                )
+            created.append(novel)
+
+    # คำถามวนตามแบบ: ถามข้อเท็จจริงในตอนโดยไม่เอ่ยชื่อ 2 แบบ (-> Vector/BM25), เอ่ยชื่อ (-> mention route), ถามนิสัยตัวละคร
+    qa = []
+    kinds = FACT_QUESTIONS + [CHARACTER_QUESTION]
+    for i in range(questions):
+        kind, template = kinds[i % len(kinds)]
+        if kind == "character" or not facts:
+            novel, user, name, personality = rng.choice(profiles)
+            qa.append({"kind": "character", "novel_id": novel.pk, "user_id": user.pk,
+                       "question": CHARACTER_QUESTION[1].format(name=name), "answer": personality})
+        else:
+            novel, user, fact = rng.choice(facts)
+            qa.append({"kind": kind, "novel_id": novel.pk, "user_id": user.pk,
+                       "question": template.format(**fact), "answer": FACT.format(**fact)})
+    return created, qa
+
+
+# ==================== วัดผล ====================
+
+def percentile(values, pct):
+    """ nearest-rank percentile (values ว่าง -> 0) """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(math.ceil(pct / 100 * len(ordered)) - 1, 0))]
+
+
+def _distribution(values, scale=1.0):
+    return {
+        "mean": statistics.fmean(values) * scale if values else 0.0,
+        "p50": percentile(values, 50) * scale,
+        "p95": percentile(values, 95) * scale,
+        "p99": percentile(values, 99) * scale,
+        "max": max(values) * scale if values else 0.0,
+    }
+
+
+def _normalized(text):
+    return " ".join((text or "").split())
+
+
+def _timed(func, *args, **kwargs):
+    started = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+def run_benchmark(users=2, novels=2, chapters=30, characters=8, chapter_chars=6000, questions=40, seed=1,
+                  ks=(1, 3, 6), dim=384, llm_latency=0.0, lexical=True, summaries=False, log=None):
+    """
+    สร้างคลังนิยาย -> Index -> ถามคำถามที่รู้คำตอบ คืน dict ของผลวัด (ข้อมูลใน DB rollback ทั้งหมดตอนจบ)
+    log = ไฟล์ที่ให้ print ของ RAGService ไปลง (None = ทิ้ง)
+    """
+    with contextlib.ExitStack() as stack:
+        workdir = stack.enter_context(tempfile.TemporaryDirectory(prefix="rag_bench_"))
+        stack.enter_context(contextlib.redirect_stdout(log or stack.enter_context(open(os.devnull, "w"))))
+        # ไม่ใช้แคชผลค้นหา: ทุกคำถามต้องค้นจริง และไม่ทิ้ง key ของนิยายที่ถูก rollback ไว้ในแคช
+        # ไม่เขียน snapshot ตัวเลขของข้อมูลปลอมลง RAG_METRICS_DIR (ไม่งั้น /metrics ของจริงนับรวมไปด้วย)
+        stack.enter_context(override_settings(RAG_RETRIEVAL_CACHE_TTL=0, RAG_METRICS_DIR=""))
+        stack.enter_context(transaction.atomic())
+
+        service = RAGService()
+        service._embeddings = HashingEmbeddings(dim=dim)
+        service._llm = FakeLLM(latency=llm_latency)
+        service._collection = LocalVectorStore(os.path.join(workdir, "vectors"))
+        service._lexical = LexicalIndex(os.path.join(workdir, "lexical.sqlite3")) if lexical else None
+
+        (corpus, qa), seconds = _timed(
+            generate_corpus, users=users, novels=novels, chapters=chapters, characters=characters,
+            chapter_chars=chapter_chars, questions=questions, seed=seed,
+        )
+        result = {
+            "corpus": _corpus_stats(corpus, qa, seconds),
+            "indexing": _index(service, corpus, summaries),
+            **_ask(service, qa, ks),
+        }
+        transaction.set_rollback(True)
+    return result
+
+
+def _stage_totals(timings):
+    totals = {}
+    for name, elapsed in timings:
+        totals[name] = totals.get(name, 0.0) + elapsed
+    return totals
+
+
+def _corpus_stats(corpus, qa, seconds):
+    lengths = [len(content) for content in Chapter.objects.filter(novel__in=corpus).values_list("content", flat=True)]
+    return {
+        "novels": len(corpus),
+        "chapters": len(lengths),
+        "characters": Character.objects.filter(project__in=corpus).count(),
+        "chapter_chars_mean": statistics.fmean(lengths) if lengths else 0.0,
+        "total_chars": sum(lengths),
+        "questions": len(qa),
+        "generate_seconds": seconds,
+    }
+
+
+def _index_all(service, corpus):
+    for novel in corpus:
+        service.add_novel_summary_to_rag(novel)
+        for char in Character.objects.filter(project=novel):
+            service.add_character_to_rag(char)
+        for chapter in Chapter.objects.filter(novel=novel).select_related("novel"):
+            service.add_chapter_to_rag(chapter)
+
+
+def _index(service, corpus, summaries):
+    """ Index ครั้งแรก (Embed ทุกชิ้น) -> Index ซ้ำ (ข้ามด้วย fingerprint) -> ดัชนี mention -> คัมภีร์ -> สรุป """
+    novel_ids = [str(novel.pk) for novel in corpus]
+    timings = start_timings()
+    _, seconds = _timed(_index_all, service, corpus)
+    docs = RagDocument.objects.filter(novel_id__in=novel_ids).count()
+    result = {
+        "docs": docs,
+        "seconds": seconds,
+        "docs_per_second": docs / seconds if seconds else 0.0,
+        "stages_seconds": _stage_totals(timings),
+    }
+    _, result["reindex_unchanged_seconds"] = _timed(_index_all, service, corpus)
+    _, result["mentions_seconds"] = _timed(lambda: [rebuild_mentions(novel) for novel in corpus])
+    _, result["bible_seconds"] = _timed(lambda: [service.rebuild_story_bible(novel) for novel in corpus])
+
+    if summaries:
+        calls = service.llm.calls
+        batch = Chapter.objects.filter(novel__in=corpus).count() + 1
+        with override_settings(RAG_SUMMARY_BATCH=batch):
+            _, result["summaries_seconds"] = _timed(lambda: [service.update_story_summaries(novel) for novel in corpus])
+        result["summaries_llm_calls"] = service.llm.calls - calls
+        result["docs_with_summaries"] = RagDocument.objects.filter(novel_id__in=novel_ids).count()
+    return result
+
+
+def _ask(service, qa, ks):
+    """ ถามทุกคำถาม: เวลาค้นบริบท (แยกตามขั้น), ขนาด Prompt, เวลา LLM และ recall@k ของคำตอบในบริบท """
+    if qa:   # คำถามแรกของ process โหลด automaton/เปิด SQLite -> ไม่นับ
+        service.retrieve_context(qa[0]["question"], novel_id=qa[0]["novel_id"], user_id=qa[0]["user_id"])
+
+    latencies, build_latencies, llm_latencies = [], [], []
+    context_tokens, prompt_tokens = [], []
+    stages, routed = {}, 0
+    hits = {k: 0 for k in ks}
+    by_kind = {}
+    for q in qa:
+        timings = start_timings()
+        retrieved, seconds = _timed(service.retrieve_context, q["question"], novel_id=q["novel_id"], user_id=q["user_id"])
+        latencies.append(seconds)
+        totals = _stage_totals(timings)
+        for name, elapsed in totals.items():
+            stages.setdefault(name, []).append(elapsed)
+        routed += "mention_query" in totals
+
+        prompt, seconds = _timed(service.build_editor_prompt, q["question"], novel_id=q["novel_id"], user_id=q["user_id"])
+        build_latencies.append(seconds)
+        _, seconds = _timed(service._invoke, service.llm, prompt, "chat")
+        llm_latencies.append(seconds)
+        context_tokens.append(retrieved["tokens"])
+        prompt_tokens.append(estimate_tokens(prompt))
+
+        # recall@k: ประโยคคำตอบอยู่ใน k ท่อนแรกของบริบทที่ส่งให้ LLM (ตามลำดับใน Prompt)
+        answer = _normalized(q["answer"])
+        found = [answer in _normalized(item["text"]) for item in retrieved["items"]]
+        kind = by_kind.setdefault(q["kind"], {"questions": 0, **{k: 0 for k in ks}})
+        kind["questions"] += 1
+        for k in ks:
+            if any(found[:k]):
+                hits[k] += 1
+                kind[k] += 1
+
+    total = len(qa) or 1
+    return {
+        "retrieval": {
+            "latency_ms": _distribution(latencies, 1000),
+            "stages_ms": {name: statistics.fmean(values) * 1000 for name, values in sorted(stages.items())},
+            "mention_scoped": routed,
+        },
+        "prompt": {
+            "tokens": _distribution(prompt_tokens),
+            "context_tokens": _distribution(context_tokens),
+            "build_ms": _distribution(build_latencies, 1000),
+        },
+        "llm": {"latency_ms": _distribution(llm_latencies, 1000), "calls": service.llm.calls},
+        "recall": {
+            **{f"at_{k}": hits[k] / total for k in ks},
+            "by_kind": {
+                name: {"questions": row["questions"], **{f"at_{k}": row[k] / row["questions"] for k in ks}}
+                for name, row in sorted(by_kind.items())
+            },
+        },
+    }
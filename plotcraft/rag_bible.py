@@ -0,0 +1,112 @@
+# rag_bible.py
+"""
+"คัมภีร์นิยาย" (StoryBible): บริบทหลักของนิยายหนึ่งเรื่อง ประกอบไว้ล่วงหน้าเก็บใน DB
+
+- เรื่องย่อ + เรื่องที่ผ่านมา (สรุปทั้งเรื่อง) + ตัวละครหลัก (คนละบรรทัด) + สถานที่สำคัญ + สรุปตอนล่าสุด
+  ยาวรวมไม่เกิน RAG_BIBLE_MAX_TOKENS (ตอนที่ยังไม่มีสรุป ใช้ต้นตอนแทน ดู rag_summaries)
+- "หลัก/สำคัญ" = ถูกเอ่ยชื่อในตอน/ฉากบ่อยสุด (EntityMention) ยังไม่มีใครถูกเอ่ยถึงก็เรียงตามที่สร้างก่อน
+- Signal ลงคิวงาน 'story_bible' ของนิยาย -> rag_worker เรียก rebuild() (debounce/ยุบงานซ้ำเหมือนงาน Index อื่น)
+  ข้อความไม่เปลี่ยน (fingerprint เดิม) = ไม่เขียนอะไรเลย
+- Prompt อ่านด้วย story_bible(novel_id) = query เดียวด้วย primary key (ยังไม่เคยสร้างก็สร้างให้ตอนนั้น)
+"""
+import hashlib
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import Chapter, Character, Location, Novel, StoryBible, StorySummary
+from .rag_chunking import estimate_tokens, html_to_text
+from .rag_context import truncate_tokens
+from .rag_retrieval_cache import bump_versions
+
+
+def _line(*parts):
+    return " — ".join(part.strip() for part in parts if part and part.strip())
+
+
+def _by_mentions(queryset):
+    return queryset.annotate(mentioned=Coalesce(Sum('mentions__count'), Value(0))).order_by('-mentioned', 'pk')
+
+
+def build_story_bible(novel):
+    """ ประกอบข้อความคัมภีร์ของนิยายจากข้อมูลปัจจุบันใน DB """
+    max_characters = getattr(settings, 'RAG_BIBLE_MAX_CHARACTERS', 8)
+    max_locations = getattr(settings, 'RAG_BIBLE_MAX_LOCATIONS', 5)
+    recent_chapters = getattr(settings, 'RAG_BIBLE_RECENT_CHAPTERS', 3)
+
+    lines = [
+        f"ชื่อเรื่อง: {novel.title}",
+        f"หมวดหมู่: {novel.get_category_display()} | ระดับเนื้อหา: {novel.get_rating_display()} | "
+        f"สถานะ: {novel.get_status_display()}",
+    ]
+    if novel.synopsis.strip():
+        lines.append(f"เรื่องย่อ: {truncate_tokens(novel.synopsis.strip(), 100)}")
+    story = StorySummary.objects.filter(novel=novel, level=StorySummary.LEVEL_NOVEL).values_list('text', flat=True).first()
+    if story:
+        lines.append(f"เรื่องที่ผ่านมา: {truncate_tokens(story, 120)}")
+
+    characters = _by_mentions(Character.objects.filter(project=novel))[:max_characters]
+    if characters:
+        lines.append("ตัวละครหลัก:")
+        for char in characters:
+            name = f"{char.name} ({char.alias})" if char.alias else char.name
+            lines.append(f"- {_line(name, char.role, truncate_tokens(char.personality, 20) if char.personality else '')}")
+
+    locations = _by_mentions(Location.objects.filter(project=novel))[:max_locations]
+    if locations:
+        lines.append("สถานที่สำคัญ:")
+        for loc in locations:
+            detail = loc.terrain or loc.culture or loc.history
+            lines.append(f"- {_line(loc.name, loc.world_type, truncate_tokens(detail, 20) if detail else '')}")
+
+    chapters = list(Chapter.objects.filter(novel=novel).exclude(content='').order_by('-order', '-pk')[:recent_chapters])
+    if chapters:
+        summaries = dict(
+            StorySummary.objects.filter(chapter__in=chapters, level=StorySummary.LEVEL_CHAPTER)
+            .values_list('chapter_id', 'text')
+        )
+        lines.append("ตอนล่าสุด:")
+        for chapter in reversed(chapters):
+            gist = summaries.get(chapter.pk) or html_to_text(chapter.content)
+            lines.append(f"- บทที่ {chapter.order} {chapter.title}: {truncate_tokens(gist, 40)}")
+
+    return truncate_tokens("\n".join(lines), getattr(settings, 'RAG_BIBLE_MAX_TOKENS', 450))
+
+
+def rebuild(novel):
+    """ สร้างคัมภีร์ใหม่ เขียนลง DB เฉพาะเมื่อข้อความเปลี่ยน คืน True ถ้าเปลี่ยน """
+    text = build_story_bible(novel)
+    fingerprint = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    if StoryBible.objects.filter(novel=novel, fingerprint=fingerprint).exists():
+        return False
+    try:
+        StoryBible.objects.update_or_create(
+            novel=novel, defaults={'text': text, 'fingerprint': fingerprint, 'tokens': estimate_tokens(text)}
+        )
+    except IntegrityError:
+        return False   # อีก request สร้างแถวของนิยายนี้ตัดหน้าไป (ข้อมูลชุดเดียวกัน)
+    # ผลค้นหาที่แคชไว้มีคัมภีร์ฉบับเก่าติดอยู่ -> ให้หมดอายุ
+    bump_versions([novel.pk], [novel.author_id])
+    return True
+
+
+def story_bible(novel_id, owner_id=None):
+    """ ข้อความคัมภีร์ของนิยาย ("" ถ้าไม่มีนิยายนี้ หรือไม่ใช่ของ owner_id) """
+    filters = {'novel_id': novel_id}
+    if owner_id is not None:
+        filters['novel__author_id'] = owner_id
+    text = StoryBible.objects.filter(**filters).values_list('text', flat=True).first()
+    if text is not None:
+        return text
+
+    # นิยายที่มีก่อนฟีเจอร์นี้ / worker ยังไม่ได้สร้าง -> สร้างเลย (แค่อ่าน DB ไม่กี่ query)
+    novels = Novel.objects.filter(pk=novel_id)
+    if owner_id is not None:
+        novels = novels.filter(author_id=owner_id)
+    novel = novels.first()
+    if novel is None:
+        return ""
+    rebuild(novel)
+    return StoryBible.objects.filter(novel=novel).values_list('text', flat=True).first() or ""
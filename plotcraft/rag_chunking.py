@@ -0,0 +1,100 @@
+# rag_chunking.py
+"""
+ตัดเนื้อหายาวๆ (ตอน/ฉาก) เป็นชิ้นเล็กก่อน Embed
+
+paraphrase-multilingual-MiniLM รับได้ประมาณ 128 token ต่อข้อความ เกินกว่านั้นจะถูกตัดทิ้งเงียบๆ
+จึงต้องหั่นให้แต่ละชิ้นพอดีกับโมเดล โดยตัดตามย่อหน้า -> ประโยค (ภาษาไทยใช้ช่องว่างคั่นประโยค)
+และให้ชิ้นที่ติดกันเหลื่อมกันนิดหน่อย (overlap) เพื่อไม่ให้ความหมายขาดตรงรอยต่อ
+"""
+import html
+import re
+
+from django.conf import settings
+from django.utils.html import strip_tags
+
+# ตัวอักษรไทย (U+0E00 - U+0E7F)
+THAI_CHAR_RE = re.compile(r'[\u0e00-\u0e7f]')
+NON_THAI_WORD_RE = re.compile(r'[^\s\u0e00-\u0e7f]+')
+
+# แท็กที่ถือเป็นการขึ้นย่อหน้าใหม่ (เนื้อหาตอนมาจาก Rich Text Editor เป็น HTML)
+BLOCK_TAG_RE = re.compile(r'<\s*(br|/p|/div|/li|/h[1-6]|/blockquote)\b[^>]*>', re.IGNORECASE)
+
+# จุดตัดประโยค: เครื่องหมายจบประโยค หรือช่องว่างที่อยู่หลังตัวอักษรไทย (วิธีเว้นวรรคจบประโยคแบบไทย)
+SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?…”"])\s+|(?<=[\u0e00-\u0e7f])\s+(?=\S)')
+
+# ใช้ประมาณความยาวเมื่อต้องตัดกลางประโยค (ภาษาไทยเฉลี่ยราวๆ 3 ตัวอักษรต่อ token)
+CHARS_PER_TOKEN = 3
+
+
+def html_to_text(value):
+    """ แปลง HTML จาก Editor เป็นข้อความล้วน โดยยังเก็บการขึ้นบรรทัด/ย่อหน้าไว้ """
+    if not value:
+        return ""
+    text = BLOCK_TAG_RE.sub("\n", value)
+    text = html.unescape(strip_tags(text))
+    lines = [" ".join(line.split()) for line in text.splitlines()]
+    return "\n".join(line for line in lines if line)
+
+
+def estimate_tokens(text):
+    """ ประมาณจำนวน token แบบไม่ต้องโหลด Tokenizer (ไทย ~3 ตัวอักษร/token, คำอังกฤษ ~1.3 token/คำ) """
+    thai_chars = len(THAI_CHAR_RE.findall(text))
+    other_words = len(NON_THAI_WORD_RE.findall(text))
+    return int(thai_chars / CHARS_PER_TOKEN + other_words * 1.3) + 1
+
+
+def split_sentences(text):
+    """ แยกย่อหน้า แล้วแยกประโยคในแต่ละย่อหน้า """
+    sentences = []
+    for paragraph in text.split("\n"):
+        paragraph = paragraph.strip()
+        if paragraph:
+            sentences.extend(s for s in SENTENCE_SPLIT_RE.split(paragraph) if s.strip())
+    return sentences
+
+
+def _hard_split(sentence, max_tokens):
+    """ ประโยคเดียวยาวเกินโมเดลรับไหว (ไทยเขียนติดกันยาวๆ) -> ตัดตามจำนวนตัวอักษร """
+    size = max_tokens * CHARS_PER_TOKEN
+    return [sentence[i:i + size] for i in range(0, len(sentence), size)]
+
+
+def chunk_text(text, max_tokens=None, overlap_tokens=None):
+    """ รวมประโยคเป็นชิ้นๆ ไม่เกิน max_tokens โดยชิ้นถัดไปจะยกประโยคท้ายๆ ของชิ้นก่อนมาด้วย (overlap) """
+    if max_tokens is None:
+        max_tokens = getattr(settings, 'RAG_CHUNK_MAX_TOKENS', 110)
+    if overlap_tokens is None:
+        overlap_tokens = getattr(settings, 'RAG_CHUNK_OVERLAP_TOKENS', 20)
+
+    units = []
+    for sentence in split_sentences(text):
+        if estimate_tokens(sentence) > max_tokens:
+            units.extend(_hard_split(sentence, max_tokens))
+        else:
+            units.append(sentence)
+
+    chunks = []
+    current, current_tokens = [], 0
+    for unit in units:
+        unit_tokens = estimate_tokens(unit)
+        if current and current_tokens + unit_tokens > max_tokens:
+            chunks.append(" ".join(current))
+
+            # ยกประโยคท้ายของชิ้นเดิมมาเป็นหัวของชิ้นใหม่ ไม่เกิน overlap_tokens
+            carry, carry_tokens = [], 0
+            for prev in reversed(current):
+                prev_tokens = estimate_tokens(prev)
+                if carry_tokens + prev_tokens > overlap_tokens:
+                    break
+                carry.insert(0, prev)
+                carry_tokens += prev_tokens
+            if carry_tokens + unit_tokens > max_tokens:
+                carry, carry_tokens = [], 0
+            current, current_tokens = carry, carry_tokens
+
+        current.append(unit)
+        current_tokens += unit_tokens
+
+    if current:
+        chunks.append(" ".join(current))
+    return chunks
@@ -0,0 +1,191 @@
+# rag_context.py
+"""
+ประกอบบริบทให้ Prompt ของพี่บก. จากผลค้นหา Vector ให้สั้น ไม่ซ้ำ และไม่เกินงบ token
+
+1. ตัดชิ้นที่ซ้ำ/เกือบซ้ำกันทิ้ง
+2. เลือกชิ้นด้วย MMR (Maximal Marginal Relevance) จาก embedding ที่ Vector Store คืนมาอยู่แล้ว
+   -> ได้ชิ้นที่ตรงคำถามแต่ไม่พูดเรื่องเดียวกันซ้ำๆ
+3. ชิ้นที่ติดกันของ Object เดียวกัน (เช่น chap_12_3, chap_12_4) ต่อเป็นท่อนเดียวและตัดส่วนที่เหลื่อมกัน (overlap) ออก
+4. เรียงตามความสำคัญของประเภท (สรุปนิยาย > ตัวละคร > ฉาก > เนื้อเรื่อง) แล้วใส่จนเต็มงบ token
+"""
+from collections import Counter
+
+from django.conf import settings
+
+from .rag_chunking import CHARS_PER_TOKEN, estimate_tokens
+
+# ยิ่งน้อยยิ่งสำคัญ (ได้ใส่ก่อนเมื่องบเหลือน้อย)
+TYPE_PRIORITY = {
+    "novel_summary": 0, "story_summary": 1, "arc_summary": 2, "character": 3,
+    "chapter_summary": 4, "scene": 5, "content": 6,
+}
+
+TYPE_LABELS = {
+    "character": "👤 [ตัวละคร]",
+    "scene": "🎬 [ฉาก]",
+    "content": "📖 [เนื้อเรื่อง]",
+    "story_summary": "🗂️ [สรุปเรื่อง]",
+    "arc_summary": "🗂️ [สรุปช่วงเรื่อง]",
+    "chapter_summary": "📝 [สรุปตอน]",
+}
+
+# ความยาวขั้นต่ำ (ตัวอักษร) ที่จะถือว่าท้ายชิ้นก่อนกับหัวชิ้นถัดไปเหลื่อมกันจริง
+MIN_OVERLAP_CHARS = 12
+
+
+def _shingles(text, size=4):
+    """ ชุดตัวอักษรติดกันทีละ 4 ตัว (ใช้ได้กับภาษาไทยที่ไม่มีช่องว่างคั่นคำ) """
+    text = " ".join(text.split())
+    return {text[i:i + size] for i in range(max(len(text) - size + 1, 1))}
+
+
+def _similarity(a, b):
+    """ cosine ของเวกเตอร์สองตัว (ไม่ต้องสมมติว่า normalize มาแล้ว) """
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = (sum(x * x for x in a) ** 0.5) * (sum(y * y for y in b) ** 0.5)
+    return dot / norm if norm else 0.0
+
+
+def dedupe(candidates, threshold=None):
+    """ ตัดชิ้นที่ข้อความซ้ำ/เกือบซ้ำกับชิ้นที่อันดับดีกว่า (Jaccard ของ shingle >= threshold) """
+    if threshold is None:
+        threshold = getattr(settings, "RAG_CONTEXT_DEDUP_THRESHOLD", 0.85)
+    kept, kept_shingles = [], []
+    for candidate in candidates:
+        shingles = _shingles(candidate["text"])
+        if any(len(shingles & other) / len(shingles | other) >= threshold for other in kept_shingles):
+            continue
+        kept.append(candidate)
+        kept_shingles.append(shingles)
+    return kept
+
+
+def mmr(candidates, k, lambda_mult=None):
+    """
+    เลือก k ชิ้นด้วย MMR: คะแนน = λ·(ใกล้คำถาม) - (1-λ)·(ใกล้ชิ้นที่เลือกไปแล้วมากสุด)
+    ความใกล้คำถามใช้ relevance (คะแนน RRF ที่ normalize แล้ว) ถ้ามี ไม่งั้นใช้ 1 - cosine distance ที่ Vector Store คืนมา (ตัดให้อยู่ใน 0..1)
+    ถ้าไม่มี embedding จะเรียงตามความใกล้คำถามอย่างเดียว
+    """
+    if lambda_mult is None:
+        lambda_mult = getattr(settings, "RAG_CONTEXT_MMR_LAMBDA", 0.7)
+    remaining = list(candidates)
+    selected = []
+    while remaining and len(selected) < k:
+        vectors = [chosen["embedding"] for chosen in selected if chosen.get("embedding") is not None]
+
+        def score(candidate):
+            relevance = candidate.get("relevance")
+            if relevance is None:
+                # cosine distance 0..2 -> 0..1 ให้อยู่สเกลเดียวกับ redundancy
+                relevance = min(max(1.0 - (candidate.get("distance") or 0.0), 0.0), 1.0)
+            if candidate.get("embedding") is None or not vectors:
+                return relevance
+            redundancy = max(_similarity(candidate["embedding"], vector) for vector in vectors)
+            return lambda_mult * relevance - (1 - lambda_mult) * redundancy
+
+        best = max(remaining, key=score)
+        remaining.remove(best)
+        selected.append(best)
+    return selected
+
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """ รวมหลายรายการอันดับ (เช่น Vector + BM25) ด้วย RRF: คะแนน = Σ 1 / (k + อันดับ) คืน [(id, score), ...] """
+    scores = Counter()
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] += 1.0 / (k + rank)
+    return scores.most_common()
+
+
+def merge_overlap(first, second, min_overlap=MIN_OVERLAP_CHARS):
+    """ ต่อข้อความสองชิ้นที่ท้ายชิ้นแรกซ้ำกับช่วงต้นของชิ้นที่สอง (overlap ตอนหั่น) โดยไม่พิมพ์ส่วนซ้ำสองรอบ """
+    for size in range(min(len(first), len(second)), min_overlap - 1, -1):
+        at = second.find(first[-size:])
+        # ส่วนที่เหลื่อมต้องตามหลังหัวข้อชิ้น (ซึ่งเหมือนกับหัวของชิ้นแรก) ทันที ไม่ใช่ข้อความบังเอิญซ้ำกลางเรื่อง
+        if at != -1 and first.startswith(second[:at]):
+            return first + second[at + size:]
+
+    # ไม่เหลื่อมกัน: ต่อท้ายโดยไม่ต้องพิมพ์บรรทัดหัวข้อที่เหมือนกันซ้ำ
+    first_lines, second_lines = first.split("\n"), second.split("\n")
+    shared = 0
+    while shared < len(second_lines) - 1 and shared < len(first_lines) and first_lines[shared] == second_lines[shared]:
+        shared += 1
+    return first + "\n" + "\n".join(second_lines[shared:])
+
+
+def _merge_adjacent(items):
+    """ ชิ้นของ Object เดียวกันที่เลขชิ้นติดกัน -> ท่อนเดียว (ลำดับตามชิ้นที่ได้อันดับดีสุดของกลุ่ม) """
+    groups = {}
+    order = []
+    for item in items:
+        meta = item["metadata"]
+        if "chunk" not in meta:
+            order.append([item])
+            continue
+        key = (meta.get("type"), meta.get("source_id") or item["id"].rsplit("_", 1)[0])
+        if key not in groups:
+            groups[key] = []
+            order.append(groups[key])
+        groups[key].append(item)
+
+    merged = []
+    for group in order:
+        group.sort(key=lambda item: item["metadata"].get("chunk", -1))
+        run = dict(group[0], ids=[group[0]["id"]])
+        for item in group[1:]:
+            if item["metadata"].get("chunk") == run["metadata"].get("chunk", -2) + 1:
+                run = dict(run, text=merge_overlap(run["text"], item["text"]),
+                           metadata=item["metadata"], ids=run["ids"] + [item["id"]])
+            else:
+                merged.append(run)
+                run = dict(item, ids=[item["id"]])
+        merged.append(run)
+    return merged
+
+
+def truncate_tokens(text, max_tokens):
+    """ ตัดข้อความให้ไม่เกิน max_tokens โดยประมาณ (สรุปนิยาย, ประวัติแชท, คัมภีร์, สรุปตอน) """
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    return text[:max(max_tokens, 1) * CHARS_PER_TOKEN].rstrip() + "…"
+
+
+def assemble_context(summary, candidates, budget=None, max_items=None):
+    """
+    candidates = [{'id', 'text', 'metadata', 'distance', 'embedding', 'relevance'?}, ...] เรียงตามความใกล้คำถาม
+    คืนค่า {'summary': str, 'items': [{'ids', 'type', 'text'}, ...], 'tokens': int}
+    """
+    if budget is None:
+        budget = getattr(settings, "RAG_CONTEXT_MAX_TOKENS", 900)
+    if max_items is None:
+        max_items = getattr(settings, "RAG_CONTEXT_MAX_DOCS", 6)
+
+    # สรุปนิยายได้ใส่ก่อนเสมอ แต่ไม่เกินครึ่งงบ
+    summary = truncate_tokens(summary, budget // 2) if summary else ""
+    used = estimate_tokens(summary) if summary else 0
+
+    candidates = [c for c in candidates if c["metadata"].get("type") != "novel_summary" and c["text"]]
+    chosen = mmr(dedupe(candidates), max_items)
+    passages = _merge_adjacent(chosen)
+
+    items = []
+    for passage in sorted(passages, key=lambda p: TYPE_PRIORITY.get(p["metadata"].get("type"), 9)):
+        tokens = estimate_tokens(passage["text"])
+        if used + tokens > budget:
+            continue
+        used += tokens
+        items.append({"ids": passage["ids"], "type": passage["metadata"].get("type", ""), "text": passage["text"]})
+
+    return {"summary": summary, "items": items, "tokens": used}
+
+
+def format_context(context):
+    """ บริบทที่ประกอบแล้ว -> ข้อความใน Prompt แยกหัวข้อตามประเภท """
+    parts = []
+    if context["summary"]:
+        parts.append(f"📌 [บริบทหลัก: ข้อมูลนิยาย]\n{context['summary']}")
+    for item in context["items"]:
+        label = TYPE_LABELS.get(item["type"], "📎 [ข้อมูลอื่นๆ]")
+        parts.append(f"{label}\n{item['text'].strip()}")
+    return "\n\n".join(parts)
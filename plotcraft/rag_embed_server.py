@@ -0,0 +1,197 @@
+# rag_embed_server.py
+"""
+Embedding Server กลางของทั้งเครื่อง (Unix socket) + Client ที่ RAGService ใช้แทนการโหลดโมเดลเอง
+
+- โมเดลอยู่ใน process เดียว (`python manage.py rag_embed_server`) เพิ่ม gunicorn worker กี่ตัว RAM ก็ไม่เพิ่มตาม
+- คำขอที่เข้ามาพร้อมกันจากทุก worker ถูกรวมเป็น micro-batch (รอไม่เกิน RAG_EMBED_SERVER_MAX_WAIT_MS)
+  แล้ว Embed ทีเดียว -> ใช้ CPU คุ้มกว่าทีละข้อความมาก
+- ระหว่างที่ชุดหนึ่งกำลัง Embed คำขอใหม่จะสะสมเป็นชุดถัดไปเอง
+
+รูปแบบข้อมูลบน socket: ทุก frame = ความยาว 4 ไบต์ (big-endian) + ข้อมูล
+- คำขอ : JSON list ของข้อความ
+- คำตอบ: b"\\x00" + (จำนวน, มิติ) + float32 ทั้งก้อน  หรือ  b"\\x01" + ข้อความ error
+"""
+import asyncio
+import json
+import os
+import socket
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+FRAME = struct.Struct(">I")
+SHAPE = struct.Struct(">II")
+STATUS_OK = b"\x00"
+STATUS_ERROR = b"\x01"
+
+
+# ==================== Server ====================
+
+class EmbeddingServer:
+
+    def __init__(self, model, path, max_batch=64, max_wait_ms=5):
+        self.model = model
+        self.path = str(path)
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.queue = None
+        # โมเดลรันทีละชุดใน thread เดียว (event loop ว่างรับคำขอใหม่ระหว่างนั้น)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embed")
+        self.stats = {"requests": 0, "texts": 0, "batches": 0, "errors": 0}
+
+    async def serve(self):
+        self.queue = asyncio.Queue()
+        if os.path.exists(self.path):
+            os.unlink(self.path)   # socket ค้างจากรอบก่อน (process ตายไม่ได้ลบ)
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+
+        server = await asyncio.start_unix_server(self._handle, path=self.path)
+        os.chmod(self.path, 0o660)
+        batcher = asyncio.ensure_future(self._batch_loop())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            batcher.cancel()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    async def _handle(self, reader, writer):
+        """ 1 connection ต่อ client thread ส่งคำขอต่อกันได้เรื่อยๆ (ตอบตามลำดับ) """
+        try:
+            while True:
+                try:
+                    header = await reader.readexactly(FRAME.size)
+                except asyncio.IncompleteReadError:
+                    break
+                texts = json.loads(await reader.readexactly(FRAME.unpack(header)[0]))
+
+                future = asyncio.get_running_loop().create_future()
+                await self.queue.put((texts, future))
+                try:
+                    vectors = await future
+                    payload = STATUS_OK + SHAPE.pack(*vectors.shape) + vectors.tobytes()
+                except Exception as e:
+                    payload = STATUS_ERROR + str(e).encode("utf-8")
+                writer.write(FRAME.pack(len(payload)) + payload)
+                await writer.drain()
+        except (ConnectionError, ValueError) as e:
+            print(f"⚠️ Embedding client dropped: {e}")
+        finally:
+            writer.close()
+
+    async def _batch_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            # รอคำขอแรก แล้วเก็บคำขอที่ตามมาภายใน max_wait (หรือจนเต็มชุด)
+            pending = [await self.queue.get()]
+            size = len(pending[0][0])
+            deadline = loop.time() + self.max_wait
+            while size < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                pending.append(item)
+                size += len(item[0])
+
+            texts = [text for item_texts, _ in pending for text in item_texts]
+            try:
+                vectors = await loop.run_in_executor(self.executor, self.model.embed_documents, texts)
+                vectors = np.asarray(vectors, dtype=np.float32)
+            except Exception as e:
+                self.stats["errors"] += 1
+                for _, future in pending:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+
+            self.stats["requests"] += len(pending)
+            self.stats["texts"] += len(texts)
+            self.stats["batches"] += 1
+            start = 0
+            for item_texts, future in pending:
+                if not future.done():
+                    future.set_result(vectors[start:start + len(item_texts)])
+                start += len(item_texts)
+
+
+# ==================== Client ====================
+
+class EmbeddingClient:
+    """
+    ใช้แทน Embedding Model ใน RAGService (embed_query / embed_documents เหมือนกัน)
+    1 connection ต่อ thread (ถือค้างไว้ใช้ซ้ำ) ถ้าหลุดจะต่อใหม่ให้อีกครั้งเดียว
+    """
+
+    def __init__(self, path, timeout=30):
+        self.path = str(path)
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.path)
+        return sock
+
+    def _read_exactly(self, sock, size):
+        data = bytearray()
+        while len(data) < size:
+            part = sock.recv(size - len(data))
+            if not part:
+                raise ConnectionError("embedding server closed the connection")
+            data.extend(part)
+        return bytes(data)
+
+    def _request(self, texts):
+        payload = json.dumps(texts, ensure_ascii=False).encode("utf-8")
+        for attempt in range(2):
+            sock = getattr(self._local, "sock", None)
+            try:
+                if sock is None:
+                    sock = self._local.sock = self._connect()
+                sock.sendall(FRAME.pack(len(payload)) + payload)
+                body = self._read_exactly(sock, FRAME.unpack(self._read_exactly(sock, FRAME.size))[0])
+                break
+            except OSError:
+                # connection เก่าตาย (server รีสตาร์ท) -> ทิ้งแล้วต่อใหม่หนึ่งครั้ง
+                if sock is not None:
+                    sock.close()
+                self._local.sock = None
+                if attempt:
+                    raise
+
+        if body[:1] == STATUS_ERROR:
+            raise RuntimeError(f"embedding server: {body[1:].decode('utf-8')}")
+        count, dim = SHAPE.unpack(body[1:1 + SHAPE.size])
+        return np.frombuffer(body[1 + SHAPE.size:], dtype=np.float32).reshape(count, dim)
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        return self._request(list(texts)).tolist()
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def report_stats(server, interval=60):
+    """ พิมพ์สถิติของ server เป็นระยะ (ขนาด micro-batch เฉลี่ย = ได้รวมคำขอจริงแค่ไหน) """
+    last = dict(server.stats)
+    while True:
+        time.sleep(interval)
+        stats = dict(server.stats)
+        batches = stats["batches"] - last["batches"]
+        if batches:
+            texts = stats["texts"] - last["texts"]
+            requests = stats["requests"] - last["requests"]
+            print(f"📊 Embedding server: {requests} requests, {texts} texts in {batches} batches "
+                  f"(avg {texts / batches:.1f} texts/batch)")
+        last = stats
@@ -0,0 +1,194 @@
+# rag_embedding_cache.py
+"""
+แคช Embedding ตาม (ชื่อโมเดล, sha256(ข้อความ))
+
+ชั้นที่ 1: LRU ในหน่วยความจำของแต่ละ process (เร็วสุด)
+ชั้นที่ 2: ไฟล์ SQLite บนดิสก์ที่ทุก gunicorn worker / rag_worker ใช้ร่วมกัน (อยู่รอดข้ามการรีสตาร์ท)
+ข้อความเดิม = เวกเตอร์เดิม จึงไม่ต้องรันโมเดลซ้ำเวลาบันทึกเนื้อหาเดิม, Index ใหม่หลังล้าง Chroma หรือถามคำถามซ้ำ
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+
+
+class EmbeddingCache:
+    """ แคชสองชั้น (LRU + SQLite) พร้อมตัวนับ hit/miss และไล่ของเก่าออกเมื่อไฟล์ใหญ่เกิน max_bytes """
+
+    # เช็คขนาดไฟล์ทุกๆ กี่ครั้งที่เขียน (ไม่ต้อง SUM ทั้งตารางทุกครั้ง)
+    EVICT_CHECK_EVERY = 200
+
+    def __init__(self, path, max_bytes=256 * 1024 * 1024, lru_size=2048):
+        self.path = str(path)
+        self.max_bytes = max_bytes
+        self.lru_size = lru_size
+
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writes = 0
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+    # ==================== SQLite ====================
+
+    def _conn(self):
+        """ 1 connection ต่อ thread (sqlite3 ห้ามใช้ข้าม thread) """
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=5)
+            # WAL: หลาย process อ่านพร้อมกันได้ระหว่างมีคนเขียน
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                " key TEXT PRIMARY KEY,"
+                " vector BLOB NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def make_key(model_name, text):
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{model_name}:{digest}"
+
+    # ==================== LRU ====================
+
+    def _remember(self, key, vector):
+        with self._lock:
+            self._lru[key] = vector
+            self._lru.move_to_end(key)
+            while len(self._lru) > self.lru_size:
+                self._lru.popitem(last=False)
+
+    # ==================== Public API ====================
+
+    def get_many(self, keys):
+        """ คืน dict {key: vector} เฉพาะที่เจอในแคช """
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._lru.get(key)
+                if vector is not None:
+                    self._lru.move_to_end(key)
+                    found[key] = vector
+            self.stats["memory_hits"] += len(found)
+
+        missing = [key for key in keys if key not in found]
+        if missing:
+            try:
+                conn = self._conn()
+                placeholders = ",".join("?" * len(missing))
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", missing
+                ).fetchall()
+                if rows:
+                    with conn:
+                        conn.executemany(
+                            "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                            [(time.time(), key) for key, _ in rows],
+                        )
+                for key, blob in rows:
+                    vector = array("f", blob).tolist()
+                    found[key] = vector
+                    self._remember(key, vector)
+                with self._lock:
+                    self.stats["disk_hits"] += len(rows)
+            except sqlite3.Error as e:
+                print(f"⚠️ Embedding cache read error: {e}")
+
+        with self._lock:
+            self.stats["misses"] += len(keys) - len(found)
+        return found
+
+    def set_many(self, items):
+        """ items = {key: vector} """
+        if not items:
+            return
+        for key, vector in items.items():
+            self._remember(key, list(vector))
+
+        now = time.time()
+        rows = []
+        for key, vector in items.items():
+            blob = array("f", vector).tobytes()
+            rows.append((key, blob, len(blob), now))
+        try:
+            conn = self._conn()
+            with conn:
+                conn.executemany(
+                    "INSERT OR REPLACE INTO embeddings (key, vector, size, last_used) VALUES (?, ?, ?, ?)", rows
+                )
+            self._writes += len(rows)
+            if self._writes >= self.EVICT_CHECK_EVERY:
+                self._writes = 0
+                self.evict()
+        except sqlite3.Error as e:
+            print(f"⚠️ Embedding cache write error: {e}")
+
+    def evict(self):
+        """ ไฟล์ใหญ่เกิน max_bytes -> ลบตัวที่ไม่ได้ใช้นานสุดจนเหลือ ~90% """
+        conn = self._conn()
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM embeddings").fetchone()[0]
+        if total <= self.max_bytes:
+            return 0
+
+        target = int(self.max_bytes * 0.9)
+        removed = 0
+        with conn:
+            for key, size in conn.execute("SELECT key, size FROM embeddings ORDER BY last_used").fetchall():
+                if total <= target:
+                    break
+                conn.execute("DELETE FROM embeddings WHERE key = ?", (key,))
+                total -= size
+                removed += 1
+        with self._lock:
+            self.stats["evictions"] += removed
+        return removed
+
+    def snapshot(self):
+        """ ตัวเลขสถิติ (สำเนา) เช่นไว้แสดงใน log/metrics """
+        with self._lock:
+            stats = dict(self.stats)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        return stats
+
+
+class CachedEmbeddings:
+    """
+    ห่อ Embedding Model (เช่น HuggingFaceEmbeddings) ให้ผ่านแคชก่อน
+    มีเมธอดเหมือน LangChain Embeddings (embed_query / embed_documents) จึงใช้แทนกันได้เลย
+    """
+
+    def __init__(self, inner, cache, model_name):
+        self.inner = inner
+        self.cache = cache
+        self.model_name = model_name
+
+    def embed_documents(self, texts):
+        keys = [self.cache.make_key(self.model_name, text) for text in texts]
+        found = self.cache.get_many(list(dict.fromkeys(keys)))
+
+        # ข้อความที่ยังไม่เคย Embed (ตัดตัวซ้ำในชุดเดียวกันออกด้วย)
+        todo = {}
+        for key, text in zip(keys, texts):
+            if key not in found and key not in todo:
+                todo[key] = text
+        if todo:
+            vectors = self.inner.embed_documents(list(todo.values()))
+            fresh = dict(zip(todo.keys(), vectors))
+            self.cache.set_many(fresh)
+            found.update(fresh)
+
+        return [found[key] for key in keys]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
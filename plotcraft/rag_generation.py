@@ -0,0 +1,171 @@
+# rag_generation.py
+"""
+ชั้นกลางระหว่าง view กับ LLM สำหรับงาน "เจน" (ร่างฉาก, ข้อมูลตัวละคร)
+
+- Single-flight: คำขอที่เหมือนกัน (user เดียวกัน + Prompt เดียวกัน) ที่เข้ามาระหว่างที่อันแรกยังรอ LLM อยู่
+  (เช่น กดปุ่มรัวๆ) จะรอผลจากการเรียก LLM ครั้งเดียวกัน ไม่ยิงซ้ำ
+- แคชผลที่เสร็จแล้วไว้สั้นๆ (RAG_GENERATION_CACHE_TTL) ใน cache 'rag' ที่ทุก worker ใช้ร่วมกัน
+- เก็บสถิติ hit / miss / coalesced ต่อประเภทงาน
+
+ผลที่จบด้วย Exception จะไม่ถูกแคช (ครั้งหน้าลองใหม่ได้)
+"""
+import asyncio
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class _StreamFlight:
+    """ Stream หนึ่งเส้นที่หลายคำขอฟังร่วมกัน: เก็บท่อนที่ได้แล้วไว้ให้คนที่มาทีหลังอ่านย้อนได้ """
+
+    def __init__(self):
+        self.chunks = []
+        self.done = False
+        self.error = None
+        self.changed = asyncio.Event()
+        self.subscribers = 0
+        self.task = None
+
+    def notify(self):
+        changed, self.changed = self.changed, asyncio.Event()
+        changed.set()
+
+
+class GenerationLayer:
+
+    def __init__(self):
+        self._tasks = {}     # key -> asyncio.Task ของ run()
+        self._streams = {}   # key -> _StreamFlight ของ stream()
+        self._lock = threading.Lock()
+        self.stats = {}
+
+    # ==================== Helpers ====================
+
+    @staticmethod
+    def make_key(kind, user_id, prompt):
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        return f"rag:gen:{kind}:{user_id}:{digest}"
+
+    def _count(self, kind, field):
+        with self._lock:
+            counters = self.stats.setdefault(kind, {"hits": 0, "misses": 0, "coalesced": 0})
+            counters[field] += 1
+
+    def snapshot(self):
+        """ ตัวเลขสถิติ (สำเนา) ต่อประเภทงาน พร้อม hit_rate (นับ coalesced เป็น hit เพราะไม่ได้เรียก LLM) """
+        with self._lock:
+            stats = {kind: dict(counters) for kind, counters in self.stats.items()}
+        for counters in stats.values():
+            total = counters["hits"] + counters["misses"] + counters["coalesced"]
+            counters["hit_rate"] = (counters["hits"] + counters["coalesced"]) / total if total else 0.0
+        return stats
+
+    @staticmethod
+    def _ttl():
+        return getattr(settings, "RAG_GENERATION_CACHE_TTL", 300)
+
+    # ==================== ผลลัพธ์ก้อนเดียว ====================
+
+    async def run(self, kind, user_id, prompt, call):
+        """
+        คืนผลของ await call() โดยเรียกจริงไม่เกินหนึ่งครั้งต่อ (kind, user, prompt) ที่กำลังทำอยู่/ยังอยู่ในแคช
+        call ต้องคืนค่าที่ pickle ได้ (str, dict)
+        """
+        key = self.make_key(kind, user_id, prompt)
+        cached = await caches["rag"].aget(key)
+        if cached is not None:
+            self._count(kind, "hits")
+            print(f"⚡ Generation cache hit ({kind})")
+            return cached
+
+        task = self._tasks.get(key)
+        if task is not None:
+            self._count(kind, "coalesced")
+            print(f"🔗 Joined in-flight generation ({kind})")
+        else:
+            self._count(kind, "misses")
+            task = asyncio.ensure_future(self._run_and_cache(key, call))
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+
+        # shield: คำขอหนึ่งถูกยกเลิก (ผู้ใช้ปิดหน้า) ไม่ทำให้คนอื่นที่รอผลเดียวกันพังไปด้วย
+        return await asyncio.shield(task)
+
+    async def _run_and_cache(self, key, call):
+        result = await call()
+        if result is not None:
+            await caches["rag"].aset(key, result, self._ttl())
+        return result
+
+    # ==================== Stream ====================
+
+    async def stream(self, kind, user_id, prompt, open_stream):
+        """
+        เหมือน run แต่สำหรับ Stream: open_stream() คืน async iterator ของข้อความ
+        ทุกคำขอที่เหมือนกันได้ท่อนเดียวกันตามลำดับ (คนมาทีหลังได้ท่อนที่ผ่านไปแล้วก่อน)
+        ถ้าทุกคนตัดการเชื่อมต่อก่อนจบ จะยกเลิกการเรียก LLM ทันที
+        """
+        key = self.make_key(kind, user_id, prompt)
+        cached = await caches["rag"].aget(key)
+        if cached is not None:
+            self._count(kind, "hits")
+            print(f"⚡ Generation cache hit ({kind})")
+            yield cached
+            return
+
+        flight = self._streams.get(key)
+        if flight is not None:
+            self._count(kind, "coalesced")
+            print(f"🔗 Joined in-flight generation ({kind})")
+        else:
+            self._count(kind, "misses")
+            flight = _StreamFlight()
+            flight.task = asyncio.ensure_future(self._pump(key, flight, open_stream))
+            self._streams[key] = flight
+
+        flight.subscribers += 1
+        position = 0
+        try:
+            while True:
+                changed = flight.changed
+                while position < len(flight.chunks):
+                    yield flight.chunks[position]
+                    position += 1
+                if flight.done:
+                    break
+                await changed.wait()
+            if flight.error is not None:
+                raise flight.error
+        finally:
+            flight.subscribers -= 1
+            if flight.subscribers == 0 and not flight.done:
+                # ไม่มีใครฟังแล้ว: เลิกเรียก LLM และไม่ให้คำขอใหม่มาเกาะเส้นที่กำลังถูกยกเลิก
+                self._streams.pop(key, None)
+                flight.task.cancel()
+
+    async def _pump(self, key, flight, open_stream):
+        """ อ่าน Stream จาก LLM เส้นเดียว แล้วกระจายให้ทุกคนที่ฟังอยู่ (จบแล้วค่อยแคชทั้งก้อน) """
+        stream = open_stream()
+        try:
+            async for text in stream:
+                flight.chunks.append(text)
+                flight.notify()
+            if flight.chunks:
+                await caches["rag"].aset(key, "".join(flight.chunks), self._ttl())
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            flight.error = e
+        finally:
+            if self._streams.get(key) is flight:
+                del self._streams[key]
+            flight.done = True
+            flight.notify()
+            if hasattr(stream, "aclose"):
+                await stream.aclose()
+
+
+# ใช้ร่วมกันทั้ง process (1 event loop ต่อ ASGI worker)
+generation = GenerationLayer()
@@ -0,0 +1,190 @@
+# rag_lexical.py
+"""
+ดัชนีคำ (BM25) ของเอกสาร RAG เก็บเป็นไฟล์ SQLite ในเครื่อง แยกตามเจ้าของ (owner_id)
+
+Embedding (MiniLM) จับ "ความหมาย" ได้ดี แต่มักพลาดชื่อเฉพาะที่นักเขียนแต่งขึ้นเอง (ชื่อตัวละคร, ชื่อเมือง, ชื่อดาบ)
+ดัชนีคำจึงช่วยหาเอกสารที่มีคำนั้นตรงๆ แล้วนำไปรวมอันดับกับผล Vector (Reciprocal Rank Fusion)
+
+- ตัดคำไทยด้วย PyThaiNLP (newmm) ถ้าติดตั้งไว้ ไม่งั้นใช้ bigram ของตัวอักษรไทยแทน
+- อัปเดตทีละเอกสารพร้อมกับตอนเขียน Vector Store (upsert / delete) ไม่ต้องสร้างใหม่ทั้งก้อน
+"""
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+
+from django.conf import settings
+
+# ช่วงตัวอักษรไทย กับ คำภาษาอื่น (ตัวอักษร/ตัวเลข)
+TOKEN_RUN_RE = re.compile(r'[\u0e00-\u0e7f]+|[^\W_]+')
+THAI_RUN_RE = re.compile(r'^[\u0e00-\u0e7f]+$')
+
+# คำที่แทบทุกเอกสาร/คำถามมี ไม่ช่วยแยกเอกสาร
+STOPWORDS = {
+    "ที่", "และ", "ของ", "ใน", "การ", "เป็น", "ได้", "ให้", "มี", "ไม่", "ว่า", "จะ", "ก็", "กับ", "แล้ว",
+    "นี้", "นั้น", "อะไร", "ยังไง", "อย่างไร", "ไหม", "มั้ย", "หรือ", "ครับ", "ค่ะ", "คะ", "นะ", "จ้า",
+    "the", "a", "an", "of", "and", "or", "to", "in", "is", "what", "does", "do", "how",
+}
+
+_segmenter = None
+_segmenter_lock = threading.Lock()
+
+
+def _thai_segmenter():
+    """ ตัวตัดคำไทย (โหลดครั้งแรกที่ใช้) คืนค่า (ชื่อ, ฟังก์ชัน) """
+    global _segmenter
+    if _segmenter is None:
+        with _segmenter_lock:
+            if _segmenter is None:
+                try:
+                    from pythainlp.tokenize import word_tokenize
+
+                    _segmenter = ("newmm", lambda text: word_tokenize(text, engine="newmm", keep_whitespace=False))
+                except ImportError:
+                    _segmenter = ("bigram", lambda text: [text[i:i + 2] for i in range(len(text) - 1)] or [text])
+    return _segmenter
+
+
+def tokenize(text):
+    """ ข้อความ -> รายการคำ (ตัวเล็ก, ตัดคำไทย, ตัด stopword) """
+    _, segment = _thai_segmenter()
+    tokens = []
+    for run in TOKEN_RUN_RE.findall((text or "").lower()):
+        words = segment(run) if THAI_RUN_RE.match(run) else [run]
+        tokens.extend(word for word in words if word.strip() and word not in STOPWORDS)
+    return tokens
+
+
+class LexicalIndex:
+    """ Inverted index + คะแนน BM25 (SQLite ใช้ร่วมกันทุก process, connection แยกต่อ thread) """
+
+    K1 = 1.5
+    B = 0.75
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._local = threading.local()
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.executescript(
+                "CREATE TABLE IF NOT EXISTS docs ("
+                " doc_id TEXT PRIMARY KEY, owner_id TEXT, novel_id TEXT, length INTEGER NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS docs_owner ON docs (owner_id, novel_id);"
+                "CREATE INDEX IF NOT EXISTS docs_novel ON docs (novel_id);"
+                "CREATE TABLE IF NOT EXISTS postings ("
+                " term TEXT NOT NULL, doc_id TEXT NOT NULL, tf INTEGER NOT NULL, PRIMARY KEY (term, doc_id));"
+                "CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc_id);"
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);"
+            )
+            self._check_segmenter(conn)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _check_segmenter(conn):
+        """ ดัชนีที่สร้างด้วยตัวตัดคำคนละแบบจะหาคำไม่เจอ -> เตือนให้ rag_reindex ใหม่ """
+        name, _ = _thai_segmenter()
+        row = conn.execute("SELECT value FROM meta WHERE key = 'segmenter'").fetchone()
+        if row is None:
+            with conn:
+                conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('segmenter', ?)", (name,))
+        elif row[0] != name:
+            print(f"⚠️ Lexical index was built with '{row[0]}' but now using '{name}' — run rag_reindex")
+
+    # ==================== Write ====================
+
+    def upsert(self, docs):
+        """ docs = [(doc_id, content, metadata), ...] แทนที่ของเดิมของ doc_id เดียวกัน """
+        if not docs:
+            return
+        conn = self._conn()
+        ids = [doc_id for doc_id, _, _ in docs]
+        with conn:
+            self._delete_ids(conn, ids)
+            for doc_id, content, metadata in docs:
+                counts = Counter(tokenize(content))
+                conn.execute(
+                    "INSERT INTO docs (doc_id, owner_id, novel_id, length) VALUES (?, ?, ?, ?)",
+                    (doc_id, metadata.get("owner_id", ""), metadata.get("novel_id", ""), sum(counts.values())),
+                )
+                conn.executemany(
+                    "INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)",
+                    [(term, doc_id, tf) for term, tf in counts.items()],
+                )
+
+    @staticmethod
+    def _delete_ids(conn, ids):
+        for start in range(0, len(ids), 500):
+            part = ids[start:start + 500]
+            placeholders = ",".join("?" * len(part))
+            conn.execute(f"DELETE FROM postings WHERE doc_id IN ({placeholders})", part)
+            conn.execute(f"DELETE FROM docs WHERE doc_id IN ({placeholders})", part)
+
+    def delete(self, ids=None, novel_id=None, owner_id=None):
+        """ ลบตาม id หรือทั้งนิยาย/ทั้งผู้ใช้ (แบบเดียวกับ collection.delete) """
+        conn = self._conn()
+        with conn:
+            if ids:
+                self._delete_ids(conn, list(ids))
+            for column, value in (("novel_id", novel_id), ("owner_id", owner_id)):
+                if value is not None:
+                    conn.execute(
+                        f"DELETE FROM postings WHERE doc_id IN (SELECT doc_id FROM docs WHERE {column} = ?)",
+                        (str(value),),
+                    )
+                    conn.execute(f"DELETE FROM docs WHERE {column} = ?", (str(value),))
+
+    def doc_ids(self, owner_id, novel_id=None):
+        """ id ของเอกสารทั้งหมดของ owner (และนิยาย) นี้ในดัชนี (ใช้ตรวจความตรงกันกับ Vector Store) """
+        scope = "owner_id = ?" + (" AND novel_id = ?" if novel_id else "")
+        params = [str(owner_id)] + ([str(novel_id)] if novel_id else [])
+        return {row[0] for row in self._conn().execute(f"SELECT doc_id FROM docs WHERE {scope}", params)}
+
+    # ==================== Search ====================
+
+    def search(self, query, owner_id, novel_id=None, k=10):
+        """ คืน [(doc_id, score), ...] เรียงจากคะแนน BM25 มากไปน้อย เฉพาะเอกสารของ owner (และนิยาย) นี้ """
+        terms = set(tokenize(query))
+        if not terms:
+            return []
+
+        conn = self._conn()
+        scope = "d.owner_id = ?" + (" AND d.novel_id = ?" if novel_id else "")
+        params = [str(owner_id)] + ([str(novel_id)] if novel_id else [])
+
+        total, avg_length = conn.execute(
+            f"SELECT COUNT(*), AVG(length) FROM docs d WHERE {scope}", params
+        ).fetchone()
+        if not total:
+            return []
+        avg_length = avg_length or 1.0
+
+        scores = Counter()
+        for term in terms:
+            rows = conn.execute(
+                f"SELECT p.doc_id, p.tf, d.length FROM postings p JOIN docs d ON d.doc_id = p.doc_id"
+                f" WHERE p.term = ? AND {scope}",
+                [term] + params,
+            ).fetchall()
+            if not rows:
+                continue
+            idf = math.log(1 + (total - len(rows) + 0.5) / (len(rows) + 0.5))
+            for doc_id, tf, length in rows:
+                norm = tf + self.K1 * (1 - self.B + self.B * length / avg_length)
+                scores[doc_id] += idf * tf * (self.K1 + 1) / norm
+
+        return scores.most_common(k)
+
+
+def lexical_index():
+    """ ดัชนีคำตาม settings (คืน None ถ้าปิดไว้ด้วย RAG_LEXICAL_INDEX_PATH ว่าง) """
+    path = getattr(settings, "RAG_LEXICAL_INDEX_PATH", None)
+    return LexicalIndex(path) if path else None
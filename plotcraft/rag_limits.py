@@ -0,0 +1,176 @@
+# rag_limits.py
+"""
+กันไม่ให้คำขอ AI ของผู้ใช้คนเดียว (หรือคลื่นคำขอช่วงพีค) กินทรัพยากรจนหน้าอื่นของเว็บช้าตาม
+
+1. Token bucket ต่อผู้ใช้ (AiRateBucket): ขอถี่เกิน -> 429 ทันที พร้อม Retry-After ว่าต้องรอกี่วินาที
+2. จำนวนคำขอ AI ที่ทำพร้อมกันทั้งระบบ (AiSlot, RAG_AI_MAX_CONCURRENCY ช่อง ใช้ร่วมกันทุก worker ผ่าน DB)
+   ช่องเต็ม -> รอคิวสั้นๆ (ไม่เกิน RAG_AI_QUEUE_WAIT_SECONDS, คิวยาวไม่เกิน RAG_AI_QUEUE_SIZE ต่อ process)
+   ยังไม่ว่าง/คิวเต็ม -> 429 ทิ้งคำขอไปเลย (load shedding) ดีกว่าให้ทุกคนรอจน timeout
+การรอคิวเป็นแค่ coroutine ที่หลับอยู่ ไม่จอง thread หรือ worker
+"""
+import asyncio
+import math
+import uuid
+from datetime import timedelta
+from functools import wraps
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import F, Q, Value
+from django.db.models.functions import Least
+from django.http import JsonResponse
+from django.utils import timezone
+
+from .models import AiRateBucket, AiSlot
+from .rag_metrics import registry
+from .rag_service import rag_service
+
+registry.define("plotcraft_ai_rejected_total", "counter", "AI requests rejected with 429, by reason")
+
+QUEUE_POLL_SECONDS = 0.2
+# จำนวนครั้งที่ลองอัปเดตแบบมีเงื่อนไขใหม่ เมื่อมีคำขออื่นแก้แถวเดียวกันตัดหน้า
+CAS_ATTEMPTS = 5
+
+# จำนวนคำขอที่กำลังรอช่องอยู่ใน process นี้
+_waiting = 0
+
+
+# ==================== Token bucket ต่อผู้ใช้ ====================
+
+def take_token(user_id):
+    """
+    ใช้ 1 token ของผู้ใช้ คืน 0 ถ้าได้ ไม่งั้นคืนจำนวนวินาทีที่ต้องรอจนมี token
+    อัปเดตแบบมีเงื่อนไข (ค่าต้องยังเป็นค่าที่อ่านมา) ไม่ต้องล็อกแถว ถ้ามีคำขออื่นแทรกก็อ่านใหม่แล้วคิดใหม่
+    """
+    burst = getattr(settings, 'RAG_AI_USER_BURST', 5)
+    rate = getattr(settings, 'RAG_AI_USER_RATE_PER_MINUTE', 12) / 60
+
+    for _ in range(CAS_ATTEMPTS):
+        now = timezone.now()
+        bucket = AiRateBucket.objects.filter(user_id=user_id).first()
+        if bucket is None:
+            try:
+                AiRateBucket.objects.create(user_id=user_id, tokens=burst - 1, updated_at=now)
+                return 0
+            except IntegrityError:
+                continue   # อีก request สร้างถังของผู้ใช้คนเดียวกันตัดหน้าไป -> อ่านใหม่
+
+        elapsed = max((now - bucket.updated_at).total_seconds(), 0)
+        tokens = min(burst, bucket.tokens + elapsed * rate)
+        if tokens < 1:
+            return (1 - tokens) / rate   # ไม่ต้องเขียนอะไร (เวลาที่ผ่านไปจะถูกนับตอนคำขอถัดไป)
+        claimed = AiRateBucket.objects.filter(
+            pk=bucket.pk, tokens=bucket.tokens, updated_at=bucket.updated_at
+        ).update(tokens=tokens - 1, updated_at=now)
+        if claimed:
+            return 0
+    return 1 / rate   # แย่งกันหนักมาก = ผู้ใช้คนนี้ยิงถี่อยู่แล้ว
+
+
+def refund_token(user_id):
+    """ คืน token (คำขอถูกทิ้งเพราะระบบเต็ม ไม่ใช่เพราะผู้ใช้ขอถี่) """
+    burst = getattr(settings, 'RAG_AI_USER_BURST', 5)
+    AiRateBucket.objects.filter(user_id=user_id).update(tokens=Least(F('tokens') + 1, Value(float(burst))))
+
+
+# ==================== ช่องทำงานพร้อมกันทั้งระบบ ====================
+
+def acquire_slot(holder):
+    """ จองช่องว่างหนึ่งช่อง คืน id ของช่อง หรือ None ถ้าเต็ม """
+    capacity = getattr(settings, 'RAG_AI_MAX_CONCURRENCY', 16)
+    lease = timedelta(seconds=getattr(settings, 'RAG_AI_SLOT_LEASE_SECONDS', 300))
+    now = timezone.now()
+
+    if AiSlot.objects.filter(pk__lte=capacity).count() < capacity:
+        existing = set(AiSlot.objects.filter(pk__lte=capacity).values_list('pk', flat=True))
+        AiSlot.objects.bulk_create(
+            [AiSlot(pk=pk) for pk in range(1, capacity + 1) if pk not in existing], ignore_conflicts=True
+        )
+
+    # ไม่ล็อกแถว: เลือกช่องว่างมาแล้ว "ยึด" ด้วย UPDATE ที่มีเงื่อนไขว่ายังว่างอยู่ ช่องไหนโดนตัดหน้าก็ลองช่องถัดไป
+    free = list(
+        AiSlot.objects.filter(Q(leased_until__isnull=True) | Q(leased_until__lt=now), pk__lte=capacity)
+        .order_by('?').values_list('pk', flat=True)[:CAS_ATTEMPTS]
+    )
+    for pk in free:
+        claimed = AiSlot.objects.filter(
+            Q(leased_until__isnull=True) | Q(leased_until__lt=now), pk=pk
+        ).update(holder=holder, leased_until=now + lease)
+        if claimed:
+            return pk
+    return None
+
+
+def release_slot(slot_id, holder):
+    AiSlot.objects.filter(pk=slot_id, holder=holder).update(holder='', leased_until=None)
+
+
+def _too_many(reason, message, retry_after):
+    registry.inc("plotcraft_ai_rejected_total", {"reason": reason})
+    response = JsonResponse({'success': False, 'error': message}, status=429)
+    response['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+# ==================== decorator ของ async view ====================
+
+def ai_rate_limited(view):
+    """
+    ใส่หลัง @login_required ของ view AI (async): เช็คโควตาผู้ใช้ -> จองช่อง (รอคิวสั้นๆ) -> ทำงาน -> คืนช่อง
+    response แบบ stream จะคืนช่องเมื่อ stream จบ (หรือ client ตัดการเชื่อมต่อ)
+    """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        global _waiting
+        if request.method != "POST":
+            return await view(request, *args, **kwargs)   # view ตอบ 405 เอง ไม่ต้องเสียโควตา
+        user = await request.auser()
+
+        wait = await rag_service.run_blocking(take_token, user.pk)
+        if wait:
+            return _too_many('user_rate', "ขอถี่ไปหน่อยนะคะ พักสักครู่แล้วลองใหม่", wait)
+
+        holder = uuid.uuid4().hex
+        slot_id = await rag_service.run_blocking(acquire_slot, holder)
+        if slot_id is None:
+            queue_wait = getattr(settings, 'RAG_AI_QUEUE_WAIT_SECONDS', 3)
+            if _waiting < getattr(settings, 'RAG_AI_QUEUE_SIZE', 32) and queue_wait > 0:
+                _waiting += 1
+                try:
+                    deadline = asyncio.get_running_loop().time() + queue_wait
+                    while slot_id is None and asyncio.get_running_loop().time() < deadline:
+                        await asyncio.sleep(QUEUE_POLL_SECONDS)
+                        slot_id = await rag_service.run_blocking(acquire_slot, holder)
+                finally:
+                    _waiting -= 1
+            if slot_id is None:
+                await rag_service.run_blocking(refund_token, user.pk)
+                return _too_many('overloaded', "ตอนนี้มีคนใช้ AI เยอะมาก ลองใหม่อีกครั้งในอีกสักครู่นะคะ",
+                                 getattr(settings, 'RAG_AI_QUEUE_WAIT_SECONDS', 3) or 1)
+
+        try:
+            response = await view(request, *args, **kwargs)
+        except BaseException:
+            await rag_service.run_blocking(release_slot, slot_id, holder)
+            raise
+
+        if not response.streaming:
+            await rag_service.run_blocking(release_slot, slot_id, holder)
+            return response
+
+        content = response.streaming_content
+
+        async def released():
+            try:
+                async for part in content:
+                    yield part
+            finally:
+                try:
+                    if hasattr(content, "aclose"):
+                        await content.aclose()   # ปิด stream ชั้นใน (-> LLM หยุด gen) ก่อนคืนช่อง
+                finally:
+                    await rag_service.run_blocking(release_slot, slot_id, holder)
+
+        response.streaming_content = released()
+        return response
+    return wrapper
@@ -0,0 +1,135 @@
+# rag_memory.py
+"""
+ความจำของแชทพี่บก. (เก็บฝั่ง server ต่อผู้ใช้ + นิยาย) ให้คุยต่อเนื่องได้โดย Prompt ไม่โตตามความยาวบทสนทนา
+
+- turn ล่าสุด RAG_CHAT_RECENT_TURNS อัน ใส่ Prompt แบบเต็มๆ (ตัดอันที่ยาวมากเหลือ RAG_CHAT_TURN_MAX_TOKENS)
+- turn ที่เก่ากว่านั้นรอไว้ก่อน จนรวมกันเกิน RAG_CHAT_SUMMARY_TRIGGER_TOKENS ค่อยให้ LLM ย่อรวมเข้ากับสรุปเดิม
+  ทีเดียว (ไม่ได้สรุปใหม่ทุก turn) สรุปยาวไม่เกิน RAG_CHAT_SUMMARY_MAX_TOKENS แล้วลบ turn ที่ย่อไปแล้วทิ้ง
+=> ส่วนประวัติใน Prompt ไม่เกิน สรุป + trigger + recent x turn max โดยประมาณ ไม่ว่าจะคุยกันกี่ร้อย turn
+"""
+from django.conf import settings
+from django.db import transaction
+
+from .models import ChatSession, ChatTurn, Novel
+from .rag_chunking import estimate_tokens
+from .rag_context import truncate_tokens
+
+ROLE_LABELS = {ChatTurn.ROLE_USER: "น้อง", ChatTurn.ROLE_EDITOR: "พี่"}
+
+
+def _recent_turns():
+    return getattr(settings, 'RAG_CHAT_RECENT_TURNS', 6)
+
+
+def _own_novel_id(user_id, novel_id):
+    """ novel_id มาจาก client -> ใช้ได้เฉพาะนิยายของผู้ใช้คนนี้ ไม่งั้นถือเป็นแชททั่วไป """
+    try:
+        novel_id = int(novel_id)
+    except (TypeError, ValueError):
+        return None
+    return novel_id if Novel.objects.filter(pk=novel_id, author_id=user_id).exists() else None
+
+
+def get_session(user_id, novel_id=None, create=True):
+    novel_id = _own_novel_id(user_id, novel_id)
+    if create:
+        try:
+            # unique (user, novel): สองคำขอแรกพร้อมกันได้แถวเดียวกัน (get_or_create จับ IntegrityError แล้ว get ใหม่)
+            return ChatSession.objects.get_or_create(user_id=user_id, novel_id=novel_id)[0]
+        except ChatSession.MultipleObjectsReturned:
+            # แชททั่วไปบน MySQL (ไม่บังคับ constraint แบบมีเงื่อนไข) อาจมีซ้ำ -> ใช้อันแรก
+            pass
+    return ChatSession.objects.filter(user_id=user_id, novel_id=novel_id).order_by('pk').first()
+
+
+def recent_turns(session):
+    """ turn ล่าสุดที่ยังไม่ถูกย่อ (เรียงเก่า -> ใหม่) """
+    turns = session.turns.filter(pk__gt=session.summarized_until).order_by('-pk')[:_recent_turns()]
+    return list(reversed(turns))
+
+
+def format_history(session):
+    """ ส่วนประวัติของ Prompt: สรุปบทสนทนาเก่า + turn ล่าสุด ("" ถ้ายังไม่เคยคุย) """
+    if session is None:
+        return ""
+    max_tokens = getattr(settings, 'RAG_CHAT_TURN_MAX_TOKENS', 400)
+    lines = []
+    if session.summary:
+        lines.append(f"[สรุปที่คุยกันก่อนหน้านี้]\n{session.summary}")
+    turns = recent_turns(session)
+    if turns:
+        lines.append("[ข้อความล่าสุด]")
+        lines.extend(f"{ROLE_LABELS[turn.role]}: {truncate_tokens(turn.content, max_tokens)}" for turn in turns)
+    return "\n".join(lines)
+
+
+def remember(session, user_message, reply):
+    """ บันทึกคำถาม-คำตอบหนึ่งคู่ """
+    ChatTurn.objects.bulk_create([
+        ChatTurn(session=session, role=ChatTurn.ROLE_USER, content=user_message, tokens=estimate_tokens(user_message)),
+        ChatTurn(session=session, role=ChatTurn.ROLE_EDITOR, content=reply, tokens=estimate_tokens(reply)),
+    ])
+    session.save(update_fields=['updated_at'])
+
+
+def _pending(session):
+    """ turn ที่ยังไม่ถูกย่อ และเก่าเกินกว่าจะอยู่ในกลุ่ม turn ล่าสุด (ถึงคิวย่อ) """
+    turns = list(session.turns.filter(pk__gt=session.summarized_until).order_by('pk'))
+    keep = _recent_turns()
+    return turns[:-keep] if keep else turns
+
+
+def needs_compression(session):
+    trigger = getattr(settings, 'RAG_CHAT_SUMMARY_TRIGGER_TOKENS', 600)
+    return sum(turn.tokens for turn in _pending(session)) >= trigger
+
+
+def build_summary_prompt(summary, turns, max_tokens):
+    transcript = "\n".join(f"{ROLE_LABELS[turn.role]}: {turn.content}" for turn in turns)
+    return f"""
+    สรุปบทสนทนาระหว่าง "พี่บก." กับน้องนักเขียน เพื่อใช้เป็นความจำของพี่บก. ในการคุยครั้งต่อไป
+
+    สรุปเดิม:
+    {summary or "(ยังไม่มี)"}
+
+    บทสนทนาที่เพิ่มเข้ามา:
+    {transcript}
+
+    คำสั่ง:
+    - รวมสรุปเดิมกับบทสนทนาที่เพิ่มเข้ามาเป็นสรุปเดียว ยาวไม่เกินประมาณ {max_tokens * 3} ตัวอักษร
+    - เก็บ: ตัวละคร/พล็อต/ฉากที่คุยถึง, สิ่งที่น้องตัดสินใจแล้ว, ไอเดียที่พี่เสนอและน้องชอบ, คำถามที่ยังค้างอยู่
+    - ตัดคำทักทาย คำชม และรายละเอียดที่ไม่มีผลกับงานเขียนทิ้ง
+    - เขียนเป็นข้อสั้นๆ ภาษาไทย ไม่ต้องมีคำเกริ่น
+    """
+
+
+def compress(session_id, summarize):
+    """
+    ย่อ turn ที่ถึงคิวรวมเข้ากับสรุปเดิม (summarize = ฟังก์ชันรับ Prompt คืนข้อความ) คืน True ถ้าย่อแล้ว
+    ไม่ล็อกระหว่างรอ LLM: ตอนบันทึกเช็คว่าไม่มีใครย่อตัดหน้าไปก่อน (summarized_until ยังเท่าเดิม)
+    """
+    session = ChatSession.objects.filter(pk=session_id).first()
+    if session is None or not needs_compression(session):
+        return False
+
+    turns = _pending(session)
+    max_tokens = getattr(settings, 'RAG_CHAT_SUMMARY_MAX_TOKENS', 300)
+    summary = summarize(build_summary_prompt(session.summary, turns, max_tokens))
+    summary = truncate_tokens(str(summary).strip(), max_tokens)
+
+    with transaction.atomic():
+        updated = ChatSession.objects.filter(pk=session.pk, summarized_until=session.summarized_until).update(
+            summary=summary, summarized_until=turns[-1].pk
+        )
+        if not updated:
+            return False
+        ChatTurn.objects.filter(session_id=session.pk, pk__lte=turns[-1].pk).delete()
+    print(f"🧠 Chat memory compressed: session {session.pk}, {len(turns)} turns -> ~{estimate_tokens(summary)} tokens")
+    return True
+
+
+def reset(user_id, novel_id=None):
+    """ ล้างความจำแชทของผู้ใช้ในนิยายนี้ (เริ่มคุยใหม่) """
+    session = get_session(user_id, novel_id, create=False)
+    if session is not None:
+        session.delete()
@@ -0,0 +1,293 @@
+# rag_mentions.py
+"""
+ดัชนีการเอ่ยชื่อ (EntityMention): ตัวละคร/สถานที่/ไอเทม ถูกพูดถึงในตอนหรือฉากไหน
+
+- ชื่อ + ชื่อเล่นของทุกสิ่งในนิยายรวมเป็น Aho-Corasick automaton เดียว สแกนข้อความรอบเดียวเจอทุกชื่อ
+  (ไทยไม่มีช่องว่างคั่นคำ จึงจับแบบ substring / ชื่ออังกฤษต้องไม่ติดตัวอักษรอื่น)
+- บันทึกตอน/ฉาก -> สแกนเฉพาะเอกสารนั้นใหม่ (index_document)
+- แก้ชื่อ/เพิ่มตัวละคร -> ให้ DB กรองตอนที่มีชื่อนั้นก่อน แล้วสแกนแค่ตอนเหล่านั้น (index_entity)
+- ใช้ทำรายการ "ปรากฏตัวใน..." ของหน้ารายละเอียด และพาคำถามที่เอ่ยชื่อไปหาเอกสารที่ถูกต้องโดยไม่ต้อง Embed
+"""
+import re
+import threading
+from collections import OrderedDict, deque
+
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+from .models import Chapter, Character, EntityMention, Item, Location, Novel, RagVersion, Scene
+from .rag_chunking import html_to_text
+from .rag_retrieval_cache import bump_scopes
+
+# ชนิด (= ชื่อ field ใน EntityMention) -> Model
+ENTITY_TYPES = {
+    "character": Character,
+    "location": Location,
+    "item": Item,
+}
+
+# ชื่อเล่นหลายชื่อในช่องเดียว เช่น "มิ, มิรา / Mira"
+ALIAS_SPLIT_RE = re.compile(r"\s*[,/;|]\s*")
+WORD_CHAR_RE = re.compile(r"[a-z0-9]")
+
+# ชื่อสั้นกว่านี้จับผิดบ่อย (เช่น "มี" ในทุกประโยค)
+MIN_NAME_CHARS = 2
+
+_AUTOMATA_SIZE = 64
+
+
+class AhoCorasick:
+    """ จับหลาย pattern พร้อมกันในการอ่านข้อความรอบเดียว (patterns = {ข้อความ: payload}) """
+
+    def __init__(self, patterns):
+        self.goto = [{}]
+        self.fail = [0]
+        self.output = [[]]
+
+        for pattern, payload in patterns.items():
+            node = 0
+            for char in pattern:
+                if char not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.output.append([])
+                    self.goto[node][char] = len(self.goto) - 1
+                node = self.goto[node][char]
+            self.output[node].append((len(pattern), payload))
+
+        # fail link แบบ BFS: โหนดลึกได้ output ของ suffix ที่สั้นกว่ามาด้วย
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                queue.append(child)
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[child] = target if target != child else 0
+                self.output[child] = self.output[child] + self.output[self.fail[child]]
+
+    def finditer(self, text):
+        """ คืน (start, end, payload) ของทุกตำแหน่งที่เจอ (รวมที่ซ้อนกัน) """
+        node = 0
+        for i, char in enumerate(text):
+            while node and char not in self.goto[node]:
+                node = self.fail[node]
+            node = self.goto[node].get(char, 0)
+            for length, payload in self.output[node]:
+                yield i - length + 1, i + 1, payload
+
+
+# ==================== ชื่อของแต่ละสิ่ง ====================
+
+def entity_type(entity):
+    for name, model in ENTITY_TYPES.items():
+        if isinstance(entity, model):
+            return name
+    raise ValueError(f"not a mentionable entity: {entity!r}")
+
+
+def entity_names(entity):
+    """ ชื่อ + ชื่อเล่น (ตัวเล็ก, ตัดช่องว่าง) ที่ยาวพอจะใช้จับได้ """
+    raw = [entity.name] + ALIAS_SPLIT_RE.split(getattr(entity, "alias", "") or "")
+    names = {" ".join(name.split()).lower() for name in raw if name}
+    return sorted(name for name in names if len(name) >= MIN_NAME_CHARS)
+
+
+def _entity_scope(novel):
+    """ สิ่งที่อยู่ในนิยายนี้ + สิ่งที่ผู้แต่งสร้างไว้โดยไม่ผูกนิยาย (ใช้ได้ทุกเรื่องของเขา) """
+    return Q(project=novel) | Q(project__isnull=True, created_by_id=novel.author_id)
+
+
+def novel_patterns(novel):
+    """ {ชื่อ: [(ชนิด, id), ...]} ของทุกสิ่งในนิยาย """
+    patterns = {}
+    for type_name, model in ENTITY_TYPES.items():
+        fields = ["id", "name"] + (["alias"] if type_name == "character" else [])
+        for row in model.objects.filter(_entity_scope(novel)).only(*fields):
+            for name in entity_names(row):
+                patterns.setdefault(name, []).append((type_name, row.id))
+    return patterns
+
+
+_automata = OrderedDict()
+_automata_lock = threading.Lock()
+
+
+def _names_scope(owner_id):
+    return f"names:owner:{owner_id}"
+
+
+def bump_names(entity):
+    """
+    ชื่อในนิยายเปลี่ยน (เพิ่ม/แก้/ลบ ตัวละคร/สถานที่/ไอเทม) -> automaton ที่ทุก process แคชไว้ของนิยายผู้แต่งคนนี้ใช้ไม่ได้
+    ขยับทั้งเรื่องของผู้แต่ง: ของที่ไม่ผูกนิยายใช้ได้ทุกเรื่อง และย้ายนิยายก็ไม่ต้องรู้ว่าเดิมอยู่เรื่องไหน
+    """
+    owner_ids = {entity.created_by_id}
+    if entity.project_id:
+        owner_ids.update(Novel.objects.filter(pk=entity.project_id).values_list("author_id", flat=True))
+    bump_scopes(_names_scope(owner_id) for owner_id in owner_ids if owner_id)
+
+
+def automaton_for(novel):
+    """
+    automaton ของนิยาย (เก็บไว้ใช้ซ้ำจนกว่าเวอร์ชันชื่อของผู้แต่งจะขยับ ดู bump_names)
+    แคชโดนใช้ = query เดียวด้วย unique key ไม่ต้องโหลดชื่อทุกสิ่งในนิยายมาเทียบ
+    """
+    # อ่านเวอร์ชันก่อนโหลดชื่อ: มีคนแก้ชื่อระหว่างนี้ ครั้งหน้าก็เห็นเวอร์ชันใหม่แล้วสร้างใหม่เอง
+    scope = _names_scope(novel.author_id)
+    version = RagVersion.objects.filter(scope=scope).values_list("version", flat=True).first() or 0
+    with _automata_lock:
+        cached = _automata.get(novel.pk)
+        if cached and cached[0] == version:
+            _automata.move_to_end(novel.pk)
+            return cached[1]
+
+    patterns = novel_patterns(novel)
+    automaton = AhoCorasick(patterns) if patterns else None
+    with _automata_lock:
+        _automata[novel.pk] = (version, automaton)
+        while len(_automata) > _AUTOMATA_SIZE:
+            _automata.popitem(last=False)
+    return automaton
+
+
+# ==================== สแกน ====================
+
+def scan(text, automaton):
+    """ {(ชนิด, id): [จำนวนครั้ง, ตำแหน่งแรก]} — ชื่อที่ซ้อนกันนับเฉพาะตัวที่ยาวที่สุด (มิรานดา ไม่นับเป็น มิรา) """
+    if not text or automaton is None:
+        return {}
+    text = text.lower()
+
+    matches = sorted(automaton.finditer(text), key=lambda m: (m[0], -(m[1] - m[0])))
+    found = {}
+    covered_until = 0
+    for start, end, keys in matches:
+        if start < covered_until:
+            continue
+        # ชื่ออังกฤษ/ตัวเลขต้องไม่ติดตัวอักษรอื่น ("Al" ไม่นับใน "Albert")
+        if WORD_CHAR_RE.match(text[start]) and start and WORD_CHAR_RE.match(text[start - 1]):
+            continue
+        if WORD_CHAR_RE.match(text[end - 1]) and end < len(text) and WORD_CHAR_RE.match(text[end]):
+            continue
+        covered_until = end
+        for key in keys:
+            if key in found:
+                found[key][0] += 1
+            else:
+                found[key] = [1, start]
+    return found
+
+
+def document_text(document):
+    """ ข้อความของตอน/ฉากที่ใช้สแกนชื่อ (HTML -> ข้อความล้วน) """
+    if isinstance(document, Chapter):
+        return f"{document.title}\n{html_to_text(document.content)}"
+    parts = [document.title, document.goal, document.conflict, document.outcome, html_to_text(document.content)]
+    return "\n".join(part for part in parts if part)
+
+
+def _document_novel(document):
+    return document.novel if isinstance(document, Chapter) else document.project
+
+
+def _document_field(document):
+    return "chapter" if isinstance(document, Chapter) else "scene"
+
+
+# ==================== อัปเดตดัชนี ====================
+
+def index_document(document):
+    """ สแกนตอน/ฉากนี้ใหม่แล้วแทนที่แถวเดิมทั้งหมดของเอกสารนี้ คืนจำนวนสิ่งที่ถูกเอ่ยถึง """
+    novel = _document_novel(document)
+    field = _document_field(document)
+    found = scan(document_text(document), automaton_for(novel)) if novel else {}
+
+    rows = [
+        EntityMention(novel=novel, count=count, first_offset=offset,
+                      **{field: document, f"{type_name}_id": entity_id})
+        for (type_name, entity_id), (count, offset) in found.items()
+    ]
+    with transaction.atomic():
+        EntityMention.objects.filter(**{field: document}).delete()
+        EntityMention.objects.bulk_create(rows)
+    return len(rows)
+
+
+def index_entity(entity):
+    """
+    เพิ่ม/แก้ชื่อของตัวละคร/สถานที่/ไอเทม -> หาเฉพาะตอน/ฉากที่มีชื่อนั้น (ให้ DB กรองด้วย icontains) แล้วสแกนใหม่
+    ไม่ต้องไล่สแกนทั้งเรื่อง
+    """
+    type_name = entity_type(entity)
+    names = entity_names(entity)
+
+    if entity.project_id:
+        novels = Novel.objects.filter(pk=entity.project_id)
+    else:
+        novels = Novel.objects.filter(author_id=entity.created_by_id)
+
+    chapter_q, scene_q = Q(pk__in=[]), Q(pk__in=[])
+    for name in names:
+        chapter_q |= Q(title__icontains=name) | Q(content__icontains=name)
+        scene_q |= (Q(title__icontains=name) | Q(goal__icontains=name) | Q(conflict__icontains=name)
+                    | Q(outcome__icontains=name) | Q(content__icontains=name))
+
+    documents = []
+    if names:
+        documents += list(Chapter.objects.filter(chapter_q, novel__in=novels).select_related("novel"))
+        documents += list(Scene.objects.filter(scene_q, project__in=novels).select_related("project"))
+
+    # แถวเก่าของสิ่งนี้ทิ้งทั้งหมด (ชื่อเดิมอาจไม่อยู่ในตอนเหล่านั้นแล้ว / ย้ายนิยาย)
+    EntityMention.objects.filter(**{type_name: entity}).delete()
+    for document in documents:
+        index_document(document)
+    return len(documents)
+
+
+def rebuild_novel(novel):
+    """ สแกนทุกตอน/ฉากของนิยายใหม่ทั้งหมด (ใช้ตอนสร้างดัชนีครั้งแรก) """
+    documents = list(novel.chapters.all()) + list(Scene.objects.filter(project=novel))
+    for document in documents:
+        index_document(document)
+    return len(documents)
+
+
+# ==================== อ่านดัชนี ====================
+
+def appearances(entity):
+    """ ตอนและฉากที่เอ่ยถึงสิ่งนี้ เรียงตามลำดับในเรื่อง (สำหรับหน้ารายละเอียด) """
+    mentions = EntityMention.objects.filter(**{entity_type(entity): entity})
+    return {
+        "chapters": list(
+            mentions.filter(chapter__isnull=False).select_related("chapter", "novel")
+            .order_by("novel_id", "chapter__order", "chapter_id")
+        ),
+        "scenes": list(
+            mentions.filter(scene__isnull=False).select_related("scene", "novel")
+            .order_by("novel_id", "scene__order", "scene_id")
+        ),
+    }
+
+
+def mentioned_entities(novel, text, automaton=None):
+    """ สิ่งที่ถูกเอ่ยชื่อในข้อความ (เช่น คำถามของผู้ใช้) เรียงตามตำแหน่งที่เจอ (automaton = ที่สร้างไว้แล้ว ถ้ามี) """
+    found = scan(text, automaton if automaton is not None else automaton_for(novel))
+    return [key for key, _ in sorted(found.items(), key=lambda item: item[1][1])]
+
+
+def mention_sources(novel, entities, limit=4):
+    """ RAG source id ('chap_12', 'scene_4') ที่เอ่ยถึงสิ่งเหล่านี้บ่อยสุด """
+    entity_q = Q(pk__in=[])
+    for type_name, entity_id in entities:
+        entity_q |= Q(**{f"{type_name}_id": entity_id})
+
+    rows = (
+        EntityMention.objects.filter(entity_q, novel=novel)
+        .values("chapter_id", "scene_id")
+        .annotate(total=Sum("count"), entities=Count("id"))
+        .order_by("-entities", "-total")[:limit]
+    )
+    return [f"chap_{row['chapter_id']}" if row["chapter_id"] else f"scene_{row['scene_id']}" for row in rows]
@@ -0,0 +1,350 @@
+# rag_metrics.py
+"""
+ตัวเลขวัดผลของ RAG/LLM ต่อขั้นตอน (ไม่ต้องติดตั้ง prometheus_client)
+
+- with stage("embed_query"): ... จับเวลาเข้า histogram + นับ error ของขั้นนั้น
+- record_llm(kind, prompt, response): ขนาด Prompt/คำตอบ (ตัวอักษร + token โดยประมาณ)
+- /metrics แสดงผลแบบ Prometheus text format
+- Server-Timing: ขั้นตอนที่เกิดใน request เดียวกัน (รวมที่ไปทำใน thread pool) ถูกเก็บไว้ใน contextvar
+
+gunicorn มีหลาย process ตัวเลขแต่ละ process จึงถูกเขียนลงไฟล์ใน RAG_METRICS_DIR เป็นระยะ (และตอนจบ process)
+แล้ว /metrics รวมทุกไฟล์ให้ (ไม่ว่า Prometheus จะยิงเข้า worker ตัวไหนก็ได้ตัวเลขรวม)
+ไฟล์ของ process ที่ตายแล้วถูกรวมเข้า exited.json ตัวเลขรวมจึงไม่ถอยหลังเมื่อ worker ถูก restart
+"""
+import atexit
+import contextvars
+import fcntl
+import json
+import os
+import socket
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+from django.conf import settings
+
+from .rag_chunking import estimate_tokens
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+# เขียน snapshot ของ process นี้ลงไฟล์ไม่บ่อยกว่านี้ (วินาที)
+FLUSH_SECONDS = 5
+# ตัวเลขสะสมของ process ที่จบไปแล้ว (ดู Registry.prune)
+EXITED_FILE = "exited.json"
+
+
+class Registry:
+    """ counter + histogram ของ process นี้ (key = (ชื่อ, labels ที่เรียงแล้ว)) """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.help = {}
+        self.kinds = {}
+        self.buckets = {}
+        self.counters = {}
+        self.histograms = {}   # key -> [bucket counts..., +Inf count, sum]
+        self.collectors = []   # ฟังก์ชันคืน [(ชื่อ, labels dict, ค่า)] ของตัวนับที่อยู่ที่อื่น (เช่น แคช Embedding)
+        self._flushed_at = 0.0
+        self._flushed_pid = None
+        self._token_pid = None
+        self._token = None
+
+    def define(self, name, kind, help_text, buckets=None):
+        self.help[name] = help_text
+        self.kinds[name] = kind
+        if buckets:
+            self.buckets[name] = buckets
+
+    def inc(self, name, labels, amount=1):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+        self.maybe_flush()
+
+    def observe(self, name, labels, value):
+        key = (name, tuple(sorted(labels.items())))
+        buckets = self.buckets[name]
+        with self._lock:
+            row = self.histograms.get(key)
+            if row is None:
+                row = self.histograms[key] = [0] * (len(buckets) + 1) + [0.0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    row[i] += 1
+            row[len(buckets)] += 1
+            row[-1] += value
+        self.maybe_flush()
+
+    # ==================== Snapshot (ข้าม process) ====================
+
+    def snapshot(self):
+        with self._lock:
+            counters = dict(self.counters)
+            histograms = {key: list(row) for key, row in self.histograms.items()}
+        for collect in self.collectors:
+            for name, labels, value in collect():
+                counters[(name, tuple(sorted(labels.items())))] = value
+        return _dump(counters, histograms)
+
+    def maybe_flush(self, force=False):
+        directory = getattr(settings, "RAG_METRICS_DIR", "")
+        now = time.monotonic()
+        if not directory or (not force and now - self._flushed_at < FLUSH_SECONDS):
+            return
+        self._flushed_at = now
+        try:
+            os.makedirs(directory, exist_ok=True)
+            pid, token = self._identity()
+            if self._flushed_pid != pid:
+                # ไฟล์แรกของ process นี้: ถ้ามีไฟล์เก่าชื่อเดียวกัน (pid ถูกใช้ซ้ำ) ต้องรวมเก็บไว้ก่อนเขียนทับ
+                self.prune(directory)
+                self._flushed_pid = pid
+                atexit.register(self.maybe_flush, force=True)
+            path = os.path.join(directory, _snapshot_name(pid))
+            with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+                json.dump({**self.snapshot(), "token": token}, f)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            print(f"⚠️ Metrics flush failed: {e}")
+
+    def _identity(self):
+        """ (pid, token) ของ process นี้ (สุ่ม token ใหม่หลัง fork) ใช้แยกไฟล์ของเรากับไฟล์เก่าที่ pid ซ้ำกัน """
+        pid = os.getpid()
+        if self._token_pid != pid:
+            self._token_pid, self._token = pid, os.urandom(8).hex()
+        return pid, self._token
+
+    def prune(self, directory):
+        """
+        รวม snapshot ของ process ที่ตายไปแล้ว (เครื่องเดียวกัน) เข้า exited.json แล้วลบไฟล์ทิ้ง
+        ตัวเลขรวมจึงไม่ลดลง (counter ของ Prometheus ห้ามถอยหลัง) และโฟลเดอร์ไม่โตตาม worker ที่ถูก restart
+        ไฟล์ของเครื่องอื่น (container อื่นที่แชร์โฟลเดอร์) เช็ค pid ไม่ได้ จึงปล่อยไว้
+        """
+        pid, token = self._identity()
+        with _locked(directory):
+            dead = []
+            for filename in os.listdir(directory):
+                owner = _snapshot_pid(filename)
+                if owner is None:
+                    continue
+                snapshot = _load(os.path.join(directory, filename))
+                if owner == pid:
+                    if snapshot is None or snapshot.get("token") == token:
+                        continue
+                elif _alive(owner):
+                    continue
+                dead.append((filename, snapshot))
+            if not dead:
+                return
+
+            aggregate = os.path.join(directory, EXITED_FILE)
+            counters, histograms = _combine([_load(aggregate)] + [snapshot for _, snapshot in dead])
+            with open(f"{aggregate}.tmp", "w", encoding="utf-8") as f:
+                json.dump(_dump(counters, histograms), f)
+            os.replace(f"{aggregate}.tmp", aggregate)
+            for filename, _ in dead:
+                os.remove(os.path.join(directory, filename))
+
+    def _merged(self):
+        """ snapshot ของทุก process (จากไฟล์) รวมกัน — process นี้ใช้ค่าสดแทนไฟล์ของตัวเอง """
+        snapshots = [self.snapshot()]
+        directory = getattr(settings, "RAG_METRICS_DIR", "")
+        if directory and os.path.isdir(directory):
+            try:
+                self.prune(directory)
+            except OSError as e:
+                print(f"⚠️ Metrics prune failed: {e}")
+            own = _snapshot_name(os.getpid())
+            with _locked(directory):
+                for filename in os.listdir(directory):
+                    if filename.endswith(".json") and filename != own:
+                        snapshots.append(_load(os.path.join(directory, filename)))
+        return _combine(snapshots)
+
+    # ==================== Prometheus text format ====================
+
+    def render(self):
+        counters, histograms = self._merged()
+        lines = []
+        for name in sorted(self.help):
+            lines.append(f"# HELP {name} {self.help[name]}")
+            lines.append(f"# TYPE {name} {self.kinds[name]}")
+            if self.kinds[name] == "counter":
+                for (metric, labels), value in sorted(counters.items()):
+                    if metric == name:
+                        lines.append(f"{name}{_labels(labels)} {value}")
+                continue
+            buckets = self.buckets[name]
+            for (metric, labels), row in sorted(histograms.items()):
+                if metric != name:
+                    continue
+                for bound, count in zip(buckets, row):
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', _number(bound)),))} {count}")
+                lines.append(f"{name}_bucket{_labels(labels + (('le', '+Inf'),))} {row[len(buckets)]}")
+                lines.append(f"{name}_count{_labels(labels)} {row[len(buckets)]}")
+                lines.append(f"{name}_sum{_labels(labels)} {row[-1]}")
+        return "\n".join(lines) + "\n"
+
+
+def _dump(counters, histograms):
+    return {
+        "counters": [[name, list(labels), value] for (name, labels), value in counters.items()],
+        "histograms": [[name, list(labels), row] for (name, labels), row in histograms.items()],
+    }
+
+
+def _combine(snapshots):
+    """ รวม snapshot หลายอัน (None = ไฟล์ที่อ่านไม่ได้ ข้ามไป) คืน (counters, histograms) """
+    counters, histograms = {}, {}
+    for snapshot in snapshots:
+        if snapshot is None:
+            continue
+        for name, labels, value in snapshot["counters"]:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0) + value
+        for name, labels, row in snapshot["histograms"]:
+            key = (name, tuple(tuple(pair) for pair in labels))
+            if key in histograms and len(histograms[key]) == len(row):
+                histograms[key] = [a + b for a, b in zip(histograms[key], row)]
+            else:
+                histograms[key] = list(row)
+    return counters, histograms
+
+
+def _load(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def _snapshot_name(pid):
+    return f"{socket.gethostname()}-{pid}.json"
+
+
+def _snapshot_pid(filename):
+    """ pid ของไฟล์ snapshot ที่เครื่องนี้เขียน (ไฟล์อื่น/เครื่องอื่น = None) """
+    host, _, pid = filename[:-len(".json")].rpartition("-")
+    if not filename.endswith(".json") or host != socket.gethostname() or not pid.isdigit():
+        return None
+    return int(pid)
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True   # มีอยู่แต่เป็นของ user อื่น
+    return True
+
+
+@contextmanager
+def _locked(directory):
+    """ ล็อกข้าม process ตอนรวม/อ่านไฟล์ (ไม่งั้นอาจเห็นตัวเลขของ process ที่ตายซ้ำสองทางชั่วขณะ) """
+    with open(os.path.join(directory, ".lock"), "a") as handle:
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        yield
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else str(value)
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (
+        f'{key}="' + str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+        for key, value in labels
+    )
+    return "{" + ",".join(escaped) + "}"
+
+
+registry = Registry()
+registry.define("plotcraft_rag_stage_seconds", "histogram", "Time spent per RAG/LLM pipeline stage", SECONDS_BUCKETS)
+registry.define("plotcraft_rag_stage_errors_total", "counter", "Exceptions raised per RAG/LLM pipeline stage")
+registry.define("plotcraft_llm_tokens", "histogram", "Estimated prompt/response tokens per LLM call", TOKEN_BUCKETS)
+registry.define("plotcraft_llm_chars_total", "counter", "Prompt/response characters sent to and received from the LLM")
+registry.define("plotcraft_rag_index_docs_total", "counter", "Documents handled by indexing, by result")
+registry.define("plotcraft_generation_requests_total", "counter", "Generation layer requests by kind and result")
+registry.define("plotcraft_embedding_cache_total", "counter", "Embedding cache lookups and evictions")
+
+
+# ==================== ใช้งาน ====================
+
+_timings = contextvars.ContextVar("rag_server_timings", default=None)
+
+
+@contextmanager
+def stage(name):
+    """ จับเวลาขั้นตอน (เข้า histogram + Server-Timing ของ request ปัจจุบัน) และนับ error ถ้าพัง """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        registry.inc("plotcraft_rag_stage_errors_total", {"stage": name})
+        raise
+    finally:
+        observe(name, time.perf_counter() - started)
+
+
+def observe(name, seconds):
+    """ บันทึกเวลาของขั้นที่จับเองได้ (เช่น เวลาถึง token แรกของ stream) """
+    registry.observe("plotcraft_rag_stage_seconds", {"stage": name}, seconds)
+    timings = _timings.get()
+    if timings is not None:
+        timings.append((name, seconds))
+
+
+def record_llm(kind, prompt, response=None):
+    """ ขนาด Prompt (และคำตอบ ถ้ามี) ของการเรียก LLM หนึ่งครั้ง """
+    for direction, text in (("prompt", prompt), ("response", response)):
+        if text is None:
+            continue
+        if not isinstance(text, str):
+            text = json.dumps(text, ensure_ascii=False)
+        labels = {"kind": kind, "direction": direction}
+        registry.inc("plotcraft_llm_chars_total", labels, len(text))
+        registry.observe("plotcraft_llm_tokens", labels, estimate_tokens(text))
+
+
+def count_index(result, amount):
+    """ จำนวนเอกสารตอน Index: embedded / unchanged / deleted """
+    if amount:
+        registry.inc("plotcraft_rag_index_docs_total", {"result": result}, amount)
+
+
+def start_timings():
+    """ เริ่มเก็บ Server-Timing ของ request นี้ คืน list ที่ stage() จะเติมให้ """
+    timings = []
+    _timings.set(timings)
+    return timings
+
+
+def server_timing_header(timings):
+    """ [(ชื่อ, วินาที), ...] -> 'retrieve;dur=12.3, llm;dur=840.0' (ขั้นชื่อซ้ำรวมเวลากัน) """
+    totals = {}
+    for name, elapsed in timings:
+        totals[name] = totals.get(name, 0.0) + elapsed
+    return ", ".join(f"{name};dur={elapsed * 1000:.1f}" for name, elapsed in totals.items())
+
+
+def server_timing(view):
+    """ decorator ของ async view: ใส่ header Server-Timing จากทุก stage() ที่เกิดระหว่างทำ request """
+    @wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        token = _timings.set([])
+        try:
+            response = await view(request, *args, **kwargs)
+            timings = _timings.get()
+        finally:
+            _timings.reset(token)
+        if timings and not response.streaming:
+            response["Server-Timing"] = server_timing_header(timings)
+        return response
+    return wrapper
@@ -0,0 +1,112 @@
+# rag_onnx.py
+"""
+Embedding Backend แบบ ONNX Runtime (ไม่ต้องใช้ PyTorch ตอนรันจริง)
+
+โมเดลเดียวกับ sentence-transformers (paraphrase-multilingual-MiniLM-L12-v2) ที่ export เป็นไฟล์ .onnx แล้ว
+- model.onnx      : float32 ผลแทบเท่าเดิมทุกหลัก ใช้กับเวกเตอร์ที่เก็บไว้แล้วได้เลย
+- model_int8.onnx : dynamic int8 quantization เล็กลง ~4 เท่าและเร็วขึ้นบน CPU แต่เวกเตอร์ต่างไปเล็กน้อย -> ควร rag_reindex
+
+Pooling เหมือน sentence-transformers: ตัดที่ max_length, mean pooling ตาม attention mask, ไม่ normalize
+สร้างไฟล์ด้วย `python manage.py rag_export_onnx` (ขั้นนี้ขั้นเดียวที่ต้องมี torch + transformers)
+"""
+import os
+import threading
+
+import numpy as np
+
+MODEL_FILE = "model.onnx"
+INT8_MODEL_FILE = "model_int8.onnx"
+
+
+def model_path(model_dir, int8=False):
+    return os.path.join(str(model_dir), INT8_MODEL_FILE if int8 else MODEL_FILE)
+
+
+class OnnxEmbeddings:
+    """ มีเมธอดเหมือน LangChain Embeddings (embed_query / embed_documents) จึงใช้แทน HuggingFaceEmbeddings ได้เลย """
+
+    def __init__(self, model_dir, int8=False, max_length=128, batch_size=32, threads=None):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        path = model_path(model_dir, int8)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"ไม่พบ {path} (สั่ง python manage.py rag_export_onnx{' --int8' if int8 else ''} ก่อน)")
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(str(model_dir), "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=max_length)
+        self.batch_size = batch_size
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        # session.run ใช้ข้าม thread ได้ แต่ tokenizer ที่ตั้ง padding ไว้ไม่ควรถูกแก้พร้อมกัน
+        self._lock = threading.Lock()
+
+    def _encode(self, texts):
+        with self._lock:
+            self.tokenizer.enable_padding()
+            encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        hidden = self.session.run(None, feeds)[0]
+
+        # mean pooling (ไม่นับ padding)
+        mask = attention_mask[..., None].astype(np.float32)
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        # เรียงตามความยาวก่อนแบ่งชุด: padding ในแต่ละชุดน้อยลง
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), self.batch_size):
+            part = order[start:start + self.batch_size]
+            for i, vector in zip(part, self._encode([texts[i] for i in part])):
+                vectors[i] = vector.tolist()
+        return vectors
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+def export_onnx(model_name, model_dir, int8=False, max_length=128):
+    """ export โมเดลจาก Hugging Face เป็น ONNX (+ tokenizer.json) และทำ int8 ถ้าขอ คืน path ของไฟล์ที่จะใช้ """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(str(model_dir), exist_ok=True)
+    tokenizer = AutoTokenizer.from_pretrained(model_name)
+    model = AutoModel.from_pretrained(model_name).eval()
+    tokenizer.save_pretrained(str(model_dir))
+
+    sample = tokenizer(["ตัวอย่าง", "sample text"], padding=True, truncation=True,
+                       max_length=max_length, return_tensors="pt")
+    names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic = {name: {0: "batch", 1: "sequence"} for name in names}
+    dynamic["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    fp32_path = model_path(model_dir)
+    with torch.no_grad():
+        torch.onnx.export(
+            model, tuple(sample[name] for name in names), fp32_path,
+            input_names=names, output_names=["last_hidden_state"],
+            dynamic_axes=dynamic, opset_version=14,
+        )
+
+    if not int8:
+        return fp32_path
+
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    int8_path = model_path(model_dir, int8=True)
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    return int8_path
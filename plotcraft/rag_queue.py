@@ -0,0 +1,192 @@
+# rag_queue.py
+"""
+คิวงาน Index ของ RAG (Outbox Pattern)
+
+- Signal เรียก enqueue() หลัง commit -> เขียนแค่แถวเดียวลง RagOutbox (เร็ว ไม่ต้องรอโมเดล/Chroma)
+- `manage.py rag_worker` เรียก process_batch() วนไปเรื่อยๆ เพื่อทำงานจริง พร้อม retry + backoff
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import DateTimeField, ExpressionWrapper, F, Value
+from django.db.models.functions import Least
+from django.utils import timezone
+
+from .models import RagOutbox, Novel, Character, Chapter, Scene
+from .rag_resilience import DependencyUnavailable
+
+
+# model_name -> (Model, ชื่อเมธอดใน rag_service, prefix ของ doc id ใน Chroma)
+INDEXERS = {
+    'novel': (Novel, 'add_novel_summary_to_rag', 'novel'),
+    'character': (Character, 'add_character_to_rag', 'char'),
+    'chapter': (Chapter, 'add_chapter_to_rag', 'chap'),
+    'scene': (Scene, 'add_scene_to_rag', 'scene'),
+}
+
+# งานที่แค่ประกอบข้อมูลลง DB (ไม่แตะ Vector Store): model_name -> (Model ของ object_id, ชื่อเมธอดใน rag_service)
+DERIVED = {
+    'story_bible': (Novel, 'rebuild_story_bible'),
+    'story_summaries': (Novel, 'update_story_summaries'),
+}
+
+# งานลบที่ทำทีเดียวทั้งก้อนด้วย where (ลบนิยาย/ลบผู้ใช้) แทนการลบทีละเอกสาร
+PURGERS = {
+    'novel': 'delete_novel_from_rag',
+    'user': 'delete_owner_from_rag',
+}
+
+# select_related ที่ add_*_to_rag ต้องใช้ จะได้ไม่ยิง query ทีละ field
+RELATED = {
+    'novel': ('author',),
+    'character': ('project', 'created_by'),
+    'chapter': ('novel__author',),
+    'scene': ('project', 'created_by', 'pov_character', 'location'),
+}
+
+
+def enqueue(model_name, object_id, op=RagOutbox.OP_UPSERT):
+    """
+    ใส่งานลงคิว ถ้ามีงานของ Object เดิมค้างอยู่แล้วจะยุบรวมเป็นแถวเดียว (งานล่าสุดชนะ)
+
+    งาน upsert จะถูกหน่วงไว้จนกว่าจะเงียบไป RAG_INDEX_QUIET_SECONDS (debounce)
+    autosave ทุก 5 วิ จึงเลื่อนเวลาออกไปเรื่อยๆ และได้ Embed แค่ครั้งเดียวตอนหยุดพิมพ์
+    แต่ไม่เกิน RAG_INDEX_MAX_DELAY_SECONDS นับจากงานแรกที่ค้าง (กันเขียนยาวทั้งคืนแล้วไม่ถูก Index เลย)
+    """
+    now = timezone.now()
+    lookup = {'model_name': model_name, 'object_id': object_id}
+
+    if op == RagOutbox.OP_UPSERT:
+        quiet = timedelta(seconds=getattr(settings, 'RAG_INDEX_QUIET_SECONDS', 30))
+        max_delay = timedelta(seconds=getattr(settings, 'RAG_INDEX_MAX_DELAY_SECONDS', 300))
+        first_run_at = now + quiet
+        next_run_at = Least(
+            Value(now + quiet, output_field=DateTimeField()),
+            ExpressionWrapper(F('created_at') + max_delay, output_field=DateTimeField()),
+        )
+    else:
+        first_run_at = next_run_at = now
+
+    changes = {'op': op, 'seq': F('seq') + 1, 'attempts': 0, 'available_at': next_run_at, 'last_error': ''}
+
+    if RagOutbox.objects.filter(**lookup).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            RagOutbox.objects.create(op=op, available_at=first_run_at, **lookup)
+    except IntegrityError:
+        # มีอีก request สร้างแถวเดียวกันตัดหน้าไปแล้ว -> อัปเดตแทน
+        RagOutbox.objects.filter(**lookup).update(**changes)
+
+
+def enqueue_on_commit(instance, op=RagOutbox.OP_UPSERT):
+    """ ใช้ใน Signal: รอให้ Transaction ของ request commit ก่อนค่อยลงคิว """
+    model_name = instance._meta.model_name
+    object_id = instance.pk
+    transaction.on_commit(lambda: enqueue(model_name, object_id, op))
+
+
+def enqueue_novel_task_on_commit(model_name, novel_id):
+    """ ใช้ใน Signal: ลงคิวงานประกอบข้อมูลของนิยาย (DERIVED เช่น 'story_bible') หลัง commit """
+    if novel_id:
+        transaction.on_commit(lambda: enqueue(model_name, novel_id))
+
+
+def doc_id_for(model_name, object_id):
+    return f"{INDEXERS[model_name][2]}_{object_id}"
+
+
+def _backoff(attempts):
+    base = getattr(settings, 'RAG_WORKER_BACKOFF_SECONDS', 5)
+    cap = getattr(settings, 'RAG_WORKER_MAX_BACKOFF_SECONDS', 600)
+    return timedelta(seconds=min(base * (2 ** attempts), cap))
+
+
+def claim_batch(batch_size, lease_seconds=300, max_attempts=None):
+    """
+    จองงานที่ถึงเวลาแล้วมาทำ โดยเลื่อน available_at ออกไป (lease)
+    worker หลายตัวจะได้ไม่แย่งงานเดียวกัน ถ้า worker ตายกลางทาง งานจะกลับมาเองเมื่อ lease หมด
+    """
+    if max_attempts is None:
+        max_attempts = getattr(settings, 'RAG_WORKER_MAX_ATTEMPTS', 8)
+    now = timezone.now()
+
+    with transaction.atomic():
+        rows = list(
+            RagOutbox.objects.select_for_update(skip_locked=True)
+            .filter(available_at__lte=now, attempts__lt=max_attempts)
+            .order_by('available_at')[:batch_size]
+        )
+        if rows:
+            RagOutbox.objects.filter(pk__in=[r.pk for r in rows]).update(
+                available_at=now + timedelta(seconds=lease_seconds)
+            )
+    return rows
+
+
+def process_task(task, service=None):
+    """ ทำงาน 1 แถว (โยน Exception ออกไปถ้าพัง ให้ process_batch จัดการ retry) """
+    if service is None:
+        from .rag_service import rag_service as service
+
+    if task.op == RagOutbox.OP_DELETE and task.model_name in PURGERS:
+        getattr(service, PURGERS[task.model_name])(task.object_id)
+        return
+
+    if task.model_name in DERIVED:
+        model, method_name = DERIVED[task.model_name]
+        instance = model.objects.filter(pk=task.object_id).first()
+        # ต้นทางถูกลบไปแล้ว -> ข้อมูลที่ประกอบไว้ถูกลบตาม CASCADE เอง
+        if instance is not None:
+            getattr(service, method_name)(instance)
+        return
+
+    model, method_name, _ = INDEXERS[task.model_name]
+
+    instance = None
+    if task.op == RagOutbox.OP_UPSERT:
+        instance = (
+            model.objects.select_related(*RELATED[task.model_name])
+            .filter(pk=task.object_id)
+            .first()
+        )
+
+    # Object ถูกลบไปแล้วระหว่างรอคิว -> ถือเป็นงานลบ
+    if instance is None:
+        service.delete_data_from_rag(doc_id_for(task.model_name, task.object_id))
+    else:
+        getattr(service, method_name)(instance)
+
+
+def process_batch(batch_size=None, service=None):
+    """ ดึงงานมาทำ 1 รอบ คืนค่า (สำเร็จ, ล้มเหลว) """
+    if batch_size is None:
+        batch_size = getattr(settings, 'RAG_WORKER_BATCH_SIZE', 50)
+
+    done = failed = 0
+    tasks = claim_batch(batch_size)
+    for position, task in enumerate(tasks):
+        try:
+            process_task(task, service=service)
+        except DependencyUnavailable as e:
+            # Chroma/โมเดลล่มทั้งระบบ ไม่ใช่ความผิดของงานนี้: ไม่นับ attempt (ไม่งั้นงานหมดสิทธิ์ retry ระหว่างล่ม)
+            # แล้วคืนงานที่เหลือทั้งชุดไปรอพร้อมกัน แทนที่จะลองทีละงานให้โดนปฏิเสธซ้ำๆ
+            retry_at = timezone.now() + timedelta(seconds=max(e.retry_after, 1))
+            RagOutbox.objects.filter(pk__in=[t.pk for t in tasks[position:]]).update(
+                available_at=retry_at, last_error=str(e)[:2000],
+            )
+            failed += len(tasks) - position
+            break
+        except Exception as e:
+            failed += 1
+            # เช็ค seq ด้วย: ถ้ามีงานใหม่มาแทนแล้ว ไม่ต้องนับ retry ให้งานเก่า
+            RagOutbox.objects.filter(pk=task.pk, seq=task.seq).update(
+                attempts=F('attempts') + 1,
+                available_at=timezone.now() + _backoff(task.attempts),
+                last_error=str(e)[:2000],
+            )
+        else:
+            done += 1
+            RagOutbox.objects.filter(pk=task.pk, seq=task.seq).delete()
+    return done, failed
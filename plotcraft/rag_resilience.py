@@ -0,0 +1,163 @@
+# rag_resilience.py
+"""
+กันไม่ให้ Chroma / Gemini ที่ช้าหรือล่ม ลากทุก request ให้ค้างไปด้วย
+
+- deadline: ทุกคำสั่งมีเวลาสูงสุด (RAG_<ชื่อ>_TIMEOUT) เกินแล้วเลิกรอทันที
+- circuit breaker: พังติดกัน RAG_BREAKER_FAILURES ครั้ง -> "เปิดวงจร" คำสั่งต่อไปตอบ DependencyUnavailable ทันที
+  (ไม่ต้องรอ timeout ซ้ำ) พ้น RAG_BREAKER_RESET_SECONDS แล้วปล่อยคำสั่งเดียวไปลองก่อน (half-open)
+  ผ่าน = ปิดวงจรกลับมาใช้ตามปกติ / ไม่ผ่าน = เปิดต่ออีกรอบ
+"""
+import asyncio
+import contextvars
+import math
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from django.conf import settings
+
+from .rag_metrics import registry
+
+registry.define("plotcraft_dependency_failures_total", "counter", "Failed or timed-out calls per external dependency")
+registry.define("plotcraft_dependency_rejected_total", "counter", "Calls short-circuited by an open circuit breaker")
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class DependencyUnavailable(RuntimeError):
+    """ บริการภายนอกใช้ไม่ได้ตอนนี้ (วงจรเปิดอยู่ หรือเกิน deadline) retry_after = วินาทีที่ควรรอก่อนลองใหม่ """
+
+    def __init__(self, dependency, message, retry_after=0):
+        super().__init__(f"{dependency}: {message}")
+        self.dependency = dependency
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+
+    def __init__(self, name, timeout=None, failure_threshold=5, reset_seconds=30, workers=4):
+        self.name = name
+        self.timeout = timeout
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        # thread สำหรับบังคับ deadline ของคำสั่ง sync (ตัวที่ค้างเกินเวลาจะถูกปล่อยทิ้งไว้ในนี้ ไม่ค้าง request)
+        self._workers = workers
+        self._pool = None
+
+    # ==================== สถานะ ====================
+
+    def retry_after(self):
+        return max(0.0, self.opened_at + self.reset_seconds - time.monotonic())
+
+    def before_call(self):
+        """ โยน DependencyUnavailable ถ้าวงจรเปิดอยู่ (half-open ปล่อยผ่านทีละหนึ่งคำสั่ง) """
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN and self.retry_after() <= 0:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return
+            wait = self.retry_after()
+        registry.inc("plotcraft_dependency_rejected_total", {"dependency": self.name})
+        raise DependencyUnavailable(self.name, f"circuit open, retry in {math.ceil(wait)}s", retry_after=wait)
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                print(f"✅ {self.name} recovered, circuit closed")
+            self.state = CLOSED
+            self.failures = 0
+            self._probing = False
+
+    def release(self):
+        """ คำสั่งทดลองจบไปโดยไม่รู้ผล (เช่น client ตัดการเชื่อมต่อกลาง stream) -> ให้คำสั่งถัดไปลองแทน """
+        with self._lock:
+            self._probing = False
+
+    def record_failure(self):
+        registry.inc("plotcraft_dependency_failures_total", {"dependency": self.name})
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != OPEN:
+                    print(f"⚡ {self.name} circuit opened after {self.failures} failures")
+                self.state = OPEN
+                self.opened_at = time.monotonic()
+
+    # ==================== เรียกผ่าน breaker ====================
+
+    def _executor(self):
+        if self._pool is None:
+            with self._lock:
+                if self._pool is None:
+                    self._pool = ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix=f"{self.name}-call")
+        return self._pool
+
+    def call(self, func, *args, **kwargs):
+        """ เรียก func แบบ sync ภายใน deadline (self.timeout) """
+        self.before_call()
+        try:
+            if self.timeout:
+                future = self._executor().submit(contextvars.copy_context().run, func, *args, **kwargs)
+                try:
+                    result = future.result(timeout=self.timeout)
+                except FutureTimeout:
+                    future.cancel()
+                    raise DependencyUnavailable(self.name, f"no response within {self.timeout:g}s",
+                                                retry_after=self.reset_seconds)
+            else:
+                result = func(*args, **kwargs)
+        except Exception:
+            self.record_failure()
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.record_success()
+        return result
+
+    async def acall(self, make_awaitable):
+        """ เหมือน call แต่สำหรับ coroutine (make_awaitable = ฟังก์ชันที่คืน coroutine ใหม่) """
+        self.before_call()
+        try:
+            result = await asyncio.wait_for(make_awaitable(), self.timeout)
+        except asyncio.TimeoutError:
+            self.record_failure()
+            raise DependencyUnavailable(self.name, f"no response within {self.timeout:g}s",
+                                        retry_after=self.reset_seconds) from None
+        except Exception:
+            self.record_failure()
+            raise
+        except asyncio.CancelledError:
+            self.release()
+            raise
+        self.record_success()
+        return result
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(name):
+    """ breaker ของบริการนี้ (หนึ่งตัวต่อ process) ใช้ค่า RAG_<NAME>_TIMEOUT, RAG_BREAKER_* จาก settings """
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(
+                name,
+                timeout=getattr(settings, f"RAG_{name.upper()}_TIMEOUT", None),
+                failure_threshold=getattr(settings, "RAG_BREAKER_FAILURES", 5),
+                reset_seconds=getattr(settings, "RAG_BREAKER_RESET_SECONDS", 30),
+            )
+        return _breakers[name]
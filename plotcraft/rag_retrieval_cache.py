@@ -0,0 +1,82 @@
+# rag_retrieval_cache.py
+"""
+แคชผลการค้นหาบริบทของพี่บก. (เอกสารสรุปนิยาย + เอกสารที่ Vector Search เจอ)
+
+key = (owner_id, novel_id, คำถามที่ normalize แล้ว, เวอร์ชันข้อมูลของนิยาย/ผู้ใช้)
+ตราบใดที่นิยายยังไม่ถูกแก้ คำถามเดิมหรือเกือบเดิมจะไม่ต้อง Embed และไม่ต้องค้น Vector Store ซ้ำ
+พอมีการ Index ใหม่ เวอร์ชันจะขยับ key เปลี่ยน แคชเก่าหมดอายุไปเองโดยไม่ต้องไล่ลบ
+"""
+import hashlib
+import re
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import IntegrityError, transaction
+from django.db.models import F
+
+from .models import RagVersion
+
+# คำลงท้าย/คำสุภาพที่ไม่เปลี่ยนความหมายของคำถาม
+TRAILING_PARTICLES_RE = re.compile(r'(\s*(ครับ|คับ|ค่ะ|คะ|ค่า|จ้า|จ้ะ|นะ|น้า|หน่อย|[?？!！.。…~]))+$')
+
+
+def normalize_query(text):
+    """ ตัวเล็ก, ยุบช่องว่าง, ตัดคำลงท้ายกับเครื่องหมายท้ายประโยค -> คำถามที่ต่างกันแค่นี้ใช้แคชร่วมกัน """
+    text = " ".join((text or "").lower().split())
+    return TRAILING_PARTICLES_RE.sub("", text).strip()
+
+
+def _scopes(novel_id=None, owner_id=None):
+    scopes = []
+    if owner_id not in (None, "", "unknown"):
+        scopes.append(f"owner:{owner_id}")
+    if novel_id not in (None, "", "unknown"):
+        scopes.append(f"novel:{novel_id}")
+    return scopes
+
+
+def bump_versions(novel_ids=(), owner_ids=()):
+    """ เรียกเมื่อเอกสารของนิยาย/ผู้ใช้เหล่านี้เปลี่ยน """
+    scopes = set()
+    for novel_id in novel_ids:
+        scopes.update(_scopes(novel_id=novel_id))
+    for owner_id in owner_ids:
+        scopes.update(_scopes(owner_id=owner_id))
+    bump_scopes(scopes)
+
+
+def bump_scopes(scopes):
+    """ เพิ่มเลขเวอร์ชันของขอบเขตเหล่านี้ (ยังไม่มีแถวก็สร้าง) """
+    scopes = set(scopes)
+    if not scopes:
+        return
+
+    updated = set(RagVersion.objects.filter(scope__in=scopes).values_list("scope", flat=True))
+    RagVersion.objects.filter(scope__in=updated).update(version=F("version") + 1)
+    for scope in scopes - updated:
+        try:
+            with transaction.atomic():
+                RagVersion.objects.create(scope=scope, version=1)
+        except IntegrityError:
+            RagVersion.objects.filter(scope=scope).update(version=F("version") + 1)
+
+
+def _cache_key(owner_id, novel_id, query):
+    scopes = _scopes(novel_id=novel_id, owner_id=owner_id)
+    versions = dict(RagVersion.objects.filter(scope__in=scopes).values_list("scope", "version"))
+    stamp = "-".join(str(versions.get(scope, 0)) for scope in scopes)
+    digest = hashlib.sha1(normalize_query(query).encode("utf-8")).hexdigest()
+    return f"rag:retrieval:v2:{owner_id}:{novel_id or '-'}:{stamp}:{digest}"
+
+
+def get_or_retrieve(owner_id, novel_id, query, retrieve):
+    """ คืนผลจากแคชถ้ามี ไม่งั้นเรียก retrieve() แล้วเก็บผลไว้ (ผลต้องเป็น dict ที่ pickle ได้) """
+    key = _cache_key(owner_id, novel_id, query)
+    cached = caches["rag"].get(key)
+    if cached is not None:
+        print("⚡ Retrieval cache hit")
+        return cached
+
+    result = retrieve()
+    caches["rag"].set(key, result, getattr(settings, "RAG_RETRIEVAL_CACHE_TTL", 600))
+    return result
@@ -1,192 +1,667 @@
 # rag_service.py
 import os
-import chromadb
+import re
+import json
+import hashlib
+import asyncio
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from django.conf import settings
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_google_genai import GoogleGenerativeAI
+from django.db import close_old_connections, transaction
+from django.db.models import Q
 from dotenv import load_dotenv
 
+from .models import Novel, RagDocument
+from .rag_bible import rebuild as rebuild_bible, story_bible
+from .rag_chunking import chunk_text, html_to_text
+from .rag_context import assemble_context, format_context, reciprocal_rank_fusion
+from .rag_lexical import lexical_index
+from .rag_memory import compress, format_history, get_session, remember
+from .rag_mentions import automaton_for, mention_sources, mentioned_entities
+from .rag_embedding_cache import CachedEmbeddings, EmbeddingCache
+from .rag_generation import generation
+from .rag_metrics import count_index, observe, record_llm, registry, stage
+from .rag_queue import enqueue
+from .rag_resilience import DependencyUnavailable, breaker
+from .rag_retrieval_cache import bump_versions, get_or_retrieve
+from .rag_summaries import build_summary_document, refresh as refresh_summaries, summary_documents
+
 load_dotenv()
 
+def content_fingerprint(content, metadata=None):
+    """ sha256 ของข้อความที่ RAG เห็นจริง (ยุบช่องว่าง/เยื้องบรรทัดทิ้ง) + metadata """
+    normalized = " ".join(content.split())
+    if metadata:
+        normalized += "\n" + json.dumps(metadata, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+def source_q(source):
+    """ เงื่อนไขหา RagDocument ทุกชิ้นของ Object เดียวกัน: ตัวมันเอง ('chap_12') และชิ้นย่อย ('chap_12_0', ...) """
+    return Q(doc_id=source) | Q(doc_id__startswith=f"{source}_")
+
+
+def record_documents(docs):
+    """ บันทึก fingerprint ของเอกสารที่เขียนลง Vector Store แล้ว (แทนที่ของเดิมทั้งชุดในครั้งเดียว) """
+    rows = [
+        RagDocument(
+            doc_id=doc_id,
+            fingerprint=content_fingerprint(content, metadata),
+            novel_id=metadata.get("novel_id", ""),
+            owner_id=metadata.get("owner_id", ""),
+        )
+        for doc_id, content, metadata in docs
+    ]
+    with transaction.atomic():
+        RagDocument.objects.filter(doc_id__in=[row.doc_id for row in rows]).delete()
+        RagDocument.objects.bulk_create(rows)
+    bump_versions({row.novel_id for row in rows}, {row.owner_id for row in rows})
+
+
+def forget_documents(queryset):
+    """ ลบ fingerprint ของเอกสารที่ลบออกจาก Vector Store แล้ว + ขยับเวอร์ชันให้แคชผลค้นหาของนิยาย/ผู้ใช้นั้นหมดอายุ """
+    scopes = list(queryset.values_list("novel_id", "owner_id").distinct())
+    removed, _ = queryset.delete()
+    bump_versions({novel_id for novel_id, _ in scopes}, {owner_id for _, owner_id in scopes})
+    return removed
+
+
+def _run_blocking_job(func, *args, **kwargs):
+    """ รันใน thread ของ executor แล้วคืน DB connection ของ thread นั้นเมื่อเสร็จ (ไม่ให้ค้างเปิดไว้) """
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+def embedding_cache_name(backend=None):
+    """ ชื่อโมเดลที่ใช้เป็น key ของแคช Embedding (int8 ได้เวกเตอร์ต่างจาก float32 เล็กน้อยจึงแยกกัน) """
+    backend = backend or getattr(settings, "RAG_EMBEDDING_BACKEND", "torch")
+    model_name = getattr(settings, "RAG_EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+    if backend == "onnx" and getattr(settings, "RAG_ONNX_INT8", False):
+        return f"{model_name}#int8"
+    return model_name
+
+
+def load_embedding_model(backend=None):
+    """
+    Embedding Model ตาม settings.RAG_EMBEDDING_BACKEND ('torch' = sentence-transformers เดิม, 'onnx' = ONNX Runtime)
+    คืน (model, ชื่อที่ใช้เป็น key ของแคช)
+    """
+    backend = backend or getattr(settings, "RAG_EMBEDDING_BACKEND", "torch")
+    model_name = getattr(settings, "RAG_EMBEDDING_MODEL", "sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2")
+
+    if backend == "onnx":
+        from .rag_onnx import OnnxEmbeddings
+
+        int8 = getattr(settings, "RAG_ONNX_INT8", False)
+        print(f"📥 Loading Embedding Model (ONNX{' int8' if int8 else ''})...")
+        embeddings = OnnxEmbeddings(
+            settings.RAG_ONNX_MODEL_DIR,
+            int8=int8,
+            threads=getattr(settings, "RAG_ONNX_THREADS", 0) or None,
+        )
+        return embeddings, embedding_cache_name(backend)
+
+    from langchain_huggingface import HuggingFaceEmbeddings
+
+    print("📥 Loading Embedding Model...")
+    embeddings = HuggingFaceEmbeddings(
+        model_name=model_name,
+        model_kwargs={'device': 'cpu'},
+        encode_kwargs={'normalize_embeddings': False}
+    )
+    return embeddings, model_name
+
+
+# ใช้แทน "ยังไม่ได้โหลด" เพราะ None มีความหมายแล้ว (เช่น ไม่มี API Key / ต่อ Chroma ไม่ได้)
+_UNSET = object()
+
+
 class RAGService:
+    """
+    บริการ RAG ของ Plotcraft แบบ Lazy
+    - ไม่โหลดโมเดล/ไม่ต่อ ChromaDB ตอน import (migrate, collectstatic, test จะได้ไม่ช้า)
+    - Embedding Model, LLM และ Collection ถูกสร้างครั้งแรกที่มีการใช้งานจริง (thread-safe, สร้างครั้งเดียว)
+    - เรียก warmup() ถ้าอยากโหลดทุกอย่างไว้ล่วงหน้า
+    - เมธอด a* (achat_with_editor, ...) สำหรับ async view: await LLM ตรงๆ ส่วนงาน sync (Embed, Chroma, ORM)
+      ถูกส่งไปทำใน thread pool ที่จำกัดจำนวน (RAG_BLOCKING_WORKERS)
+    """
+
     def __init__(self):
         self.api_key = os.environ.get("GOOGLE_API_KEY")
-        
-        # 1. ตั้งค่า Model (เหมือนเดิม)
-        print("📥 Loading Embedding Model...")
-        self.embeddings = HuggingFaceEmbeddings(
-            model_name="sentence-transformers/paraphrase-multilingual-MiniLM-L12-v2",
-            model_kwargs={'device': 'cpu'},
-            encode_kwargs={'normalize_embeddings': False}
-        )
+        self.chroma_client = None
 
-        if self.api_key:
-            self.llm = GoogleGenerativeAI(
-                model="gemini-2.5-flash",
-                google_api_key=self.api_key,
-                temperature=0.7
-            )
+        # แยก Lock ต่อ Component กันโหลดโมเดลนานๆ แล้วไปบล็อกการต่อ Chroma
+        self._locks = {
+            "_embeddings": threading.Lock(),
+            "_llm": threading.Lock(),
+            "_collection": threading.Lock(),
+            "_lexical": threading.Lock(),
+        }
+        self._embeddings = _UNSET
+        self._llm = _UNSET
+        self._collection = _UNSET
+        self._lexical = _UNSET
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        self._compressing = set()   # id ของ ChatSession ที่กำลังย่อความจำอยู่ใน process นี้
+
+    def _get_or_init(self, attr, loader):
+        """ คืนค่า Component ถ้าโหลดแล้ว ไม่งั้นโหลดครั้งเดียว (double-checked locking) """
+        value = getattr(self, attr)
+        if value is _UNSET:
+            with self._locks[attr]:
+                value = getattr(self, attr)
+                if value is _UNSET:
+                    value = loader()
+                    setattr(self, attr, value)
+        return value
+
+    # ==================== 0. LAZY COMPONENTS ====================
+
+    def _load_embeddings(self):
+        socket_path = getattr(settings, "RAG_EMBED_SERVER_SOCKET", "")
+        if socket_path:
+            # ใช้โมเดลตัวเดียวใน rag_embed_server ร่วมกับ worker อื่น (ไม่โหลดโมเดลใน process นี้)
+            from .rag_embed_server import EmbeddingClient
+
+            print(f"🔌 Using embedding server at {socket_path}")
+            embeddings = EmbeddingClient(socket_path, timeout=getattr(settings, "RAG_EMBED_SERVER_TIMEOUT", 30))
+            model_name = embedding_cache_name()
         else:
-            self.llm = None
+            embeddings, model_name = load_embedding_model()
 
-        # 2. เชื่อมต่อ ChromaDB (เปลี่ยนชื่อ Collection เป็น plotcraft)
-        try:
-            self.chroma_client = chromadb.HttpClient(
-                host=os.environ.get("CHROMA_HOST", "chroma_db"), 
-                port=int(os.environ.get("CHROMA_PORT", 8000))
+        # ห่อด้วยแคช ข้อความเดิมจะไม่ต้องผ่านโมเดลซ้ำ (ใช้ไฟล์ร่วมกันทุก worker)
+        cache_path = getattr(settings, "RAG_EMBEDDING_CACHE_PATH", None)
+        if cache_path:
+            cache = EmbeddingCache(
+                cache_path,
+                max_bytes=getattr(settings, "RAG_EMBEDDING_CACHE_MAX_MB", 256) * 1024 * 1024,
+                lru_size=getattr(settings, "RAG_EMBEDDING_CACHE_LRU_SIZE", 2048),
             )
-            self.collection = self.chroma_client.get_or_create_collection(name="plotcraft_collection")
-            print("✅ RAG Service Initialized for Plotcraft")
+            embeddings = CachedEmbeddings(embeddings, cache, model_name)
+        return embeddings
+
+    def _load_llm(self):
+        if not self.api_key:
+            return None
+
+        from langchain_google_genai import GoogleGenerativeAI
+
+        # timeout/retry ของ client เอง สั้นกว่าค่าเริ่มต้นมาก (ค่าเริ่มต้น retry 6 รอบ = ค้างเป็นนาทีตอน Gemini ล่ม)
+        # ส่วน deadline รวม + circuit breaker อยู่ที่ breaker("llm") ตอนเรียก (ดู _invoke)
+        return GoogleGenerativeAI(
+            model="gemini-2.5-flash",
+            google_api_key=self.api_key,
+            temperature=0.7,
+            timeout=getattr(settings, "RAG_LLM_TIMEOUT", 60),
+            max_retries=getattr(settings, "RAG_LLM_MAX_RETRIES", 1),
+        )
+
+    def _load_collection(self):
+        """ Vector Store ตาม settings.RAG_VECTOR_BACKEND ('chroma' = ChromaDB HTTP, 'local' = ไฟล์ในเครื่อง) """
+        backend = getattr(settings, "RAG_VECTOR_BACKEND", "chroma")
+        try:
+            if backend == "local":
+                from .rag_vector_store import LocalVectorStore
+
+                store = LocalVectorStore(settings.RAG_LOCAL_STORE_PATH)
+                print(f"✅ RAG Service Initialized for Plotcraft (local store: {store.path})")
+                return store
+
+            import chromadb
+            from .rag_vector_store import ChromaVectorStore, GuardedVectorStore
+
+            def connect():
+                # เชื่อมต่อ ChromaDB (เปลี่ยนชื่อ Collection เป็น plotcraft) — ถูกเรียกใหม่ทุกครั้งที่ connection เดิมพัง
+                self.chroma_client = chromadb.HttpClient(
+                    host=os.environ.get("CHROMA_HOST", "chroma_db"),
+                    port=int(os.environ.get("CHROMA_PORT", 8000))
+                )
+                collection = self.chroma_client.get_or_create_collection(
+                    name="plotcraft_collection", metadata={"hnsw:space": "cosine"}
+                )
+                print("✅ RAG Service Initialized for Plotcraft")
+                return ChromaVectorStore(collection)
+
+            # ยังไม่ต่อตอนนี้: Chroma ล่มตอน boot จะไม่ทำให้ collection เป็น None ถาวรอีกต่อไป
+            return GuardedVectorStore(connect, breaker("chroma"))
         except Exception as e:
-            print(f"❌ ChromaDB Error: {e}")
-            self.collection = None
-    
+            print(f"❌ Vector Store Error ({backend}): {e}")
+            return None
+
+    def _load_lexical(self):
+        """ ดัชนีคำ BM25 (ไฟล์ SQLite) สำหรับค้นแบบ hybrid ปิดได้ด้วย RAG_LEXICAL_INDEX_PATH ว่าง """
+        return lexical_index()
+
+    @property
+    def embeddings(self):
+        return self._get_or_init("_embeddings", self._load_embeddings)
+
+    @property
+    def llm(self):
+        return self._get_or_init("_llm", self._load_llm)
+
+    @property
+    def collection(self):
+        return self._get_or_init("_collection", self._load_collection)
+
+    @property
+    def lexical(self):
+        return self._get_or_init("_lexical", self._load_lexical)
+
+    @property
+    def executor(self):
+        """ thread pool สำหรับงาน blocking ของ async view (สร้างครั้งแรกที่ใช้) """
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=getattr(settings, 'RAG_BLOCKING_WORKERS', 8),
+                        thread_name_prefix="rag-blocking",
+                    )
+        return self._executor
+
+    async def run_blocking(self, func, *args, **kwargs):
+        """ await งาน sync ที่ช้าโดยไม่บล็อก event loop """
+        loop = asyncio.get_running_loop()
+        # copy_context: stage() ที่จับเวลาใน thread ยังเห็นตัวเก็บ Server-Timing ของ request นี้
+        context = contextvars.copy_context()
+        job = partial(context.run, _run_blocking_job, func, *args, **kwargs)
+        return await loop.run_in_executor(self.executor, job)
+
+    def warmup(self):
+        """ โหลดทุก Component ไว้ล่วงหน้า (เช่น ตอน worker เริ่มทำงาน) เพื่อให้ request แรกไม่ช้า """
+        self.embeddings
+        self.llm
+        self.collection
+
+    def _store_document(self, doc_id, content, metadata):
+        """ บันทึกเอกสารชิ้นเดียว (ดู _store_documents) คืนค่า True ถ้ามีการ Embed ใหม่ """
+        return self._store_documents([(doc_id, content, metadata)]) > 0
+
+    def _store_documents(self, docs, source=None):
+        """
+        บันทึกเอกสารหลายชิ้นลง ChromaDB เฉพาะชิ้นที่ข้อความ/metadata เปลี่ยนจริง
+        - เทียบ fingerprint กับที่เคยบันทึกไว้ ถ้าเหมือนเดิม (เช่น autosave ซ้ำ, แค่สลับ is_draft) ข้ามการ Embed ไปเลย
+        - ชิ้นที่เปลี่ยนจะถูก Embed รวดเดียวด้วย embed_documents
+        - source: doc id หลักของ Object (เช่น 'chap_12') ชิ้นเก่าของ source นี้ที่ไม่อยู่ใน docs แล้วจะถูกลบ
+          (เช่น ตอนสั้นลง ชิ้นท้ายๆ หายไป)
+        docs = [(doc_id, content, metadata), ...] คืนค่าจำนวนชิ้นที่ Embed ใหม่
+        """
+        with stage("index_diff"):
+            fingerprints = {doc_id: content_fingerprint(content, metadata) for doc_id, content, metadata in docs}
+            known = dict(
+                RagDocument.objects.filter(doc_id__in=list(fingerprints)).values_list("doc_id", "fingerprint")
+            )
+            changed = [doc for doc in docs if known.get(doc[0]) != fingerprints[doc[0]]]
+
+        if changed:
+            ids = [doc_id for doc_id, _, _ in changed]
+            contents = [content for _, content, _ in changed]
+            with stage("index_embed"):
+                embeddings = self.embeddings.embed_documents(contents)
+
+            # upsert: id เดิมถูกแทนที่ทั้งข้อความและเวกเตอร์ (add เฉยๆ จะไม่ทับของเก่า)
+            with stage("index_upsert"):
+                self.collection.upsert(
+                    documents=contents,
+                    embeddings=embeddings,
+                    metadatas=[metadata for _, _, metadata in changed],
+                    ids=ids
+                )
+            if self.lexical:
+                with stage("index_lexical"):
+                    self.lexical.upsert(changed)
+            # จด fingerprint หลังเขียนครบทั้งสองดัชนี: ถ้า BM25 พัง (เช่น SQLite locked) งานคิวรอบใหม่ยังเห็นว่าชิ้นนี้เปลี่ยน
+            record_documents(changed)
+
+        if source:
+            stale = list(
+                RagDocument.objects.filter(source_q(source))
+                .exclude(doc_id__in=list(fingerprints))
+                .values_list("doc_id", flat=True)
+            )
+            if stale:
+                with stage("index_delete"):
+                    self.collection.delete(ids=stale)
+                    if self.lexical:
+                        self.lexical.delete(ids=stale)
+                    forget_documents(RagDocument.objects.filter(doc_id__in=stale))
+                count_index("deleted", len(stale))
+                print(f"🧹 RAG Removed {len(stale)} stale docs ({source})")
+
+        skipped = len(docs) - len(changed)
+        count_index("embedded", len(changed))
+        count_index("unchanged", skipped)
+        if skipped:
+            print(f"⏭️ RAG Unchanged: {skipped}/{len(docs)} docs")
+        return len(changed)
+
     # ==================== 1. NOVEL SUMMARY ====================
+    def build_novel_documents(self, novel):
+        """ เอกสารสรุปนิยาย (ชื่อเรื่อง, คำโปรย, หมวดหมู่) คืนค่า (source, docs) """
+        # ใช้ get_FOO_display() เพื่อให้ AI ได้คำเต็มภาษาไทย (เช่น 'แฟนตาซี' แทนที่จะเป็น 'FANTASY')
+        content = f"""
+        [สรุปข้อมูลนิยาย]
+        ชื่อเรื่อง: {novel.title}
+        คำโปรย/เรื่องย่อ: {novel.synopsis}
+        หมวดหมู่: {novel.get_category_display()}
+        ระดับเนื้อหา: {novel.get_rating_display()}
+        สถานะ: {novel.get_status_display()}
+        """
+        metadata = {
+            "type": "novel_summary",
+            "novel_id": str(novel.id),
+            "owner_id": str(novel.author_id)
+        }
+        source = f"novel_{novel.id}"
+        return source, [(source, content, metadata)]
+
     def add_novel_summary_to_rag(self, novel):
         """ จดจำสรุปเนื้อหานิยาย (ชื่อเรื่อง, คำโปรย, หมวดหมู่) """
         try:
-            # ใช้ get_FOO_display() เพื่อให้ AI ได้คำเต็มภาษาไทย (เช่น 'แฟนตาซี' แทนที่จะเป็น 'FANTASY')
-            content = f"""
-            [สรุปข้อมูลนิยาย]
-            ชื่อเรื่อง: {novel.title}
-            คำโปรย/เรื่องย่อ: {novel.synopsis}
-            หมวดหมู่: {novel.get_category_display()}
-            ระดับเนื้อหา: {novel.get_rating_display()}
-            สถานะ: {novel.get_status_display()}
-            """
-            
-            # ลบข้อมูลเก่าก่อน (ถ้ามี) แล้วค่อยเพิ่มใหม่ กันข้อมูลซ้ำ
-            self.delete_data_from_rag(f"novel_{novel.id}")
-
-            self.collection.add(
-                documents=[content],
-                embeddings=[self.embeddings.embed_query(content)],
-                metadatas=[{
-                    "type": "novel_summary",
-                    "novel_id": str(novel.id),
-                    "owner_id": str(novel.author.id)
-                }],
-                ids=[f"novel_{novel.id}"]
-            )
-            print(f"✅ RAG Added Novel Summary: {novel.title}")
+            source, docs = self.build_novel_documents(novel)
+            if self._store_documents(docs, source=source):
+                print(f"✅ RAG Added Novel Summary: {novel.title}")
         except Exception as e:
             print(f"❌ Error adding novel summary: {e}")
+            raise  # ให้ rag_worker รู้ว่าพัง จะได้ retry
+
+    def rebuild_story_bible(self, novel):
+        """ ประกอบคัมภีร์นิยายใหม่ (ข้อมูลใน DB ล้วน ไม่ต้อง Embed) งานคิว 'story_bible' ของ rag_worker """
+        if rebuild_bible(novel):
+            print(f"📖 Story bible rebuilt: {novel.title}")
 
     # ==================== 2. CHARACTER & CHAPTER ====================
 
+    def build_character_documents(self, char):
+        """ เอกสารข้อมูลตัวละคร คืนค่า (source, docs) """
+        # สร้างข้อความสรุปตัวละครจาก Field ใน models.py
+        content = f"""
+        [ข้อมูลตัวละคร]
+        ชื่อ: {char.name}
+        นามแฝง: {char.alias}
+        บทบาท: {char.role}
+        นิสัย: {char.personality}
+        ปูมหลัง: {char.background}
+        จุดแข็ง: {char.strengths}
+        จุดอ่อน: {char.weaknesses}
+        ทักษะ: {char.skills}
+        รูปลักษณ์: {char.appearance}
+        อาชีพ: {char.occupation}
+        อายุ: {char.age}
+        """
+        metadata = {
+            "type": "character",
+            "novel_id": str(char.project_id) if char.project_id else "unknown",
+            "owner_id": str(char.created_by_id) if char.created_by_id else "unknown",
+            "source_id": str(char.id)
+        }
+        source = f"char_{char.id}"
+        return source, [(source, content, metadata)]
+
     def add_character_to_rag(self, char):
         """ จดจำข้อมูลตัวละคร """
         try:
-            # สร้างข้อความสรุปตัวละครจาก Field ใน models.py
-            content = f"""
-            [ข้อมูลตัวละคร]
-            ชื่อ: {char.name}
-            นามแฝง: {char.alias}
-            บทบาท: {char.role}
-            นิสัย: {char.personality}
-            ปูมหลัง: {char.background}
-            จุดแข็ง: {char.strengths}
-            จุดอ่อน: {char.weaknesses}
-            ทักษะ: {char.skills}
-            รูปลักษณ์: {char.appearance}
-            อาชีพ: {char.occupation}
-            อายุ: {char.age}
-            """
-            
-            self.collection.add(
-                documents=[content],
-                embeddings=[self.embeddings.embed_query(content)],
-                metadatas=[{
-                    "type": "character",
-                    "novel_id": str(char.project.id) if char.project else "unknown",
-                    "owner_id": str(char.created_by.id) if char.created_by else "unknown",
-                    "source_id": str(char.id)
-                }],
-                ids=[f"char_{char.id}"]
-            )
-            print(f"✅ RAG Added Character: {char.name} (Owner: {char.created_by.id})")
+            source, docs = self.build_character_documents(char)
+            if self._store_documents(docs, source=source):
+                print(f"✅ RAG Added Character: {char.name} (Owner: {char.created_by_id})")
         except Exception as e:
             print(f"❌ Error adding character: {e}")
+            raise
+
+    # ==================== 3. CHAPTER ====================
 
-    # ==================== 3. CHAPTER ====================        
+    def build_chapter_documents(self, chapter):
+        """ เนื้อหาตอนหั่นเป็นชิ้น chap_{id}_{n} ให้พอดีกับโมเดล Embed คืนค่า (source, docs) """
+        metadata = {
+            "type": "content",
+            "novel_id": str(chapter.novel_id),
+            "source_id": str(chapter.id),
+            "owner_id": str(chapter.novel.author_id)
+        }
+        header = f"[เนื้อเรื่อง บทที่ {chapter.order}] ชื่อตอน: {chapter.title}"
+        chunks = chunk_text(html_to_text(chapter.content)) or [""]
+
+        docs = [
+            (f"chap_{chapter.id}_{n}", f"{header}\nเนื้อหา: {chunk}", {**metadata, "chunk": n})
+            for n, chunk in enumerate(chunks)
+        ]
+        return f"chap_{chapter.id}", docs
 
     def add_chapter_to_rag(self, chapter):
         """ จดจำเนื้อหาในแต่ละตอน """
         try:
-            # ตัดเนื้อหาถ้ายาวเกินไป (Optional) แต่ Gemini รองรับ Context ยาวได้พอสมควร
-            content = f"""
-            [เนื้อเรื่อง บทที่ {chapter.order}]
-            ชื่อตอน: {chapter.title}
-            เนื้อหา: {chapter.content}
-            """
-            
-            self.collection.add(
-                documents=[content],
-                embeddings=[self.embeddings.embed_query(content)],
-                metadatas=[{
-                    "type": "content",
-                    "novel_id": str(chapter.novel.id),
-                    "source_id": str(chapter.id),
-                    "owner_id": str(chapter.novel.author.id)
-                }],
-                ids=[f"chap_{chapter.id}"]
-            )
-            print(f"✅ Added Chapter: {chapter.title}")
+            source, docs = self.build_chapter_documents(chapter)
+            changed = self._store_documents(docs, source=source)
+            if changed:
+                print(f"✅ Added Chapter: {chapter.title} ({changed}/{len(docs)} chunks)")
         except Exception as e:
-             print(f"❌ Error adding chapter: {e}")
+            print(f"❌ Error adding chapter: {e}")
+            raise
+
+    # ==================== 3.1 STORY SUMMARIES ====================
+
+    def build_summary_documents(self, summary):
+        """ เอกสารสรุป (ตอน/ช่วง/ทั้งเรื่อง) หนึ่งอัน คืนค่า (source, docs) """
+        return summary.key, [build_summary_document(summary, summary.novel.author_id)]
+
+    def update_story_summaries(self, novel):
+        """
+        งานคิว 'story_summaries': สรุปตอนที่เนื้อหาเปลี่ยน -> รวมเป็นสรุปช่วง/ทั้งเรื่อง (ดู rag_summaries)
+        แล้ว Index สรุปทุกชั้นคู่กับชิ้นเนื้อหา (ชิ้นที่ไม่เปลี่ยนถูกข้ามด้วย fingerprint อยู่แล้ว)
+        """
+        summarize = None
+        if self.llm:
+            summarize = lambda prompt, level: self._invoke(self.llm, prompt, f"summary_{level}")
+        changed, pending = refresh_summaries(novel, summarize)
+
+        docs = summary_documents(novel)
+        self._store_documents(docs)
+        stale = list(
+            RagDocument.objects.filter(novel_id=str(novel.pk))
+            .filter(Q(doc_id__startswith="chapsum_") | Q(doc_id__startswith="arcsum_") | Q(doc_id__startswith="novsum_"))
+            .exclude(doc_id__in=[doc_id for doc_id, _, _ in docs])
+            .values_list("doc_id", flat=True)
+        )
+        if stale:
+            # เอกสารสรุปไม่มีชิ้นย่อย ลบรวดเดียวด้วย id (ไม่ต้องไปทีละชิ้นผ่าน delete_data_from_rag)
+            with stage("index_delete"):
+                self.collection.delete(ids=stale)
+                if self.lexical:
+                    self.lexical.delete(ids=stale)
+                removed = forget_documents(RagDocument.objects.filter(doc_id__in=stale))
+            count_index("deleted", removed)
+            print(f"🧹 RAG Removed {len(stale)} stale summary docs ({novel.title})")
+
+        if changed:
+            print(f"📝 Story summaries updated: {novel.title}")
+            rebuild_bible(novel)   # คัมภีร์ใช้สรุปตอนล่าสุด/สรุปทั้งเรื่อง
+        if pending:
+            enqueue('story_summaries', novel.pk)   # ตอนที่เหลือทำรอบถัดไป
 
     # ==================== 4. CHAT WITH EDITOR & SCENE DRAFTER ====================
 
-    def chat_with_editor(self, user_query, novel_id=None, user_id=None):
-        """ ฟังก์ชันคุยกับพี่บก. (รวมร่าง: คุยเล่น + ตรวจงาน) """
+    def retrieve_context(self, user_query, novel_id=None, user_id=None):
+        """ ค้นบริบทให้พี่บก.: สรุปนิยาย + เอกสารที่ใกล้คำถาม ประกอบแล้ว (ดู rag_context.assemble_context) """
+        summary = ""
+
+        # ---------------------------------------------------------
+        # STEP A: บริบทหลักของนิยาย (คัมภีร์: เรื่องย่อ + ตัวละครหลัก + สถานที่ + ตอนล่าสุด) ก่อนเสมอ
+        # อ่านแถวเดียวจาก DB ไม่ต้องถาม Vector Store (ดู rag_bible)
+        # ---------------------------------------------------------
+        if novel_id:
+            with stage("summary"):
+                summary = story_bible(novel_id, owner_id=user_id)
+
+        # ---------------------------------------------------------
+        # STEP A2: คำถามเอ่ยชื่อตัวละคร/สถานที่/ไอเทม -> ขอบเขตการค้นเพิ่ม: เอกสารของตัวละครนั้น + ตอน/ฉากที่เอ่ยถึง
+        # (ดัชนี mention บอกแค่ "ที่ไหนพูดถึง" ลำดับยังตัดสินด้วยความใกล้คำถาม ไม่ใช่จำนวนครั้งที่เอ่ยชื่อ)
+        # ---------------------------------------------------------
+        entity_sources, mention_scope = [], []
+        if novel_id:
+            with stage("mention_route"):
+                entity_sources, mention_scope = self._mention_scope(user_query, novel_id, user_id)
+
+        # ---------------------------------------------------------
+        # STEP B: ค้นหา Vector (เนื้อหาอื่นๆ ที่ตรงกับคำถาม)
+        # ---------------------------------------------------------
+        with stage("embed_query"):
+            query_vector = self.embeddings.embed_query(user_query)
+
+        where_conditions = [{"owner_id": str(user_id)}]
+        if novel_id:
+            where_conditions.append({"novel_id": str(novel_id)})
+
+        if len(where_conditions) > 1:
+            final_where = {"$and": where_conditions}
+        else:
+            final_where = where_conditions[0]
+
+        # ดึงตัวเลือกมาเผื่อ แล้วให้ assemble_context คัด (ตัดซ้ำ + MMR + งบ token)
+        n_results = getattr(settings, 'RAG_CONTEXT_CANDIDATES', 8)
+        with stage("vector_query"):
+            results = self.collection.query(
+                query_embeddings=[query_vector],
+                n_results=n_results,
+                where=final_where,
+                include=["documents", "metadatas", "distances", "embeddings"]
+            )
+        candidates = self._query_candidates(results)
+        by_id = {c["id"]: c for c in candidates}
+        rankings = [[c["id"] for c in candidates]]
+
+        # ---------------------------------------------------------
+        # STEP B2: ค้น Vector ซ้ำเฉพาะในขอบเขตของชื่อที่เอ่ยถึง (เอกสารตัวละครนั้นขึ้นก่อน) เป็นอีกหนึ่งอันดับให้ RRF
+        # ---------------------------------------------------------
+        if entity_sources or mention_scope:
+            with stage("mention_query"):
+                scoped = self._scoped_candidates(query_vector, where_conditions, entity_sources, mention_scope, n_results)
+            for candidate in scoped:
+                by_id.setdefault(candidate["id"], candidate)
+            rankings.append([c["id"] for c in scoped])
+            print(f"🏷️ Name mentions scoped {len(scoped)} docs")
+
+        # ---------------------------------------------------------
+        # STEP C: ค้นจากดัชนีคำ (BM25) แล้วรวมอันดับกับผล Vector ด้วย RRF
+        # ชื่อเฉพาะ (ตัวละคร/สถานที่/ของวิเศษ) ที่ Embedding มองข้าม จะถูกดึงขึ้นมาตรงนี้
+        # ---------------------------------------------------------
+        if self.lexical:
+            with stage("lexical"):
+                hits = self.lexical.search(
+                    user_query, user_id, novel_id=novel_id, k=getattr(settings, 'RAG_LEXICAL_CANDIDATES', 8)
+                )
+                missing = [doc_id for doc_id, _ in hits if doc_id not in by_id]
+                if missing:
+                    extra = self.collection.get(ids=missing, include=["documents", "metadatas", "embeddings"])
+                    for candidate in self._candidates(extra['ids'], extra['documents'], extra['metadatas'],
+                                                      extra.get('embeddings')):
+                        by_id[candidate["id"]] = candidate
+            rankings.append([doc_id for doc_id, _ in hits])
+            if missing:
+                print(f"🔤 Lexical search added {len(missing)} docs")
+
+        if len(rankings) > 1:
+            fused = reciprocal_rank_fusion(rankings, k=getattr(settings, 'RAG_RRF_K', 60))
+            top = fused[0][1] if fused else 1.0
+            candidates = [dict(by_id[doc_id], relevance=score / top) for doc_id, score in fused if doc_id in by_id]
+
+        with stage("assemble"):
+            return assemble_context(summary, candidates)
+
+    def _query_candidates(self, results):
+        """ ผลของ collection.query (คำถามเดียว) -> รายการ candidate """
+        embeddings = results.get('embeddings')
+        return self._candidates(results['ids'][0], results['documents'][0], results['metadatas'][0],
+                                embeddings[0] if embeddings is not None else None, results['distances'][0])
+
+    def _mention_scope(self, user_query, novel_id, user_id):
+        """
+        สิ่งที่ถูกเอ่ยชื่อในคำถาม -> (doc id ของตัวละครที่ถูกเอ่ยชื่อ, source ของตอน/ฉากที่เอ่ยถึงสิ่งเหล่านั้น)
+        คืน ([], []) ถ้าคำถามไม่ได้เอ่ยชื่อใคร
+        """
+        novel = Novel.objects.filter(pk=novel_id, author_id=user_id).first()
+        if novel is None:
+            return [], []
+        entities = mentioned_entities(novel, user_query, automaton_for(novel))
+        if not entities:
+            return [], []
+
+        characters = [f"char_{entity_id}" for type_name, entity_id in entities if type_name == "character"]
+        indexed = set(
+            RagDocument.objects.filter(doc_id__in=characters, owner_id=str(user_id)).values_list("doc_id", flat=True)
+        )
+        sources = mention_sources(novel, entities, limit=getattr(settings, 'RAG_MENTION_MAX_SOURCES', 20))
+        return [doc_id for doc_id in characters if doc_id in indexed], sources
+
+    def _scoped_candidates(self, query_vector, where_conditions, entity_sources, mention_scope, n_results):
+        """ เอกสารตัวละครที่ถูกเอ่ยชื่อ + ชิ้นของตอน/ฉากในขอบเขต เรียงตามความใกล้คำถาม (Vector Search ที่กรองด้วย source) """
+        scoped = []
+        if entity_sources:
+            found = self.collection.get(ids=entity_sources, include=["documents", "metadatas", "embeddings"])
+            scoped += self._candidates(found['ids'], found['documents'], found['metadatas'], found.get('embeddings'))
+
+        by_type = {"content": [], "scene": []}
+        for source in mention_scope:
+            prefix, source_id = source.split("_", 1)
+            by_type["content" if prefix == "chap" else "scene"].append(source_id)
+        clauses = [
+            {"$and": [{"type": doc_type}, {"source_id": {"$in": ids}}]} for doc_type, ids in by_type.items() if ids
+        ]
+        if clauses:
+            scope_filter = clauses[0] if len(clauses) == 1 else {"$or": clauses}
+            results = self.collection.query(
+                query_embeddings=[query_vector],
+                n_results=n_results,
+                where={"$and": where_conditions + [scope_filter]},
+                include=["documents", "metadatas", "distances", "embeddings"]
+            )
+            scoped += self._query_candidates(results)
+        return scoped
+
+    @staticmethod
+    def _candidates(ids, documents, metadatas, embeddings=None, distances=None):
+        """ ผลจาก Vector Store (แบบ list ขนานกัน) -> รายการ dict ที่ assemble_context ใช้ """
+        return [
+            {
+                "id": doc_id,
+                "text": documents[i] or "",
+                "metadata": metadatas[i] or {},
+                "distance": distances[i] if distances is not None else None,
+                "embedding": [float(x) for x in embeddings[i]] if embeddings is not None else None,
+            }
+            for i, doc_id in enumerate(ids)
+        ]
+
+    def build_editor_prompt(self, user_query, novel_id=None, user_id=None, history=""):
+        """
+        ค้นบริบท + ประกอบ Prompt ของพี่บก. (ใช้ร่วมกันทั้งแบบตอบทีเดียวและแบบ Stream)
+        history = ความจำของแชทนี้จาก rag_memory.format_history (ว่าง = คุยครั้งแรก)
+        """
         print(f"💬 Chatting with Editor. Novel ID: {novel_id}, User ID: {user_id}")
-        
+
         context_text = ""
-        
+
         # ค้นหาข้อมูล (ต้องมี User ID เสมอเพื่อความปลอดภัย)
-        if user_id: 
+        if user_id:
             try:
-                # ---------------------------------------------------------
-                # STEP A: ดึงข้อมูลสรุปนิยาย (Novel Summary) ก่อนเสมอ
-                # ---------------------------------------------------------
-                if novel_id:
-                    summary_results = self.collection.get(
-                        where={
-                            "$and": [
-                                {"type": "novel_summary"},
-                                {"novel_id": str(novel_id)}
-                            ]
-                        },
-                        limit=1
+                # คำถามเดิม/เกือบเดิมในนิยายที่ยังไม่ถูกแก้ -> ใช้ผลค้นหาเดิม ไม่ต้อง Embed/ค้น Vector ซ้ำ
+                with stage("retrieve"):
+                    retrieved = get_or_retrieve(
+                        user_id, novel_id, user_query,
+                        lambda: self.retrieve_context(user_query, novel_id=novel_id, user_id=user_id)
                     )
-                    if summary_results['documents']:
-                        context_text += f"📌 [บริบทหลัก: ข้อมูลนิยาย]\n{summary_results['documents'][0]}\n\n"
-
-                # ---------------------------------------------------------
-                # STEP B: ค้นหา Vector (เนื้อหาอื่นๆ ที่ตรงกับคำถาม)
-                # ---------------------------------------------------------
-                query_vector = self.embeddings.embed_query(user_query)
-                
-                where_conditions = [{"owner_id": str(user_id)}]
-                if novel_id:
-                    where_conditions.append({"novel_id": str(novel_id)})
-                
-                if len(where_conditions) > 1:
-                    final_where = {"$and": where_conditions}
-                else:
-                    final_where = where_conditions[0]
-
-                results = self.collection.query(
-                    query_embeddings=[query_vector],
-                    n_results=3,
-                    where=final_where 
-                )
-                
-                docs = results['documents'][0]
-                if docs:
-                    context_text = "\n\n".join(docs)
-                    print(f"📚 Found {len(docs)} related docs")
-                    
+
+                # สรุปนิยายมาก่อน ตามด้วยตัวละคร/ฉาก/เนื้อเรื่อง (ไม่เขียนทับกันแล้ว)
+                context_text = format_context(retrieved)
+                if retrieved["items"]:
+                    print(f"📚 Found {len(retrieved['items'])} related passages (~{retrieved['tokens']} tokens)")
+
             except Exception as e:
                 print(f"RAG Error: {e}")
 
@@ -201,6 +676,9 @@ class RAGService:
         บริบทนิยายที่กำลังคุยถึง (Context):
         {context_text if context_text else "ยังไม่มีข้อมูลนิยายเจาะจง ให้คุยเรื่องเทคนิคการเขียนทั่วไป"}
 
+        บทสนทนาก่อนหน้านี้ (ความจำของพี่):
+        {history if history else "ยังไม่เคยคุยกันมาก่อน"}
+
         ข้อความจากน้องนักเขียน: 
         "{user_query}"
 
@@ -208,6 +686,7 @@ class RAGService:
         1. วิเคราะห์คำถามของน้องร่วมกับ Context ที่มี
         2. อย่าแค่ตอบรับเฉย ๆ ให้ **"เสนอไอเดียเพิ่ม"** หรือ **"ชวนคิดมุมกลับ"** เสมอ
         3. ถ้า Context มีข้อมูลตัวละคร ให้ยกชื่อตัวละครมาพูดถึงเพื่อให้รู้ว่าพี่อ่านอยู่จริง
+        4. ถ้าน้องพูดต่อจากเรื่องที่เคยคุยกันไว้ ให้ตอบต่อเนื่องจากบทสนทนาก่อนหน้า ไม่ต้องถามซ้ำสิ่งที่น้องบอกไปแล้ว
 
         Format (รูปแบบการตอบ):
         - Tone: ภาษาพูด เหมือนพิมพ์แชทไลน์ (แทนตัวว่า "พี่" แทน User ว่า "เรา/น้อง/เตง")
@@ -222,32 +701,191 @@ class RAGService:
 
         เริ่มตอบน้องเขาได้เลย:
         """
-        
+        return prompt
+
+    async def achat_with_editor(self, user_query, novel_id=None, user_id=None):
+        """ คุยกับพี่บก. (รวมร่าง: คุยเล่น + ตรวจงาน) จำบทสนทนาก่อนหน้าของผู้ใช้ในนิยายนี้ได้ """
+        session, history = await self.run_blocking(self._load_memory, novel_id, user_id)
+        prompt = await self.run_blocking(
+            self.build_editor_prompt, user_query, novel_id=novel_id, user_id=user_id, history=history
+        )
+        llm = await self.run_blocking(lambda: self.llm)
+
         try:
-            if self.llm:
-                return self.llm.invoke(prompt)
-            return "ระบบพี่ยังไม่พร้อมใช้งานค่ะ (No API Key)"
+            if not llm:
+                return "ระบบพี่ยังไม่พร้อมใช้งานค่ะ (No API Key)"
+            reply = await self._ainvoke(llm, prompt, "chat")
         except Exception as e:
             return f"ขอโทษทีนะ พี่มึนหัวนิดหน่อย (Error: {str(e)})"
-    
-    def generate_scene_draft(self, scene):
-        """ ฟังก์ชันสำหรับช่วยร่างฉากนิยาย (Scene Drafter) """
-        print(f"✍️ Drafting Scene: {scene.title}")
-        
+        await self.run_blocking(self._remember, session, user_query, reply)
+        return reply
+
+    async def astream_chat_with_editor(self, user_query, novel_id=None, user_id=None):
+        """ เหมือน achat_with_editor แต่ทยอยคืนข้อความทีละท่อนตามที่ LLM พิมพ์ออกมา """
+        session, history = await self.run_blocking(self._load_memory, novel_id, user_id)
+        prompt = await self.run_blocking(
+            self.build_editor_prompt, user_query, novel_id=novel_id, user_id=user_id, history=history
+        )
+        async for text in self._astream(
+            prompt,
+            unavailable="ระบบพี่ยังไม่พร้อมใช้งานค่ะ (No API Key)",
+            error_prefix="ขอโทษทีนะ พี่มึนหัวนิดหน่อย",
+            label="chat",
+            on_done=partial(self._remember, session, user_query),
+        ):
+            yield text
+
+    # ---------- ความจำของแชท (ดู rag_memory) ----------
+
+    @staticmethod
+    def _load_memory(novel_id, user_id):
+        """ (ChatSession, ข้อความประวัติสำหรับ Prompt) — ไม่มี user_id = ไม่จำ """
+        if not user_id:
+            return None, ""
         try:
-            # 1. เตรียมข้อมูลวัตถุดิบ (Raw Data)
-            pov_name = scene.pov_character.name if scene.pov_character else "ไม่ระบุ"
-            pov_desc = f"นิสัย: {scene.pov_character.personality}, รูปลักษณ์: {scene.pov_character.appearance}" if scene.pov_character else ""
-            
-            loc_name = scene.location.name if scene.location else "ไม่ระบุ"
-            loc_desc = f"สภาพแวดล้อม: {scene.location.terrain}, บรรยากาศ: {scene.location.climate}" if scene.location else ""
-            
-            other_chars = ", ".join([c.name for c in scene.characters.all()]) or "ไม่มี"
+            session = get_session(user_id, novel_id)
+            return session, format_history(session)
+        except Exception as e:
+            print(f"⚠️ Chat memory unavailable: {e}")
+            return None, ""
+
+    def _remember(self, session, user_query, reply):
+        """ บันทึกคำถาม-คำตอบ (เฉพาะที่ LLM ตอบสำเร็จ) แล้วให้ย่อความจำเบื้องหลังถ้าถึงเกณฑ์ """
+        if session is None:
+            return
+        try:
+            remember(session, user_query, str(reply))
+        except Exception as e:
+            print(f"⚠️ Chat memory not saved: {e}")
+            return
+        # ไม่ให้ผู้ใช้ต้องรอ LLM สรุป: ส่งไปทำใน thread pool (ไม่ผูกกับ event loop ของ request)
+        self.executor.submit(_run_blocking_job, self._compress_memory, session.pk)
+
+    def _compress_memory(self, session_id):
+        if session_id in self._compressing:
+            return
+        self._compressing.add(session_id)
+        try:
+            if self.llm:
+                compress(session_id, lambda prompt: self._invoke(self.llm, prompt, "chat_summary"))
+        except Exception as e:
+            print(f"⚠️ Chat memory compression failed: {e}")
+        finally:
+            self._compressing.discard(session_id)
+
+    @staticmethod
+    def _invoke(llm, prompt, label):
+        """
+        llm.invoke ผ่าน circuit breaker (เกิน RAG_LLM_TIMEOUT / Gemini ล่มต่อเนื่อง -> DependencyUnavailable ทันที)
+        + จับเวลา/ขนาด Prompt-คำตอบ (label = ชื่องานใน metrics เช่น 'chat')
+        """
+        with stage(f"llm_{label}"):
+            response = breaker("llm").call(llm.invoke, prompt)
+        record_llm(label, prompt, response)
+        return response
+
+    @staticmethod
+    async def _ainvoke(llm, prompt, label):
+        """ _invoke แบบ async """
+        with stage(f"llm_{label}"):
+            response = await breaker("llm").acall(lambda: llm.ainvoke(prompt))
+        record_llm(label, prompt, response)
+        return response
+
+    async def _astream(self, prompt, unavailable, error_prefix, kind=None, user_id=None, label=None, on_done=None):
+        """
+        ส่ง Prompt ให้ LLM แบบ Stream แล้ว yield ข้อความทีละท่อน: ถ้า task ถูกยกเลิก (client ตัดการเชื่อมต่อ) stream ของ LLM จะถูกปิดตาม
+        kind: ชื่องานเจน (เช่น 'scene_draft') -> ผ่าน generation layer (single-flight + แคชผล)
+        on_done(ข้อความเต็ม): งาน sync ที่ทำใน thread pool เมื่อ LLM ตอบจบครบโดยไม่มี Error
+        """
+        llm = await self.run_blocking(lambda: self.llm)
+        if not llm:
+            yield unavailable
+            return
+
+        label = label or kind or "stream"
+        if kind:
+            source = generation.stream(kind, user_id, prompt, lambda: self._llm_astream(llm, prompt, label))
+        else:
+            source = self._llm_astream(llm, prompt, label)
+        parts = []
+        try:
+            async for text in source:
+                parts.append(text)
+                yield text
+        except Exception as e:
+            print(f"Stream Error: {e}")
+            yield f"{error_prefix} (Error: {str(e)})"
+        else:
+            if on_done and parts:
+                await self.run_blocking(on_done, "".join(parts))
+        finally:
+            await source.aclose()
+
+    @staticmethod
+    async def _llm_astream(llm, prompt, label="stream"):
+        """
+        ข้อความทีละท่อนจาก LLM ตรงๆ (Error โยนออกไปให้คนเรียกจัดการ)
+        ผ่าน circuit breaker และรอแต่ละท่อนไม่เกิน RAG_LLM_TIMEOUT (stream ค้างกลางทางก็เลิกรอ)
+        """
+        guard = breaker("llm")
+        guard.before_call()
+        stream = llm.astream(prompt)
+        parts = []
+        started = time.perf_counter()
+        try:
+            with stage(f"llm_{label}"):
+                while True:
+                    try:
+                        chunk = await asyncio.wait_for(anext(stream), guard.timeout)
+                    except StopAsyncIteration:
+                        break
+                    except asyncio.TimeoutError:
+                        if not parts:
+                            guard.record_failure()
+                        raise DependencyUnavailable("llm", f"stream stalled for {guard.timeout:g}s",
+                                                    retry_after=guard.reset_seconds) from None
+                    except Exception:
+                        if not parts:
+                            guard.record_failure()
+                        raise
+                    # LLM ธรรมดาคืน str, Chat Model คืน MessageChunk
+                    text = getattr(chunk, "content", chunk)
+                    if text:
+                        if not parts:
+                            observe(f"llm_{label}_first_token", time.perf_counter() - started)
+                            guard.record_success()
+                        parts.append(text)
+                        yield text
+            if not parts:
+                guard.record_success()
+        finally:
+            guard.release()
+            if hasattr(stream, "aclose"):
+                await stream.aclose()
+            record_llm(label, prompt, "".join(parts))
+
+    def build_scene_prompt(self, scene, concept=""):
+        """ ประกอบ Prompt ให้นักเขียนเงาจากโครงสร้างฉาก (+ ไอเดียเพิ่มเติมที่นักเขียนพิมพ์มา ถ้ามี) """
+        # 1. เตรียมข้อมูลวัตถุดิบ (Raw Data)
+        pov_name = scene.pov_character.name if scene.pov_character else "ไม่ระบุ"
+        pov_desc = f"นิสัย: {scene.pov_character.personality}, รูปลักษณ์: {scene.pov_character.appearance}" if scene.pov_character else ""
+
+        loc_name = scene.location.name if scene.location else "ไม่ระบุ"
+        loc_desc = f"สภาพแวดล้อม: {scene.location.terrain}, บรรยากาศ: {scene.location.climate}" if scene.location else ""
+
+        other_chars = ", ".join([c.name for c in scene.characters.all()]) or "ไม่มี"
+        with stage("summary"):
+            bible = story_bible(scene.project_id)
+        concept_line = f"\n            💡 ไอเดียเพิ่มเติมจากนักเขียน: {concept}\n" if concept else ""
 
-            # 2. สร้าง Prompt สำหรับนักเขียนเงา
-            prompt = f"""
+        # 2. สร้าง Prompt สำหรับนักเขียนเงา
+        return f"""
             Role: คุณคือ "Ghostwriter" มืออาชีพ หน้าที่ของคุณคือร่างเนื้อหานิยาย (First Draft) จากโครงเรื่องที่กำหนดให้
             
+            📚 ข้อมูลหลักของนิยาย (ใช้ให้ชื่อ/นิสัย/โลกของเรื่องตรงกัน):
+            {bible or "ไม่มีข้อมูล"}
+
             🏗️ โครงสร้างฉาก (Scene Structure):
             - ชื่อฉาก: {scene.title}
             - ตัวละครดำเนินเรื่อง (POV): {pov_name} ({pov_desc})
@@ -257,7 +895,7 @@ class RAGService:
             🎯 เป้าหมายของฉาก (Goal): {scene.goal}
             🚧 อุปสรรค/ความขัดแย้ง (Conflict): {scene.conflict}
             🏁 ผลลัพธ์ของฉาก (Outcome): {scene.outcome}
-            
+            {concept_line}
             📝 คำสั่งการเขียน:
             1. เขียนบรรยายในรูปแบบ "นิยาย" (Narrative) มุมมองบุคคลที่ 3 (หรือ 1 ตามความเหมาะสมของ POV)
             2. เริ่มต้นด้วยการบรรยายบรรยากาศสถานที่ (Setting the scene) ให้เห็นภาพ
@@ -268,75 +906,132 @@ class RAGService:
             
             เริ่มร่างเนื้อหา:
             """
-            
-            if self.llm:
-                return self.llm.invoke(prompt)
+
+    async def agenerate_scene_draft(self, scene, concept="", user_id=None):
+        """ ช่วยร่างฉากนิยาย (Scene Drafter) ผ่าน generation layer (single-flight + แคชผล) """
+        print(f"✍️ Drafting Scene: {scene.title}")
+
+        try:
+            prompt = await self.run_blocking(self.build_scene_prompt, scene, concept)
+            llm = await self.run_blocking(lambda: self.llm)
+            if llm:
+                return await generation.run("scene_draft", user_id, prompt,
+                                            lambda: self._ainvoke(llm, prompt, "scene_draft"))
             return "ระบบยังไม่พร้อมใช้งานค่ะ (No API Key)"
-            
+
         except Exception as e:
             print(f"Draft Error: {e}")
             return f"เกิดข้อผิดพลาดในการร่าง: {str(e)}"
-        
-    
-        
+
+    async def astream_scene_draft(self, scene, concept="", user_id=None):
+        """ ร่างฉากแบบ Stream: ทยอยคืนเนื้อหาทีละท่อน """
+        print(f"✍️ Drafting Scene (stream): {scene.title}")
+        async for text in self._astream(
+            await self.run_blocking(self.build_scene_prompt, scene, concept),
+            unavailable="ระบบยังไม่พร้อมใช้งานค่ะ (No API Key)",
+            error_prefix="เกิดข้อผิดพลาดในการร่าง",
+            kind="scene_draft",
+            user_id=user_id,
+        ):
+            yield text
+
+    def build_scene_documents(self, scene):
+        """ เอกสารโครงสร้างฉาก (Goal, Conflict, Outcome) + เนื้อหาฉากเป็นชิ้นๆ คืนค่า (source, docs) """
+        # 1. เตรียมข้อมูลให้ AI อ่านง่าย
+        pov = scene.pov_character.name if scene.pov_character else "ไม่ระบุ"
+        loc = scene.location.name if scene.location else "ไม่ระบุ"
+        chars = ", ".join([c.name for c in scene.characters.all()]) or "-"
+
+        content = f"""
+        [ข้อมูลฉาก]
+        ชื่อฉาก: {scene.title} (ลำดับที่ {scene.order})
+        สถานะ: {scene.get_status_display()}
+        สถานที่: {loc}
+        ตัวละครดำเนินเรื่อง (POV): {pov}
+        ตัวละครประกอบ: {chars}
+
+        🎯 เป้าหมาย (Goal): {scene.goal}
+        🚧 อุปสรรค (Conflict): {scene.conflict}
+        🏁 ผลลัพธ์ (Outcome): {scene.outcome}
+        """
+        metadata = {
+            "type": "scene",
+            "novel_id": str(scene.project_id) if scene.project_id else "unknown",
+            "owner_id": str(scene.created_by_id) if scene.created_by_id else "unknown",
+            "source_id": str(scene.id)
+        }
+
+        # 2. เนื้อหาฉากหั่นเป็นชิ้น scene_{id}_{n} (แทนการตัดแค่ 1000 ตัวอักษรแรก)
+        source = f"scene_{scene.id}"
+        docs = [(source, content, metadata)]
+        for n, chunk in enumerate(chunk_text(html_to_text(scene.content))):
+            docs.append((
+                f"scene_{scene.id}_{n}",
+                f"[เนื้อหาฉาก] {scene.title}\n{chunk}",
+                {**metadata, "chunk": n}
+            ))
+        return source, docs
+
     def add_scene_to_rag(self, scene):
         """ จดจำข้อมูลโครงสร้างฉาก (Goal, Conflict, Outcome) """
         try:
-            # 1. เตรียมข้อมูลให้ AI อ่านง่าย
-            pov = scene.pov_character.name if scene.pov_character else "ไม่ระบุ"
-            loc = scene.location.name if scene.location else "ไม่ระบุ"
-            chars = ", ".join([c.name for c in scene.characters.all()]) or "-"
-            
-            content = f"""
-            [ข้อมูลฉาก]
-            ชื่อฉาก: {scene.title} (ลำดับที่ {scene.order})
-            สถานะ: {scene.get_status_display()}
-            สถานที่: {loc}
-            ตัวละครดำเนินเรื่อง (POV): {pov}
-            ตัวละครประกอบ: {chars}
-            
-            🎯 เป้าหมาย (Goal): {scene.goal}
-            🚧 อุปสรรค (Conflict): {scene.conflict}
-            🏁 ผลลัพธ์ (Outcome): {scene.outcome}
-            
-            📝 เนื้อหาบางส่วน:
-            {scene.content[:1000] if scene.content else "ยังไม่มีเนื้อหา"}
-            """
-            
-            # 2. บันทึกลง ChromaDB
-            self.collection.add(
-                documents=[content],
-                embeddings=[self.embeddings.embed_query(content)],
-                metadatas=[{
-                    "type": "scene",
-                    "novel_id": str(scene.project.id) if scene.project else "unknown",
-                    "owner_id": str(scene.created_by.id) if scene.created_by else "unknown",
-                    "source_id": str(scene.id)
-                }],
-                ids=[f"scene_{scene.id}"]
-            )
-            print(f"✅ RAG Added Scene: {scene.title}")
-            
+            source, docs = self.build_scene_documents(scene)
+            changed = self._store_documents(docs, source=source)
+            if changed:
+                print(f"✅ RAG Added Scene: {scene.title} ({changed}/{len(docs)} docs)")
         except Exception as e:
             print(f"❌ Error adding scene: {e}")
-        
+            raise
+
     def delete_data_from_rag(self, doc_id):
-        """ ฟังก์ชันลบข้อมูลออกจากสมอง AI """
+        """ ฟังก์ชันลบข้อมูลออกจากสมอง AI (รวมชิ้นย่อย {doc_id}_{n} ด้วย) """
         try:
-            self.collection.delete(ids=[doc_id])
+            chunk_ids = list(RagDocument.objects.filter(source_q(doc_id)).values_list("doc_id", flat=True))
+            ids = list({doc_id, *chunk_ids})
+            with stage("index_delete"):
+                self.collection.delete(ids=ids)
+                if self.lexical:
+                    self.lexical.delete(ids=ids)
+                removed = forget_documents(RagDocument.objects.filter(doc_id__in=ids))
+            count_index("deleted", removed)
             print(f"🗑️ Deleted from RAG: {doc_id}")
         except Exception as e:
             print(f"❌ Error deleting from RAG: {e}")
+            raise
 
-    def generate_character_data(self, concept):
-        """ ช่วยคิด/แกะข้อมูลตัวละคร (รองรับทั้งบรีฟสั้นและยาว) """
-        import json
-        import re
-        
-        print(f"🎨 Processing Character Concept: {concept[:50]}...")
-        
+    def delete_novel_from_rag(self, novel_id):
+        """ ลบทุกอย่างของนิยายเรื่องนี้ (สรุป, ตัวละคร, ตอน, ฉาก) ด้วยคำสั่งเดียว แทนการลบทีละแถว """
+        try:
+            with stage("index_delete"):
+                self.collection.delete(where={"novel_id": str(novel_id)})
+                if self.lexical:
+                    self.lexical.delete(novel_id=novel_id)
+                removed = forget_documents(RagDocument.objects.filter(novel_id=str(novel_id)))
+            count_index("deleted", removed)
+            bump_versions(novel_ids=[novel_id])
+            print(f"🗑️ Deleted Novel from RAG: {novel_id} ({removed} docs)")
+        except Exception as e:
+            print(f"❌ Error deleting novel from RAG: {e}")
+            raise
+
+    def delete_owner_from_rag(self, owner_id):
+        """ ลบทุกอย่างของผู้ใช้คนนี้ด้วยคำสั่งเดียว (ตอนลบบัญชี) """
         try:
-            prompt = f"""
+            with stage("index_delete"):
+                self.collection.delete(where={"owner_id": str(owner_id)})
+                if self.lexical:
+                    self.lexical.delete(owner_id=owner_id)
+                removed = forget_documents(RagDocument.objects.filter(owner_id=str(owner_id)))
+            count_index("deleted", removed)
+            bump_versions(owner_ids=[owner_id])
+            print(f"🗑️ Deleted Owner from RAG: {owner_id} ({removed} docs)")
+        except Exception as e:
+            print(f"❌ Error deleting owner from RAG: {e}")
+            raise
+
+    def build_character_prompt(self, concept):
+        """ Prompt ให้ LLM กรอกแบบฟอร์มตัวละครเป็น JSON """
+        return f"""
             Role: คุณคือผู้ช่วยกรอกแบบฟอร์มตัวละครมืออาชีพ และมีความคิดสร้างสรรค์สูง
             Input: "{concept}"
             
@@ -368,21 +1063,49 @@ class RAGService:
                 "notes": "บันทึกเพิ่มเติม"
             }}
             """
-            
-            if self.llm:
-                response = self.llm.invoke(prompt)
-                
-                # แกะ JSON (ใช้ Regex กันเหนียวเหมือนเดิม)
-                json_match = re.search(r'\{.*\}', response, re.DOTALL)
-                if json_match:
-                    return json.loads(json_match.group(0))
-                else:
-                    return json.loads(response)
-            
+
+    @staticmethod
+    def parse_character_response(response):
+        """ แกะ JSON (ใช้ Regex กันเหนียวเหมือนเดิม) """
+        json_match = re.search(r'\{.*\}', response, re.DOTALL)
+        if json_match:
+            return json.loads(json_match.group(0))
+        return json.loads(response)
+
+    async def agenerate_character_data(self, concept, user_id=None):
+        """ ช่วยคิด/แกะข้อมูลตัวละคร (รองรับทั้งบรีฟสั้นและยาว) (กดซ้ำ/ส่งบรีฟเดิมภายใน TTL ได้ผลเดิมโดยไม่เรียก LLM) """
+        print(f"🎨 Processing Character Concept: {concept[:50]}...")
+
+        try:
+            llm = await self.run_blocking(lambda: self.llm)
+            if llm:
+                prompt = self.build_character_prompt(concept)
+
+                async def call():
+                    # แกะ JSON ในนี้เลย ถ้าแกะไม่ได้จะโยน Error ออกไป ผลพังจะไม่ถูกแคช
+                    return self.parse_character_response(await self._ainvoke(llm, prompt, "character"))
+
+                return await generation.run("character", user_id, prompt, call)
             return None
-            
+
         except Exception as e:
             print(f"Gen Char Error: {e}")
             return None
-# สร้าง Instance รอไว้เรียกใช้
-rag_service = RAGService()
\ No newline at end of file
+
+# สร้าง Instance รอไว้เรียกใช้ (ยังไม่โหลดอะไร จนกว่าจะถูกใช้งานจริง)
+rag_service = RAGService()
+
+
+def _metrics_counters():
+    """ ตัวนับของ generation layer + แคช Embedding (ถ้าโหลดแล้ว) สำหรับ /metrics """
+    for kind, counters in generation.snapshot().items():
+        for result in ("hits", "misses", "coalesced"):
+            yield "plotcraft_generation_requests_total", {"kind": kind, "result": result}, counters[result]
+    embeddings = rag_service._embeddings
+    if isinstance(embeddings, CachedEmbeddings):
+        for field, value in embeddings.cache.snapshot().items():
+            if field != "hit_rate":
+                yield "plotcraft_embedding_cache_total", {"result": field}, value
+
+
+registry.collectors.append(_metrics_counters)
\ No newline at end of file
@@ -0,0 +1,202 @@
+# rag_summaries.py
+"""
+สรุปเนื้อเรื่องเป็นชั้นๆ ให้นิยายยาวหลายร้อยตอนใส่ Prompt ได้ในไม่กี่ร้อย token (StorySummary)
+
+ตอน (RAG_SUMMARY_CHAPTER_TOKENS) -> ช่วงละ RAG_SUMMARY_ARC_CHAPTERS ตอน (RAG_SUMMARY_ARC_TOKENS)
+-> ทั้งเรื่อง (RAG_SUMMARY_NOVEL_TOKENS)
+
+- แต่ละสรุปจำ fingerprint ของต้นทาง (เนื้อหาตอน / สรุปชั้นล่าง) ต้นทางไม่เปลี่ยน = ไม่เรียก LLM
+  แก้ตอนเดียว = สรุปตอนนั้น + ช่วงของมัน + ทั้งเรื่อง (อย่างละครั้ง) ที่เหลือใช้ของเดิม
+- rag_worker ทำงานคิว 'story_summaries' ของนิยาย (ลงคิวตอนบันทึก/ลบตอน) ทีละไม่เกิน RAG_SUMMARY_BATCH ตอน
+- ไม่มี LLM (ไม่มี API Key): ใช้ต้นเรื่องของตอน / ต่อสรุปชั้นล่างแทน (fingerprint ต่างกัน พอมี LLM จะสรุปใหม่ให้)
+"""
+import hashlib
+
+from django.conf import settings
+
+from .models import Chapter, StorySummary
+from .rag_chunking import estimate_tokens, html_to_text
+from .rag_context import truncate_tokens
+
+# เนื้อหาตอนที่ส่งให้ LLM สรุปยาวไม่เกินนี้ (กันตอนยาวผิดปกติกินค่า LLM)
+MAX_INPUT_TOKENS = 6000
+
+
+def chapter_key(chapter_id):
+    return f"chapsum_{chapter_id}"
+
+
+def arc_key(novel_id, arc):
+    return f"arcsum_{novel_id}_{arc}"
+
+
+def novel_key(novel_id):
+    return f"novsum_{novel_id}"
+
+
+def _fingerprint(*parts):
+    return hashlib.sha256("\n\x1f".join(parts).encode("utf-8")).hexdigest()
+
+
+def _save(key, novel, level, fingerprint, text, chapter=None, arc=0):
+    StorySummary.objects.update_or_create(key=key, defaults={
+        'novel': novel, 'chapter': chapter, 'level': level, 'arc': arc,
+        'source_fingerprint': fingerprint, 'text': text, 'tokens': estimate_tokens(text),
+    })
+
+
+# ==================== Prompt ====================
+
+def chapter_prompt(chapter, text, max_tokens):
+    return f"""
+    สรุปเนื้อหานิยายตอนนี้ (บทที่ {chapter.order} {chapter.title}) เป็นภาษาไทย ยาวไม่เกินประมาณ {max_tokens * 3} ตัวอักษร
+    - เหตุการณ์สำคัญตามลำดับ ใครทำอะไร ผลเป็นอย่างไร
+    - สิ่งที่เปลี่ยนไปของตัวละคร/ความสัมพันธ์ และปมที่ยังค้างอยู่
+    - ใช้ชื่อตัวละคร/สถานที่ตามต้นฉบับ ไม่ต้องมีคำเกริ่น ไม่ต้องวิจารณ์
+
+    เนื้อหา:
+    {text}
+    """
+
+
+def rollup_prompt(title, parts, max_tokens):
+    joined = "\n\n".join(parts)
+    return f"""
+    รวมสรุปต่อไปนี้เป็น{title} ภาษาไทย ยาวไม่เกินประมาณ {max_tokens * 3} ตัวอักษร
+    - เล่าตามลำดับเวลา เก็บเหตุการณ์หลัก จุดเปลี่ยนของตัวละคร และปมที่ยังค้างอยู่ ณ ตอนล่าสุด
+    - ตัดรายละเอียดปลีกย่อยที่ไม่มีผลกับเรื่องต่อไป ไม่ต้องมีคำเกริ่น
+
+    {joined}
+    """
+
+
+# ==================== สร้าง/อัปเดต ====================
+
+def refresh(novel, summarize=None, limit=None):
+    """
+    อัปเดตสรุปทุกชั้นของนิยายเฉพาะส่วนที่ต้นทางเปลี่ยน
+    summarize(prompt, level) -> ข้อความ (None = ไม่มี LLM ใช้แบบตัดต้นเรื่อง)
+    คืนค่า (มีสรุปเปลี่ยนไหม, ยังเหลือตอนที่ต้องสรุปอีกไหม)
+    """
+    mode = "llm" if summarize else "lead"
+    chapter_tokens = getattr(settings, 'RAG_SUMMARY_CHAPTER_TOKENS', 120)
+    if limit is None:
+        limit = getattr(settings, 'RAG_SUMMARY_BATCH', 20)
+
+    # 1. สรุปตอน: ดูแค่ตอนที่มีเนื้อหาและแก้หลังสรุปล่าสุด (ไม่โหลดเนื้อหาทุกตอน) แล้วค่อยเทียบ fingerprint
+    removed, _ = StorySummary.objects.filter(
+        novel=novel, level=StorySummary.LEVEL_CHAPTER, chapter__content=''
+    ).delete()
+    changed = bool(removed)
+    chapters = list(
+        Chapter.objects.filter(novel=novel).exclude(content='')
+        .order_by('order', 'pk').only('pk', 'order', 'title', 'updated_at')
+    )
+    existing = {s.chapter_id: s for s in StorySummary.objects.filter(novel=novel, level=StorySummary.LEVEL_CHAPTER)}
+    stale = [c for c in chapters if c.pk not in existing or c.updated_at > existing[c.pk].updated_at]
+
+    # นับ limit เฉพาะตอนที่ต้องสรุปจริง ตอนที่ข้ามได้ (เนื้อหาว่างหลังตัด HTML / fingerprint เดิม) ไม่กินโควตา
+    # ไม่งั้นตอนว่างที่ค้างอยู่ใน stale ตลอดจะกินที่ทุกรอบ และงานจะลงคิวตัวเองซ้ำไม่จบ
+    summarized = 0
+    pending = False
+    for chapter in stale:
+        text = html_to_text(Chapter.objects.filter(pk=chapter.pk).values_list('content', flat=True).first() or "")
+        summary = existing.get(chapter.pk)
+        if not text.strip():
+            if summary:
+                summary.delete()
+                changed = True
+            continue
+        fingerprint = _fingerprint(mode, chapter.title, text)
+        if summary and summary.source_fingerprint == fingerprint:
+            summary.save(update_fields=['updated_at'])   # แก้แค่ส่วนที่สรุปไม่ได้ใช้ (เช่น is_draft)
+            continue
+        if summarized >= limit:
+            pending = True
+            break
+        if summarize and estimate_tokens(text) > chapter_tokens:
+            result = summarize(chapter_prompt(chapter, truncate_tokens(text, MAX_INPUT_TOKENS), chapter_tokens), "chapter")
+        else:
+            result = text
+        _save(chapter_key(chapter.pk), novel, StorySummary.LEVEL_CHAPTER, fingerprint,
+              truncate_tokens(str(result).strip(), chapter_tokens), chapter=chapter)
+        summarized += 1
+        changed = True
+
+    if pending:
+        return changed, True   # รวมช่วง/ทั้งเรื่องตอนสรุปตอนครบแล้ว ไม่งั้นต้องสรุปชั้นบนซ้ำหลายรอบ
+
+    # 2. สรุปช่วง: ตอนเรียงตามลำดับ ตัดเป็นช่วงละ RAG_SUMMARY_ARC_CHAPTERS ตอน
+    chapter_summaries = list(
+        StorySummary.objects.filter(novel=novel, level=StorySummary.LEVEL_CHAPTER)
+        .select_related('chapter').order_by('chapter__order', 'chapter_id')
+    )
+    size = max(getattr(settings, 'RAG_SUMMARY_ARC_CHAPTERS', 10), 1)
+    arcs = [chapter_summaries[i:i + size] for i in range(0, len(chapter_summaries), size)]
+    known = dict(StorySummary.objects.filter(novel=novel, level=StorySummary.LEVEL_ARC).values_list('key', 'text'))
+    arc_texts = []
+    for number, members in enumerate(arcs):
+        first, last = members[0].chapter.order, members[-1].chapter.order
+        parts = [f"[บทที่ {s.chapter.order} {s.chapter.title}]\n{s.text}" for s in members]
+        text = _roll_up(
+            arc_key(novel.pk, number), novel, StorySummary.LEVEL_ARC, mode, parts, summarize,
+            f"สรุปช่วงเรื่องบทที่ {first}-{last}", getattr(settings, 'RAG_SUMMARY_ARC_TOKENS', 200), arc=number,
+        )
+        changed |= text is not None
+        arc_texts.append(known[arc_key(novel.pk, number)] if text is None else text)
+
+    removed, _ = StorySummary.objects.filter(novel=novel, level=StorySummary.LEVEL_ARC, arc__gte=len(arcs)).delete()
+    changed |= bool(removed)
+
+    # 3. สรุปทั้งเรื่อง จากสรุปของทุกช่วง
+    if arc_texts:
+        parts = [f"[ช่วงที่ {i + 1}]\n{text}" for i, text in enumerate(arc_texts)]
+        changed |= _roll_up(
+            novel_key(novel.pk), novel, StorySummary.LEVEL_NOVEL, mode, parts, summarize,
+            "เรื่องย่อของนิยายทั้งเรื่องจนถึงตอนล่าสุด", getattr(settings, 'RAG_SUMMARY_NOVEL_TOKENS', 300),
+        ) is not None
+    else:
+        removed, _ = StorySummary.objects.filter(novel=novel, level=StorySummary.LEVEL_NOVEL).delete()
+        changed |= bool(removed)
+    return changed, False
+
+
+def _roll_up(key, novel, level, mode, parts, summarize, title, max_tokens, arc=0):
+    """ รวมสรุปชั้นล่างเป็นสรุปชั้นบนหนึ่งอัน คืนข้อความใหม่ หรือ None ถ้าต้นทางไม่เปลี่ยน """
+    fingerprint = _fingerprint(mode, title, *parts)
+    if StorySummary.objects.filter(key=key, source_fingerprint=fingerprint).exists():
+        return None
+    if len(parts) == 1:
+        text = parts[0].split("\n", 1)[-1]   # มีชิ้นเดียว สรุปซ้ำก็ได้ความเดิม
+    elif summarize:
+        text = summarize(rollup_prompt(title, parts, max_tokens), level)
+    else:
+        text = "\n".join(parts)
+    text = truncate_tokens(str(text).strip(), max_tokens)
+    _save(key, novel, level, fingerprint, text, arc=arc)
+    return text
+
+
+def summary_documents(novel):
+    """ สรุปทุกชั้นของนิยายเป็นเอกสารสำหรับ Vector Store [(doc_id, content, metadata), ...] """
+    return [build_summary_document(summary, novel.author_id) for summary in
+            StorySummary.objects.filter(novel=novel).select_related('chapter')]
+
+
+def build_summary_document(summary, owner_id):
+    if summary.level == StorySummary.LEVEL_CHAPTER:
+        header = f"[สรุปบทที่ {summary.chapter.order}] ชื่อตอน: {summary.chapter.title}"
+        doc_type = "chapter_summary"
+    elif summary.level == StorySummary.LEVEL_ARC:
+        header = f"[สรุปช่วงเรื่องที่ {summary.arc + 1}]"
+        doc_type = "arc_summary"
+    else:
+        header = "[สรุปเรื่องทั้งหมดจนถึงตอนล่าสุด]"
+        doc_type = "story_summary"
+    metadata = {
+        "type": doc_type,
+        "novel_id": str(summary.novel_id),
+        "owner_id": str(owner_id),
+        "source_id": str(summary.chapter_id or summary.novel_id),
+    }
+    return summary.key, f"{header}\n{summary.text}", metadata
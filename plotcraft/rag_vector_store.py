@@ -0,0 +1,388 @@
+# rag_vector_store.py
+"""
+ที่เก็บเวกเตอร์ของ RAG (เลือกได้ผ่าน settings.RAG_VECTOR_BACKEND)
+
+- 'chroma': ChromaDB ผ่าน HTTP (ค่าเริ่มต้น แบบเดิม)
+- 'local' : เก็บในเครื่องเอง ไม่ต้องมี service แยก เหมาะกับ deployment เล็กๆ และ CI
+            เวกเตอร์ (normalize แล้ว, float16) อยู่ในไฟล์ memory-mapped ส่วน id/ข้อความ/metadata อยู่ใน SQLite
+            ค้นหาแบบ brute-force cosine ด้วย NumPy เฉพาะแถวของ owner/novel ที่ขอ (partition ตาม metadata)
+
+ทั้งสองแบบมีเมธอดและรูปแบบผลลัพธ์เหมือน Chroma Collection (upsert / delete / get / query)
+โค้ดใน RAGService จึงเรียกใช้ได้เหมือนกันหมด
+"""
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+
+class VectorStore(ABC):
+    """ Interface กลาง (ใช้ชื่อและรูปแบบผลลัพธ์ตาม Chroma Collection) """
+
+    @abstractmethod
+    def upsert(self, ids, documents, embeddings, metadatas):
+        ...
+
+    @abstractmethod
+    def delete(self, ids=None, where=None):
+        ...
+
+    @abstractmethod
+    def get(self, ids=None, where=None, limit=None, offset=None, include=None):
+        """ คืน {'ids': [...], 'documents': [...], 'metadatas': [...]} """
+
+    @abstractmethod
+    def query(self, query_embeddings, n_results=10, where=None, include=None):
+        """ คืน {'ids': [[...]], 'documents': [[...]], 'metadatas': [[...]], 'distances': [[...]]} (1 list ต่อ 1 query) """
+
+
+class ChromaVectorStore(VectorStore):
+    """
+    ห่อ Chroma Collection เดิม (ส่งต่อคำสั่งตรงๆ)
+    distances ที่คืนเป็น cosine distance (0..2) เสมอเหมือน LocalVectorStore: Collection ที่สร้างก่อนตั้ง
+    hnsw:space = cosine ยังเป็น L2 อยู่ จึงคำนวณ cosine ใหม่จาก embedding ของผลลัพธ์ (ลำดับยังมาจาก L2
+    จนกว่าจะลบ Collection แล้ว rag_reindex)
+    """
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.space = (getattr(collection, "metadata", None) or {}).get("hnsw:space", "l2")
+
+    def upsert(self, ids, documents, embeddings, metadatas):
+        return self.collection.upsert(ids=ids, documents=documents, embeddings=embeddings, metadatas=metadatas)
+
+    def delete(self, ids=None, where=None):
+        return self.collection.delete(ids=ids, where=where)
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=None):
+        kwargs = {"ids": ids, "where": where, "limit": limit, "offset": offset}
+        if include is not None:
+            kwargs["include"] = include
+        return self.collection.get(**kwargs)
+
+    def query(self, query_embeddings, n_results=10, where=None, include=None):
+        kwargs = {"query_embeddings": query_embeddings, "n_results": n_results, "where": where}
+        if include is not None:
+            kwargs["include"] = include
+        if self.space == "cosine" or (include is not None and "distances" not in include):
+            return self.collection.query(**kwargs)
+
+        kwargs["include"] = list(dict.fromkeys((include or ["documents", "metadatas", "distances"]) + ["embeddings"]))
+        result = self.collection.query(**kwargs)
+        queries = LocalVectorStore._normalize(query_embeddings)
+        distances = []
+        for q, embeddings in zip(queries, result.get("embeddings") or []):
+            if embeddings is None or not len(embeddings):
+                distances.append([])
+                continue
+            distances.append((1.0 - LocalVectorStore._normalize(embeddings) @ q).tolist())
+        result["distances"] = distances
+        if include is not None and "embeddings" not in include:
+            result.pop("embeddings", None)
+        return result
+
+
+class GuardedVectorStore(VectorStore):
+    """
+    Vector Store ที่อยู่อีก service (Chroma) ผ่าน circuit breaker + deadline (ดู rag_resilience)
+    - ยังไม่ต่อจนกว่าจะใช้จริง Chroma ล่มตอน boot ก็แค่คำสั่งแรกๆ พัง ไม่ได้พังถาวร
+    - คำสั่งไหนพัง/เกินเวลา ทิ้ง connection เดิม คำสั่งถัดไป (ที่ breaker ปล่อยผ่าน) ต่อใหม่เอง
+    """
+
+    def __init__(self, connect, breaker):
+        self._connect = connect
+        self.breaker = breaker
+        self._store = None
+
+    def _call(self, method, **kwargs):
+        def run():
+            store = self._store
+            if store is None:
+                store = self._store = self._connect()
+            return getattr(store, method)(**kwargs)
+
+        try:
+            return self.breaker.call(run)
+        except Exception:
+            self._store = None
+            raise
+
+    def upsert(self, ids, documents, embeddings, metadatas):
+        return self._call("upsert", ids=ids, documents=documents, embeddings=embeddings, metadatas=metadatas)
+
+    def delete(self, ids=None, where=None):
+        return self._call("delete", ids=ids, where=where)
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=None):
+        return self._call("get", ids=ids, where=where, limit=limit, offset=offset, include=include)
+
+    def query(self, query_embeddings, n_results=10, where=None, include=None):
+        return self._call("query", query_embeddings=query_embeddings, n_results=n_results, where=where,
+                          include=include)
+
+
+# ==================== WHERE FILTER (แบบเดียวกับ Chroma) ====================
+
+def match_where(metadata, where):
+    """ เช็ค metadata กับเงื่อนไขแบบ Chroma: {"k": v}, {"k": {"$in": [...]}}, {"$and": [...]}, {"$or": [...]} """
+    if not where:
+        return True
+    for key, cond in where.items():
+        if key == "$and":
+            if not all(match_where(metadata, c) for c in cond):
+                return False
+        elif key == "$or":
+            if not any(match_where(metadata, c) for c in cond):
+                return False
+        else:
+            value = metadata.get(key)
+            if isinstance(cond, dict):
+                for op, expected in cond.items():
+                    if op == "$eq" and value != expected:
+                        return False
+                    if op == "$ne" and value == expected:
+                        return False
+                    if op == "$in" and value not in expected:
+                        return False
+                    if op == "$nin" and value in expected:
+                        return False
+            elif value != cond:
+                return False
+    return True
+
+
+def _partition_filters(where):
+    """ ดึงเงื่อนไข owner_id / novel_id แบบเท่ากับตรงๆ ออกมาใช้กรองด้วย index ของ SQLite ก่อน """
+    found = {}
+    if not where:
+        return found
+    clauses = where["$and"] if "$and" in where else [where]
+    for clause in clauses:
+        for key in ("owner_id", "novel_id"):
+            value = clause.get(key)
+            if isinstance(value, dict):
+                value = value.get("$eq")
+            if isinstance(value, str):
+                found[key] = value
+    return found
+
+
+class LocalVectorStore(VectorStore):
+    """ Vector Store ในเครื่อง: float16 memmap + SQLite, ค้นหา cosine top-k ด้วย NumPy """
+
+    GROW_ROWS = 4096       # ขยายไฟล์เวกเตอร์ทีละกี่แถว
+    BLOCK_ROWS = 8192      # คำนวณ dot product ทีละกี่แถว (คุมการใช้หน่วยความจำ)
+
+    def __init__(self, path):
+        self.path = str(path)
+        os.makedirs(self.path, exist_ok=True)
+        self.db_path = os.path.join(self.path, "docs.sqlite3")
+        self.vec_path = os.path.join(self.path, "vectors.f16")
+        self.lock_path = os.path.join(self.path, "write.lock")
+
+        self._local = threading.local()
+        self._mmap = None
+        self._mmap_size = -1
+        self._mmap_lock = threading.Lock()
+
+    # ==================== Storage ====================
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=10)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(
+                "CREATE TABLE IF NOT EXISTS docs ("
+                " id TEXT PRIMARY KEY, row INTEGER NOT NULL UNIQUE,"
+                " owner_id TEXT, novel_id TEXT, document TEXT, metadata TEXT);"
+                "CREATE INDEX IF NOT EXISTS docs_owner ON docs (owner_id, novel_id);"
+                "CREATE INDEX IF NOT EXISTS docs_novel ON docs (novel_id);"
+                "CREATE TABLE IF NOT EXISTS free_rows (row INTEGER PRIMARY KEY);"
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);"
+            )
+            self._local.conn = conn
+        return conn
+
+    def _meta(self, key, default=None):
+        row = self._conn().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return int(row[0]) if row else default
+
+    def _matrix(self, dim):
+        """ memmap ของไฟล์เวกเตอร์ (เปิดใหม่เมื่อมี process อื่นขยายไฟล์) """
+        size = os.path.getsize(self.vec_path) if os.path.exists(self.vec_path) else 0
+        with self._mmap_lock:
+            if size != self._mmap_size:
+                rows = size // (dim * 2)
+                self._mmap = np.memmap(self.vec_path, dtype=np.float16, mode="r+", shape=(rows, dim)) if rows else None
+                self._mmap_size = size
+            return self._mmap
+
+    def _write_lock(self):
+        """ ล็อกข้าม process ตอนเขียน (rag_worker กับ rag_reindex อาจเขียนพร้อมกัน) """
+        handle = open(self.lock_path, "a")
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        return handle
+
+    @staticmethod
+    def _normalize(vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return vectors / norms
+
+    # ==================== Write ====================
+
+    def upsert(self, ids, documents, embeddings, metadatas):
+        if not ids:
+            return
+        vectors = self._normalize(embeddings)
+        lock = self._write_lock()
+        try:
+            conn = self._conn()
+            with conn:
+                dim = self._meta("dim")
+                if dim is None:
+                    dim = vectors.shape[1]
+                    conn.execute("INSERT INTO meta (key, value) VALUES ('dim', ?)", (str(dim),))
+                if vectors.shape[1] != dim:
+                    raise ValueError(f"Embedding dimension {vectors.shape[1]} ไม่ตรงกับ store ({dim})")
+
+                existing = dict(conn.execute(
+                    f"SELECT id, row FROM docs WHERE id IN ({','.join('?' * len(ids))})", ids
+                ).fetchall())
+                rows = [existing.get(doc_id) for doc_id in ids]
+
+                # หาแถวว่างให้เอกสารใหม่: ใช้แถวที่ถูกลบไปแล้วก่อน ไม่พอค่อยต่อท้ายไฟล์
+                need = rows.count(None)
+                free = [r for (r,) in conn.execute("SELECT row FROM free_rows ORDER BY row LIMIT ?", (need,))]
+                conn.executemany("DELETE FROM free_rows WHERE row = ?", [(r,) for r in free])
+                next_row = self._meta("next_row", 0)
+                while len(free) < need:
+                    free.append(next_row)
+                    next_row += 1
+                conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('next_row', ?)", (str(next_row),))
+                free_iter = iter(free)
+                rows = [r if r is not None else next(free_iter) for r in rows]
+
+                # ขยายไฟล์เป็นก้อนๆ แล้วเขียนเวกเตอร์ก่อน commit แถวใน SQLite (ผู้อ่านจะไม่เห็นแถวที่ยังไม่มีเวกเตอร์)
+                capacity_rows = -(-next_row // self.GROW_ROWS) * self.GROW_ROWS
+                if not os.path.exists(self.vec_path) or os.path.getsize(self.vec_path) < capacity_rows * dim * 2:
+                    with open(self.vec_path, "ab") as f:
+                        f.truncate(capacity_rows * dim * 2)
+                matrix = self._matrix(dim)
+                matrix[rows] = vectors.astype(np.float16)
+                matrix.flush()
+
+                conn.executemany(
+                    "INSERT OR REPLACE INTO docs (id, row, owner_id, novel_id, document, metadata) VALUES (?, ?, ?, ?, ?, ?)",
+                    [
+                        (doc_id, row, meta.get("owner_id"), meta.get("novel_id"), doc, json.dumps(meta, ensure_ascii=False))
+                        for doc_id, row, doc, meta in zip(ids, rows, documents, metadatas)
+                    ],
+                )
+        finally:
+            lock.close()
+
+    def delete(self, ids=None, where=None):
+        lock = self._write_lock()
+        try:
+            conn = self._conn()
+            with conn:
+                if ids:
+                    found = conn.execute(
+                        f"SELECT id, row FROM docs WHERE id IN ({','.join('?' * len(ids))})", list(ids)
+                    ).fetchall()
+                elif where:
+                    found = [(doc_id, row) for doc_id, row, _, _ in self._select(where)]
+                else:
+                    return
+                conn.executemany("DELETE FROM docs WHERE id = ?", [(doc_id,) for doc_id, _ in found])
+                conn.executemany("INSERT OR IGNORE INTO free_rows (row) VALUES (?)", [(row,) for _, row in found])
+        finally:
+            lock.close()
+
+    # ==================== Read ====================
+
+    def _select(self, where=None, ids=None):
+        """ คืน [(id, row, document, metadata)] ที่ตรงเงื่อนไข (กรองด้วย index ก่อน แล้วค่อยเช็ค where ที่เหลือ) """
+        sql = "SELECT id, row, document, metadata FROM docs"
+        clauses, params = [], []
+        for key, value in _partition_filters(where).items():
+            clauses.append(f"{key} = ?")
+            params.append(value)
+        if ids is not None:
+            clauses.append(f"id IN ({','.join('?' * len(ids))})")
+            params.extend(ids)
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY row"
+
+        results = []
+        for doc_id, row, document, metadata in self._conn().execute(sql, params):
+            metadata = json.loads(metadata)
+            if match_where(metadata, where):
+                results.append((doc_id, row, document, metadata))
+        return results
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=None):
+        include = include or ["documents", "metadatas"]
+        if ids is not None and not ids:
+            found = []
+        else:
+            found = self._select(where, ids)
+        found = found[offset or 0:]
+        if limit is not None:
+            found = found[:limit]
+
+        result = {"ids": [doc_id for doc_id, _, _, _ in found]}
+        if "documents" in include:
+            result["documents"] = [doc for _, _, doc, _ in found]
+        if "metadatas" in include:
+            result["metadatas"] = [meta for _, _, _, meta in found]
+        if "embeddings" in include:
+            dim = self._meta("dim")
+            matrix = self._matrix(dim) if dim else None
+            result["embeddings"] = [matrix[row].astype(np.float32).tolist() for _, row, _, _ in found]
+        return result
+
+    def query(self, query_embeddings, n_results=10, where=None, include=None):
+        include = include or ["documents", "metadatas", "distances"]
+        result = {"ids": [], "documents": [], "metadatas": [], "distances": []}
+        if "embeddings" in include:
+            result["embeddings"] = []
+
+        dim = self._meta("dim")
+        candidates = self._select(where) if dim else []
+        matrix = self._matrix(dim) if candidates else None
+        queries = self._normalize(query_embeddings)
+
+        for q in queries:
+            if not candidates:
+                for key in result:
+                    result[key].append([])
+                continue
+
+            # cosine ทีละบล็อก เก็บเฉพาะ top-k ของแต่ละบล็อกไว้รวมกัน
+            best_scores, best_idx = [], []
+            for start in range(0, len(candidates), self.BLOCK_ROWS):
+                block = candidates[start:start + self.BLOCK_ROWS]
+                scores = matrix[[row for _, row, _, _ in block]].astype(np.float32) @ q
+                k = min(n_results, len(block))
+                top = np.argpartition(-scores, k - 1)[:k]
+                best_scores.extend(scores[top].tolist())
+                best_idx.extend((start + top).tolist())
+
+            order = np.argsort(-np.asarray(best_scores))[:n_results]
+            picked = [candidates[best_idx[i]] for i in order]
+            result["ids"].append([doc_id for doc_id, _, _, _ in picked])
+            result["documents"].append([doc for _, _, doc, _ in picked])
+            result["metadatas"].append([meta for _, _, _, meta in picked])
+            result["distances"].append([1.0 - best_scores[i] for i in order])
+            if "embeddings" in include:
+                result["embeddings"].append([matrix[row].astype(np.float32).tolist() for _, row, _, _ in picked])
+        return result
@@ -1,60 +1,144 @@
 # plotcraft/signals.py
+# Signal แค่ "ลงคิว" งาน Index หลัง commit เท่านั้น งานหนัก (Embedding + ChromaDB)
+# ให้ `manage.py rag_worker` ทำ การบันทึกจะได้ไม่ต้องรอโมเดลหรือ Chroma
+from functools import partial
+
+from django.db import transaction
+from django.db.models import QuerySet
 from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
-from .models import Character, Chapter, Scene, Novel # Import Scene เพิ่มเผื่ออนาคต
-from .rag_service import rag_service
+from .models import User, Character, Chapter, Scene, Novel, Location, Item, RagOutbox
+from .rag_mentions import bump_names, index_document, index_entity
+from .rag_queue import enqueue_novel_task_on_commit, enqueue_on_commit
+
+
+def _covered_by_bulk_delete(instance, origin):
+    """
+    ถูกลบเพราะ Cascade จากการลบนิยาย/ผู้ใช้ใช่ไหม?
+    ถ้าใช่ ไม่ต้องลงคิวลบทีละแถว เพราะต้นทางจะลบทั้งก้อนด้วย where={"novel_id"/"owner_id": ...} ครั้งเดียวอยู่แล้ว
+    (ลบนิยาย 300 ตอน = 1 round-trip แทนที่จะเป็น 300)
+    """
+    if origin is None:
+        return False
+    root = origin.model if isinstance(origin, QuerySet) else type(origin)
+    return root in (Novel, User) and not isinstance(instance, root)
+
+# ==================== USER (ลบบัญชี) ====================
+@receiver(post_delete, sender=User)
+def delete_user_rag(sender, instance, **kwargs):
+    """ เมื่อลบผู้ใช้ -> ลบข้อมูลทั้งหมดของเขาออกจากสมอง AI ทีเดียว """
+    enqueue_on_commit(instance, RagOutbox.OP_DELETE)
 
 # ==================== NOVEL (นิยาย) ====================
 @receiver(post_save, sender=Novel)
 def update_novel_rag(sender, instance, created, **kwargs):
     """ เมื่อสร้างหรือแก้ไขนิยาย -> ให้ AI จำชื่อเรื่อง/คำโปรยใหม่ """
-    rag_service.add_novel_summary_to_rag(instance)
-    print(f"🔄 RAG Updated: Novel Summary '{instance.title}'")
+    enqueue_on_commit(instance)
 
 @receiver(post_delete, sender=Novel)
 def delete_novel_rag(sender, instance, **kwargs):
-    """ เมื่อลบนิยาย -> ลบออกจากสมอง AI """
-    rag_service.delete_data_from_rag(f"novel_{instance.id}")
-    print(f"🗑️ RAG Deleted: Novel '{instance.title}'")
+    """ เมื่อลบนิยาย -> ลบออกจากสมอง AI (ทั้งเรื่องรวมตอน/ตัวละคร/ฉาก ด้วยคำสั่งเดียว) """
+    if _covered_by_bulk_delete(instance, kwargs.get('origin')):
+        return
+    enqueue_on_commit(instance, RagOutbox.OP_DELETE)
 
 # ==================== CHARACTER (ตัวละคร) ====================
 @receiver(post_save, sender=Character)
 def update_character_rag(sender, instance, created, **kwargs):
-    rag_service.add_character_to_rag(instance)
     """ เมื่อสร้างหรือแก้ตัวละคร -> ให้จำข้อมูลตัวละคร """
-    print(f"🔄 RAG Updated: Character '{instance.name}'")
+    enqueue_on_commit(instance)
 
 @receiver(post_delete, sender=Character)
 def delete_character_rag(sender, instance, **kwargs):
     """ เมื่อลบตัวละคร -> ให้ลืม """
-    rag_service.delete_data_from_rag(f"char_{instance.id}")
-    print(f"🗑️ RAG Deleted: Character '{instance.name}'")
+    if _covered_by_bulk_delete(instance, kwargs.get('origin')):
+        return
+    enqueue_on_commit(instance, RagOutbox.OP_DELETE)
 
 
 # ==================== CHAPTER (เนื้อหาตอน) ====================
 @receiver(post_save, sender=Chapter)
 def update_chapter_rag(sender, instance, created, **kwargs):
-    if instance.content: 
-        """ เมื่อสร้างหรือแก้ตอน -> ให้จำข้อมูลตอน """
-        rag_service.add_chapter_to_rag(instance)
-        print(f"🔄 RAG Updated: Chapter '{instance.title}'")
+    """ เมื่อสร้างหรือแก้ตอน -> ให้จำข้อมูลตอน """
+    if instance.content:
+        enqueue_on_commit(instance)
 
 # เพิ่มฟังก์ชันลบตอน
 @receiver(post_delete, sender=Chapter)
 def delete_chapter_rag(sender, instance, **kwargs):
     """ เมื่อลบตอน -> ให้ลืม """
-    rag_service.delete_data_from_rag(f"chap_{instance.id}")
-    print(f"🗑️ RAG Deleted: Chapter '{instance.title}'")
+    if _covered_by_bulk_delete(instance, kwargs.get('origin')):
+        return
+    enqueue_on_commit(instance, RagOutbox.OP_DELETE)
 
 # ==================== SCENE (ฉาก) ====================
 @receiver(post_save, sender=Scene)
 def update_scene_rag(sender, instance, **kwargs):
     """ เมื่อสร้างหรือแก้ฉาก -> ให้จำข้อมูลฉาก (Goal/Conflict) """
-    rag_service.add_scene_to_rag(instance) 
-    print(f"🔄 RAG Updated: Scene '{instance.title}'")
+    enqueue_on_commit(instance)
 
 @receiver(post_delete, sender=Scene)
 def delete_scene_rag(sender, instance, **kwargs):
     """ เมื่อลบฉาก -> ให้ลืม """
-    rag_service.delete_data_from_rag(f"scene_{instance.id}")
-    print(f"🗑️ RAG Deleted: Scene '{instance.title}'")
\ No newline at end of file
+    if _covered_by_bulk_delete(instance, kwargs.get('origin')):
+        return
+    enqueue_on_commit(instance, RagOutbox.OP_DELETE)
+
+
+# ==================== STORY BIBLE (คัมภีร์นิยาย) ====================
+@receiver(post_save, sender=Novel)
+def update_novel_bible(sender, instance, **kwargs):
+    """ ชื่อเรื่อง/เรื่องย่อ/หมวดหมู่เปลี่ยน -> สร้างคัมภีร์ของนิยายใหม่ """
+    enqueue_novel_task_on_commit('story_bible', instance.pk)
+
+@receiver(post_save, sender=Character)
+@receiver(post_delete, sender=Character)
+@receiver(post_save, sender=Location)
+@receiver(post_delete, sender=Location)
+def update_entity_bible(sender, instance, **kwargs):
+    """ ตัวละคร/สถานที่ของนิยายเปลี่ยน -> สร้างคัมภีร์ใหม่ (ลบทั้งเรื่องไม่ต้อง คัมภีร์ถูกลบตามนิยาย) """
+    if _covered_by_bulk_delete(instance, kwargs.get('origin')):
+        return
+    enqueue_novel_task_on_commit('story_bible', instance.project_id)
+
+@receiver(post_save, sender=Chapter)
+@receiver(post_delete, sender=Chapter)
+def update_chapter_bible(sender, instance, **kwargs):
+    """ ตอนล่าสุดอยู่ในคัมภีร์ด้วย -> สร้างใหม่ (งานซ้ำระหว่างพิมพ์ถูกยุบรวมในคิว) """
+    if _covered_by_bulk_delete(instance, kwargs.get('origin')):
+        return
+    enqueue_novel_task_on_commit('story_bible', instance.novel_id)
+
+
+# ==================== STORY SUMMARIES (สรุปตอน/ช่วง/ทั้งเรื่อง) ====================
+@receiver(post_save, sender=Chapter)
+@receiver(post_delete, sender=Chapter)
+def update_story_summaries(sender, instance, **kwargs):
+    """ เนื้อหาตอนเปลี่ยน/ตอนหาย -> สรุปตอนนั้นใหม่แล้วรวมชั้นบนใหม่ (ตอนที่เนื้อหาไม่เปลี่ยนไม่เสีย LLM) """
+    if _covered_by_bulk_delete(instance, kwargs.get('origin')):
+        return
+    enqueue_novel_task_on_commit('story_summaries', instance.novel_id)
+
+
+# ==================== MENTION INDEX (ดัชนีการเอ่ยชื่อ) ====================
+# แค่สแกนข้อความกับเขียน DB (ไม่แตะโมเดล/Chroma) เร็วพอจะทำหลัง commit ได้เลย ไม่ต้องผ่านคิว
+@receiver(post_save, sender=Chapter)
+@receiver(post_save, sender=Scene)
+def update_document_mentions(sender, instance, **kwargs):
+    """ บันทึกตอน/ฉาก -> สแกนชื่อตัวละคร/สถานที่/ไอเทมในเอกสารนั้นใหม่ """
+    transaction.on_commit(partial(index_document, instance), robust=True)
+
+@receiver(post_save, sender=Character)
+@receiver(post_save, sender=Location)
+@receiver(post_save, sender=Item)
+def update_entity_mentions(sender, instance, **kwargs):
+    """ เพิ่ม/แก้ชื่อ -> หาตอน/ฉากที่มีชื่อนี้ใหม่ (การลบ: แถวถูกลบตาม CASCADE เอง) """
+    bump_names(instance)
+    transaction.on_commit(partial(index_entity, instance), robust=True)
+
+@receiver(post_delete, sender=Character)
+@receiver(post_delete, sender=Location)
+@receiver(post_delete, sender=Item)
+def forget_entity_name(sender, instance, **kwargs):
+    """ ลบตัวละคร/สถานที่/ไอเทม -> automaton ที่มีชื่อนี้ต้องสร้างใหม่ """
+    bump_names(instance)
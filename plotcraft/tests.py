@@ -1,3 +1,657 @@
-from django.test import TestCase
+import asyncio
+import atexit
+import contextlib
+import json
+import io
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+from datetime import timedelta
 
-# Create your tests here.
+import numpy as np
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from .models import AiRateBucket, Chapter, Character, Location, Novel, RagDocument, RagOutbox, StorySummary
+from .rag_bench import HashingEmbeddings
+from .rag_context import mmr, reciprocal_rank_fusion
+from .rag_embed_server import FRAME, SHAPE, STATUS_OK, EmbeddingClient, EmbeddingServer
+from .rag_lexical import LexicalIndex
+from .rag_limits import refund_token, take_token
+from .rag_mentions import AhoCorasick, rebuild_novel, scan
+from .rag_metrics import Registry, _snapshot_name, start_timings
+from .rag_queue import enqueue, process_batch
+from .rag_resilience import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, DependencyUnavailable
+from .rag_service import RAGService
+from .rag_summaries import refresh
+from .rag_vector_store import GuardedVectorStore, LocalVectorStore, VectorStore
+
+User = get_user_model()
+
+
+class AhoCorasickTests(SimpleTestCase):
+    def test_finds_every_pattern_including_overlaps(self):
+        automaton = AhoCorasick({"he": "he", "she": "she", "hers": "hers"})
+        found = sorted((start, end, payload) for start, end, payload in automaton.finditer("ushers"))
+        self.assertEqual(found, [(1, 4, "she"), (2, 4, "he"), (2, 6, "hers")])
+
+    def test_scan_counts_longest_name_only(self):
+        automaton = AhoCorasick({"มิรา": [("character", 1)], "มิรานดา": [("character", 2)]})
+        found = scan("มิรานดาพบมิราที่ตลาด แล้วมิรานดาก็กลับบ้าน", automaton)
+        self.assertEqual(found[("character", 2)][0], 2)
+        self.assertEqual(found[("character", 1)], [1, 9])
+
+    def test_scan_latin_names_need_word_boundaries(self):
+        automaton = AhoCorasick({"al": [("character", 1)]})
+        self.assertEqual(scan("Albert met Al, then AL left", automaton), {("character", 1): [2, 11]})
+        self.assertEqual(scan("อัลพบAlที่นี่", automaton), {("character", 1): [1, 5]})
+
+
+class MmrTests(SimpleTestCase):
+    def test_skips_near_duplicates(self):
+        candidates = [
+            {"id": "a", "distance": 0.0, "embedding": [1.0, 0.0]},
+            {"id": "a2", "distance": 0.05, "embedding": [1.0, 0.01]},
+            {"id": "b", "distance": 0.2, "embedding": [0.0, 1.0]},
+        ]
+        self.assertEqual([c["id"] for c in mmr(candidates, 2, lambda_mult=0.5)], ["a", "b"])
+
+    def test_without_embeddings_orders_by_distance(self):
+        candidates = [{"id": "far", "distance": 0.6}, {"id": "near", "distance": 0.1}]
+        self.assertEqual([c["id"] for c in mmr(candidates, 2)], ["near", "far"])
+
+    def test_clamps_distance_relevance(self):
+        # cosine distance ไปได้ถึง 2: relevance ต้องไม่ติดลบจนแพ้ชิ้นที่ซ้ำกัน
+        candidates = [
+            {"id": "a", "distance": 0.0, "embedding": [1.0, 0.0]},
+            {"id": "a2", "distance": 0.2, "embedding": [1.0, 0.0]},
+            {"id": "far", "distance": 1.9, "embedding": [0.0, 1.0]},
+        ]
+        self.assertEqual([c["id"] for c in mmr(candidates, 2, lambda_mult=0.5)], ["a", "far"])
+
+
+class ReciprocalRankFusionTests(SimpleTestCase):
+    def test_rewards_agreement(self):
+        fused = reciprocal_rank_fusion([["a", "b", "c"], ["b", "c"]], k=60)
+        self.assertEqual([doc_id for doc_id, _ in fused], ["b", "c", "a"])
+        self.assertAlmostEqual(dict(fused)["a"], 1 / 61)
+
+    def test_empty_rankings(self):
+        self.assertEqual(reciprocal_rank_fusion([[], []]), [])
+
+
+class StorySummaryRefreshTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="writer")
+        self.novel = Novel.objects.create(title="เรื่องทดสอบ", author=self.user)
+
+    def _chapter(self, order, content):
+        return Chapter.objects.create(novel=self.novel, order=order, title=f"บทที่ {order}", content=content)
+
+    def _count(self, level):
+        return StorySummary.objects.filter(novel=self.novel, level=level).count()
+
+    def test_batches_until_nothing_is_pending(self):
+        for order in range(1, 4):
+            self._chapter(order, f"<p>เนื้อหาตอนที่ {order}</p>")
+
+        self.assertEqual(refresh(self.novel, limit=2), (True, True))
+        self.assertEqual(self._count(StorySummary.LEVEL_NOVEL), 0)   # ชั้นบนรอจนสรุปตอนครบ
+        self.assertEqual(refresh(self.novel, limit=2), (True, False))
+        self.assertEqual(refresh(self.novel, limit=2), (False, False))
+        self.assertEqual(self._count(StorySummary.LEVEL_CHAPTER), 3)
+        self.assertEqual(self._count(StorySummary.LEVEL_NOVEL), 1)
+
+    def test_empty_chapters_do_not_starve_the_batch(self):
+        for order in range(1, 26):
+            self._chapter(order, "")
+        for order in range(26, 31):
+            self._chapter(order, "<p> </p><br>")
+        for order in range(31, 34):
+            self._chapter(order, f"<p>เนื้อหาตอนที่ {order}</p>")
+
+        self.assertEqual(refresh(self.novel, limit=2), (True, True))
+        self.assertEqual(refresh(self.novel, limit=2), (True, False))
+        self.assertEqual(refresh(self.novel, limit=2), (False, False))
+        self.assertEqual(self._count(StorySummary.LEVEL_CHAPTER), 3)
+
+    def test_emptied_chapter_loses_its_summary(self):
+        chapter = self._chapter(1, "<p>มีเนื้อหา</p>")
+        refresh(self.novel)
+        Chapter.objects.filter(pk=chapter.pk).update(content="")
+        self.assertEqual(refresh(self.novel), (True, False))
+        self.assertEqual(self._count(StorySummary.LEVEL_CHAPTER), 0)
+
+
+class StoreDocumentsTests(TestCase):
+    def setUp(self):
+        workdir = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+
+        self.service = RAGService()
+        self.service._embeddings = HashingEmbeddings()
+        self.service._collection = LocalVectorStore(os.path.join(workdir, "vectors"))
+        self.service._lexical = LexicalIndex(os.path.join(workdir, "lexical.sqlite3"))
+        self.docs = [("char_1", "มิราเป็นนักดาบ", {"type": "character", "novel_id": "1", "owner_id": "1"})]
+
+    def test_failed_lexical_write_leaves_document_pending(self):
+        lexical = self.service._lexical
+        self.service._lexical = FailingLexical()
+        with self.assertRaises(RuntimeError):
+            self.service._store_documents(self.docs)
+        self.assertFalse(RagDocument.objects.filter(doc_id="char_1").exists())
+
+        # รอบใหม่ต้องไม่ถูกข้ามด้วย fingerprint และเขียนลง BM25 จริง
+        self.service._lexical = lexical
+        self.assertEqual(self.service._store_documents(self.docs), 1)
+        self.assertTrue(RagDocument.objects.filter(doc_id="char_1").exists())
+        self.assertEqual(self.service._store_documents(self.docs), 0)
+
+
+class FailingLexical:
+    def upsert(self, docs):
+        raise RuntimeError("database is locked")
+
+
+@override_settings(RAG_AI_USER_BURST=2, RAG_AI_USER_RATE_PER_MINUTE=60)
+class TokenBucketTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username="limited")
+
+    def test_burst_then_wait_then_refill(self):
+        self.assertEqual(take_token(self.user.pk), 0)
+        self.assertEqual(take_token(self.user.pk), 0)
+        wait = take_token(self.user.pk)
+        self.assertGreater(wait, 0)
+        self.assertLessEqual(wait, 1)
+
+        # 1.5 วินาทีที่ 1 token/วินาที -> ได้คืน 1 token
+        bucket = AiRateBucket.objects.get(user=self.user)
+        AiRateBucket.objects.filter(pk=bucket.pk).update(updated_at=bucket.updated_at - timedelta(seconds=1.5))
+        self.assertEqual(take_token(self.user.pk), 0)
+        self.assertGreater(take_token(self.user.pk), 0)
+
+    def test_refund_gives_the_token_back_up_to_burst(self):
+        take_token(self.user.pk)
+        take_token(self.user.pk)
+        refund_token(self.user.pk)
+        self.assertEqual(take_token(self.user.pk), 0)
+
+        for _ in range(5):
+            refund_token(self.user.pk)
+        self.assertEqual(AiRateBucket.objects.get(user=self.user).tokens, 2)
+
+
+@override_settings(RAG_RETRIEVAL_CACHE_TTL=0, RAG_CONTEXT_MAX_DOCS=3)
+class MentionRoutingTests(TestCase):
+    ANSWER = "วรเชษฐ์ซ่อนกุญแจเงินไว้ใต้สะพานหินตอนเที่ยงคืน"
+
+    def setUp(self):
+        workdir = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+
+        self.service = RAGService()
+        self.service._embeddings = HashingEmbeddings()
+        self.service._collection = LocalVectorStore(os.path.join(workdir, "vectors"))
+        self.service._lexical = LexicalIndex(os.path.join(workdir, "lexical.sqlite3"))
+
+        self.user = User.objects.create(username="router")
+        self.novel = Novel.objects.create(title="ตำนานสะพานหิน", author=self.user)
+        Character.objects.create(project=self.novel, created_by=self.user, name="วรเชษฐ์", personality="ขี้ระแวง")
+        Location.objects.create(project=self.novel, created_by=self.user, name="สะพานหิน")
+        # ตอนที่เอ่ยทั้งสองชื่อบ่อยแต่ไม่เกี่ยวกับคำถาม มาก่อนตอนที่มีคำตอบ (เอ่ยชื่อละครั้งเดียว)
+        for order in range(1, 6):
+            self._chapter(order, "วรเชษฐ์นั่งกินข้าวเหนียวมะม่วงกับแม่ค้าริมสะพานหินอย่างมีความสุขจนลืมเวลา " * 6)
+        self._chapter(6, self.ANSWER + " แล้วรีบกลับบ้าน")
+        for order in range(7, 10):
+            self._chapter(order, "ชาวบ้านช่วยกันเก็บเกี่ยวข้าวในทุ่งกว้าง " * 6)
+
+        self.service.add_character_to_rag(Character.objects.get(project=self.novel))
+        for chapter in Chapter.objects.filter(novel=self.novel).select_related("novel"):
+            self.service.add_chapter_to_rag(chapter)
+        rebuild_novel(self.novel)
+
+    def _chapter(self, order, text):
+        Chapter.objects.create(novel=self.novel, order=order, title=f"บทที่ {order}", content=f"<p>{text}</p>")
+
+    def test_named_question_ranks_by_relevance_within_mentions(self):
+        timings = start_timings()
+        context = self.service.retrieve_context(
+            "วรเชษฐ์ซ่อนอะไรไว้ใต้สะพานหิน", novel_id=self.novel.pk, user_id=self.user.pk
+        )
+        self.assertIn("mention_query", {name for name, _ in timings})
+        # ตัวละครขึ้นก่อนเสมอ ตอนแรกที่ได้ต้องเป็นตอนที่มีคำตอบ ไม่ใช่ตอนที่เอ่ยชื่อบ่อยสุด
+        chapters = [item["text"] for item in context["items"] if item["type"] == "content"]
+        self.assertTrue(chapters)
+        self.assertIn(self.ANSWER, " ".join(chapters[0].split()))
+
+
+class FakeIndexService:
+    """ แทน rag_service ในการทดสอบคิว: delete_data_from_rag เรียก on_delete(doc_id) """
+
+    def __init__(self, on_delete=None):
+        self.deleted = []
+        self.on_delete = on_delete
+
+    def delete_data_from_rag(self, doc_id):
+        self.deleted.append(doc_id)
+        if self.on_delete:
+            self.on_delete(doc_id)
+
+
+@override_settings(RAG_INDEX_QUIET_SECONDS=30, RAG_WORKER_BACKOFF_SECONDS=5)
+class RagOutboxTests(TestCase):
+    def _due(self):
+        RagOutbox.objects.update(available_at=timezone.now() - timedelta(seconds=1))
+
+    def test_repeat_enqueues_collapse_into_one_row(self):
+        enqueue("chapter", 7)
+        enqueue("chapter", 7)
+        row = RagOutbox.objects.get()
+        self.assertEqual(row.seq, 1)
+        self.assertGreater(row.available_at, timezone.now() + timedelta(seconds=20))   # debounce
+
+        enqueue("chapter", 7, RagOutbox.OP_DELETE)
+        row = RagOutbox.objects.get()
+        self.assertEqual((row.op, row.seq), (RagOutbox.OP_DELETE, 2))
+        self.assertLessEqual(row.available_at, timezone.now())
+
+    def test_failure_counts_an_attempt_and_backs_off(self):
+        enqueue("chapter", 7, RagOutbox.OP_DELETE)
+
+        def boom(doc_id):
+            raise ValueError("broken chunk")
+
+        self.assertEqual(process_batch(service=FakeIndexService(boom)), (0, 1))
+        row = RagOutbox.objects.get()
+        self.assertEqual(row.attempts, 1)
+        self.assertEqual(row.last_error, "broken chunk")
+        self.assertGreater(row.available_at, timezone.now() + timedelta(seconds=3))
+        self.assertEqual(process_batch(service=FakeIndexService(boom)), (0, 0))   # ยังไม่ถึงเวลา
+
+        self._due()
+        self.assertEqual(process_batch(service=FakeIndexService()), (1, 0))
+        self.assertFalse(RagOutbox.objects.exists())
+
+    def test_reenqueue_during_processing_keeps_the_row(self):
+        enqueue("chapter", 7, RagOutbox.OP_DELETE)
+
+        # มีคนแก้ Object เดิมระหว่าง worker ทำงาน -> seq เปลี่ยน งานใหม่ต้องไม่หาย
+        service = FakeIndexService(lambda doc_id: enqueue("chapter", 7, RagOutbox.OP_DELETE))
+        self.assertEqual(process_batch(service=service), (1, 0))
+        self.assertEqual(RagOutbox.objects.get().seq, 1)
+
+        def edited_then_failed(doc_id):
+            enqueue("chapter", 7, RagOutbox.OP_DELETE)
+            raise ValueError("stale attempt")
+
+        self.assertEqual(process_batch(service=FakeIndexService(edited_then_failed)), (0, 1))
+        row = RagOutbox.objects.get()
+        self.assertEqual((row.seq, row.attempts), (2, 0))   # งานเก่าพัง ไม่นับ retry ให้งานใหม่
+
+    def test_dependency_outage_requeues_without_an_attempt(self):
+        enqueue("chapter", 7, RagOutbox.OP_DELETE)
+        enqueue("chapter", 8, RagOutbox.OP_DELETE)
+
+        def down(doc_id):
+            raise DependencyUnavailable("chroma", "circuit open", retry_after=60)
+
+        service = FakeIndexService(down)
+        self.assertEqual(process_batch(service=service), (0, 2))
+        self.assertEqual(len(service.deleted), 1)   # งานที่เหลือถูกคืนทั้งชุด ไม่ลองต่อ
+        for row in RagOutbox.objects.all():
+            self.assertEqual(row.attempts, 0)
+            self.assertGreater(row.available_at, timezone.now() + timedelta(seconds=50))
+            self.assertIn("circuit open", row.last_error)
+
+    def test_purges_suppress_per_row_deletes(self):
+        user = User.objects.create(username="purged")
+        novel = Novel.objects.create(title="เรื่องที่จะลบ", author=user)
+        Character.objects.create(project=novel, created_by=user, name="มิรา")
+        Chapter.objects.create(novel=novel, order=1, title="บทที่ 1", content="<p>เนื้อหา</p>")
+
+        novel_id, user_id = novel.pk, user.pk
+
+        with self.captureOnCommitCallbacks(execute=True):
+            novel.delete()
+        self.assertEqual(
+            list(RagOutbox.objects.values_list("model_name", "object_id", "op")),
+            [("novel", novel_id, RagOutbox.OP_DELETE)],
+        )
+
+        RagOutbox.objects.all().delete()
+        Novel.objects.create(title="อีกเรื่อง", author=user)
+        with self.captureOnCommitCallbacks(execute=True):
+            user.delete()
+        self.assertEqual(
+            list(RagOutbox.objects.values_list("model_name", "object_id", "op")),
+            [("user", user_id, RagOutbox.OP_DELETE)],
+        )
+
+
+def fail(message="down"):
+    raise ConnectionError(message)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+        self.breaker = CircuitBreaker("test", failure_threshold=2, reset_seconds=30)
+
+    def _trip(self):
+        for _ in range(2):
+            with self.assertRaises(ConnectionError):
+                self.breaker.call(fail)
+
+    def _expire(self):
+        self.breaker.opened_at -= 31
+
+    def test_opens_after_threshold_then_probes_and_closes(self):
+        self._trip()
+        self.assertEqual(self.breaker.state, OPEN)
+        calls = []
+        with self.assertRaises(DependencyUnavailable) as raised:
+            self.breaker.call(calls.append, 1)
+        self.assertEqual(calls, [])   # วงจรเปิด: ไม่เรียกจริงเลย
+        self.assertGreater(raised.exception.retry_after, 0)
+
+        self._expire()
+        self.breaker.before_call()   # คำสั่งทดลองตัวแรกผ่าน
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        with self.assertRaises(DependencyUnavailable):
+            self.breaker.before_call()   # ตัวที่สองระหว่างทดลองถูกปฏิเสธ
+        self.breaker.record_success()
+        self.assertEqual((self.breaker.state, self.breaker.failures), (CLOSED, 0))
+        self.assertEqual(self.breaker.call(lambda: "ok"), "ok")
+
+    def test_failed_probe_reopens(self):
+        self._trip()
+        self._expire()
+        with self.assertRaises(ConnectionError):
+            self.breaker.call(fail)
+        self.assertEqual(self.breaker.state, OPEN)
+        self.assertGreater(self.breaker.retry_after(), 29)
+
+    def test_cancelled_probe_releases_the_slot(self):
+        self._trip()
+        self._expire()
+
+        async def cancelled():
+            raise asyncio.CancelledError()
+
+        with self.assertRaises(asyncio.CancelledError):
+            asyncio.run(self.breaker.acall(cancelled))
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        self.assertEqual(self.breaker.call(lambda: "ok"), "ok")   # คำสั่งถัดไปได้ลองแทน
+        self.assertEqual(self.breaker.state, CLOSED)
+
+    def test_deadline_counts_as_failure(self):
+        self.breaker.timeout = 0.2
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        with self.assertRaises(DependencyUnavailable) as raised:
+            self.breaker.call(release.wait, 1)
+        self.assertIn("0.2s", str(raised.exception))
+        self.assertEqual(self.breaker.failures, 1)
+
+        async def hang():
+            await asyncio.sleep(1)
+
+        with self.assertRaises(DependencyUnavailable):
+            asyncio.run(self.breaker.acall(hang))
+        self.assertEqual(self.breaker.state, OPEN)
+
+
+class GuardedVectorStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+        self.connections = []
+        self.store = GuardedVectorStore(self._connect, CircuitBreaker("test", failure_threshold=2, reset_seconds=30))
+
+    def _connect(self):
+        connection = FakeConnection(broken=not self.connections)
+        self.connections.append(connection)
+        return connection
+
+    def test_reconnects_after_a_failure(self):
+        with self.assertRaises(ConnectionError):
+            self.store.get(ids=["a"])
+        self.assertEqual(self.store.get(ids=["a"]), {"ids": ["a"]})
+        self.assertEqual(len(self.connections), 2)
+        self.store.get(ids=["b"])
+        self.assertEqual(len(self.connections), 2)   # ต่อแล้วใช้ connection เดิมต่อ
+
+    def test_open_circuit_does_not_connect(self):
+        self.store.breaker.failure_threshold = 1
+        with self.assertRaises(ConnectionError):
+            self.store.get(ids=["a"])
+        with self.assertRaises(DependencyUnavailable):
+            self.store.get(ids=["a"])
+        self.assertEqual(len(self.connections), 1)
+
+
+class FakeConnection:
+    def __init__(self, broken):
+        self.broken = broken
+
+    def get(self, ids=None, **kwargs):
+        if self.broken:
+            fail("connection reset")
+        return {"ids": ids}
+
+
+class MetricsSnapshotTests(SimpleTestCase):
+    def setUp(self):
+        self.directory = self.enterContext(tempfile.TemporaryDirectory())
+        self.enterContext(override_settings(RAG_METRICS_DIR=self.directory))
+        self.registry = Registry()
+        self.registry.define("jobs_total", "counter", "Jobs")
+        self.addCleanup(atexit.unregister, self.registry.maybe_flush)
+
+    def _write(self, pid, value, token="old"):
+        snapshot = {"counters": [["jobs_total", [], value]], "histograms": [], "token": token}
+        with open(os.path.join(self.directory, _snapshot_name(pid)), "w", encoding="utf-8") as f:
+            json.dump(snapshot, f)
+
+    def _total(self):
+        counters, _ = self.registry._merged()
+        return counters.get(("jobs_total", ()), 0)
+
+    def test_exited_processes_are_folded_once(self):
+        exited = subprocess.run([sys.executable, "-c", "import os; print(os.getpid())"], capture_output=True, text=True)
+        self._write(int(exited.stdout), 5)
+        self._write(os.getppid(), 7)   # ยังมีชีวิตอยู่ ต้องไม่ถูกรวม
+
+        self.assertEqual(self._total(), 12)
+        self.assertEqual(sorted(os.listdir(self.directory)), sorted([".lock", "exited.json", _snapshot_name(os.getppid())]))
+        self.assertEqual(self._total(), 12)
+
+    def test_reused_pid_keeps_the_old_count(self):
+        self._write(os.getpid(), 4)   # ไฟล์ของ process เก่าที่เคยได้ pid นี้
+        self.registry.inc("jobs_total", {}, 2)
+
+        self.assertEqual(self._total(), 6)
+        with open(os.path.join(self.directory, _snapshot_name(os.getpid())), encoding="utf-8") as f:
+            self.assertEqual(json.load(f)["counters"], [["jobs_total", [], 2]])
+
+
+class LocalVectorStoreTests(SimpleTestCase):
+    def setUp(self):
+        self.path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), "vectors")
+        self.store = LocalVectorStore(self.path)
+        self.store.upsert(
+            ids=["c1", "c2", "c3", "x1"],
+            documents=["หนึ่ง", "สอง", "สาม", "ของคนอื่น"],
+            embeddings=[[1.0, 0.0], [0.0, 1.0], [1.0, 1.0], [1.0, 0.0]],
+            metadatas=[
+                {"owner_id": "1", "novel_id": "10", "type": "content"},
+                {"owner_id": "1", "novel_id": "10", "type": "character"},
+                {"owner_id": "1", "novel_id": "11", "type": "content"},
+                {"owner_id": "2", "novel_id": "20", "type": "content"},
+            ],
+        )
+
+    def _ids(self, where):
+        return self.store.get(where=where)["ids"]
+
+    def test_is_a_vector_store(self):
+        self.assertIsInstance(self.store, VectorStore)
+        with self.assertRaises(TypeError):
+            VectorStore()
+
+    def test_where_filters(self):
+        self.assertEqual(self._ids({"owner_id": "1"}), ["c1", "c2", "c3"])
+        self.assertEqual(self._ids({"$and": [{"owner_id": "1"}, {"type": "content"}]}), ["c1", "c3"])
+        self.assertEqual(self._ids({"$or": [{"novel_id": "11"}, {"type": "character"}]}), ["c2", "c3"])
+        self.assertEqual(self._ids({"novel_id": {"$in": ["10", "20"]}}), ["c1", "c2", "x1"])
+        self.assertEqual(self._ids({"$and": [{"owner_id": "1"}, {"type": {"$ne": "content"}}]}), ["c2"])
+
+        result = self.store.query([[1.0, 0.0]], n_results=5, where={"owner_id": "1"})
+        self.assertEqual(result["ids"][0], ["c1", "c3", "c2"])
+        self.assertAlmostEqual(result["distances"][0][0], 0.0, places=3)
+        self.assertAlmostEqual(result["distances"][0][2], 1.0, places=3)
+
+    def test_delete_by_where_and_row_reuse(self):
+        self.store.delete(where={"novel_id": "10"})
+        self.assertEqual(self._ids(None), ["c3", "x1"])
+        self.assertEqual(self.store.query([[0.0, 1.0]], n_results=5, where={"owner_id": "1"})["ids"][0], ["c3"])
+
+        self.store.upsert(
+            ids=["n1", "n2", "n3"], documents=["ใหม่1", "ใหม่2", "ใหม่3"],
+            embeddings=[[0.0, 1.0], [1.0, 0.0], [1.0, 1.0]],
+            metadatas=[{"owner_id": "1", "novel_id": "12"}] * 3,
+        )
+        rows = dict(self.store._conn().execute("SELECT id, row FROM docs").fetchall())
+        self.assertEqual(sorted(rows[doc_id] for doc_id in ("n1", "n2")), [0, 1])   # ใช้แถวที่ลบไปก่อน
+        self.assertEqual(rows["n3"], 4)
+        self.assertEqual(self.store.query([[0.0, 1.0]], n_results=1, where={"novel_id": "12"})["ids"], [["n1"]])
+
+    def test_reopens_from_disk(self):
+        self.store.upsert(ids=["c1"], documents=["หนึ่ง (แก้)"], embeddings=[[0.0, 1.0]],
+                          metadatas=[{"owner_id": "1", "novel_id": "10", "type": "content"}])
+        reopened = LocalVectorStore(self.path)
+        self.assertEqual(reopened.get(ids=["c1"])["documents"], ["หนึ่ง (แก้)"])
+        result = reopened.query([[0.0, 1.0]], n_results=2, where={"novel_id": "10"}, include=["embeddings"])
+        self.assertEqual(sorted(result["ids"][0]), ["c1", "c2"])
+        self.assertEqual(result["embeddings"][0][0], [0.0, 1.0])
+        with self.assertRaises(ValueError):
+            reopened.upsert(ids=["bad"], documents=["x"], embeddings=[[1.0, 0.0, 0.0]], metadatas=[{}])
+
+
+class RecordingEmbeddings(HashingEmbeddings):
+    """ HashingEmbeddings ที่จดขนาดแต่ละ batch และพังเมื่อเจอข้อความ 'boom' """
+
+    def __init__(self):
+        super().__init__(dim=16)
+        self.batches = []
+
+    def embed_documents(self, texts):
+        if "boom" in texts:
+            raise ValueError("model exploded")
+        self.batches.append(len(texts))
+        return super().embed_documents(texts)
+
+
+class EmbeddingServerTests(SimpleTestCase):
+    def setUp(self):
+        self.enterContext(contextlib.redirect_stdout(io.StringIO()))
+        self.path = os.path.join(self.enterContext(tempfile.TemporaryDirectory()), "embed.sock")
+        self.model = RecordingEmbeddings()
+        self.server = self._start()
+        self.client = EmbeddingClient(self.path, timeout=5)
+
+    def _start(self):
+        server = EmbeddingServer(self.model, self.path, max_batch=4, max_wait_ms=100)
+        loop = asyncio.new_event_loop()
+        task = loop.create_task(server.serve())
+
+        def run():
+            with contextlib.suppress(asyncio.CancelledError):
+                loop.run_until_complete(task)
+            # ปิด connection ที่ค้างอยู่เหมือน asyncio.run ตอนจบ (client ต้องเห็นว่า server ดับจริง)
+            pending = asyncio.all_tasks(loop)
+            for leftover in pending:
+                leftover.cancel()
+            loop.run_until_complete(asyncio.gather(*pending, return_exceptions=True))
+            loop.close()
+
+        def stop():
+            if thread.is_alive():
+                loop.call_soon_threadsafe(task.cancel)
+                thread.join(2)
+            server.executor.shutdown()
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        server.stop = stop
+        self.addCleanup(stop)
+        for _ in range(200):
+            if os.path.exists(self.path):
+                break
+            threading.Event().wait(0.01)
+        return server
+
+    def _expected(self, texts):
+        return np.asarray(HashingEmbeddings(dim=16).embed_documents(texts), dtype=np.float32)
+
+    def test_concurrent_callers_get_their_own_vectors(self):
+        texts = {n: [f"คำขอ {n} ข้อความ {i}" for i in range(3)] for n in range(8)}
+        results = {}
+        barrier = threading.Barrier(len(texts))
+
+        def call(n):
+            client = EmbeddingClient(self.path, timeout=5)
+            barrier.wait()
+            results[n] = client.embed_documents(texts[n])
+
+        threads = [threading.Thread(target=call, args=(n,)) for n in texts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(5)
+
+        for n, sent in texts.items():
+            self.assertTrue(np.allclose(results[n], self._expected(sent)), n)
+        self.assertEqual(sum(self.model.batches), 24)
+        self.assertLess(len(self.model.batches), 8)                 # คำขอที่มาพร้อมกันถูกรวมชุด
+        self.assertLessEqual(max(self.model.batches), 6)            # เต็ม max_batch แล้วตัดชุด
+        self.assertEqual(self.server.stats["requests"], 8)
+
+    def test_model_error_comes_back_as_runtime_error(self):
+        with self.assertRaisesMessage(RuntimeError, "model exploded"):
+            self.client.embed_documents(["ok", "boom"])
+        self.assertEqual(self.server.stats["errors"], 1)
+        # connection เดิมยังใช้ต่อได้
+        self.assertTrue(np.allclose(self.client.embed_query("ต่อได้"), self._expected(["ต่อได้"])[0]))
+        self.assertEqual(self.client.embed_documents([]), [])
+
+    def test_framing(self):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(5)
+            sock.connect(self.path)
+            payload = json.dumps(["ก", "ข"]).encode("utf-8")
+            sock.sendall(FRAME.pack(len(payload)) + payload)
+            body = self.client._read_exactly(sock, FRAME.unpack(self.client._read_exactly(sock, FRAME.size))[0])
+            self.assertEqual(body[:1], STATUS_OK)
+            self.assertEqual(SHAPE.unpack(body[1:1 + SHAPE.size]), (2, 16))
+            self.assertEqual(len(body), 1 + SHAPE.size + 2 * 16 * 4)
+
+            # frame ที่ไม่ใช่ JSON -> server ตัด connection นั้นทิ้ง แต่ยังรับ client อื่นได้
+            sock.sendall(FRAME.pack(3) + b"{x]")
+            self.assertEqual(sock.recv(1), b"")
+        self.assertEqual(len(self.client.embed_documents(["ยังอยู่"])), 1)
+
+    def test_reconnects_once_after_server_restart(self):
+        self.client.embed_query("ก่อนรีสตาร์ท")
+        self.server.stop()
+        self.server = self._start()
+        self.assertTrue(np.allclose(self.client.embed_query("หลังรีสตาร์ท"), self._expected(["หลังรีสตาร์ท"])[0]))
+
+        self.server.stop()
+        with self.assertRaises(OSError):
+            self.client.embed_query("server ดับ")
@@ -75,6 +75,11 @@ urlpatterns = [
 
     # ==================== RAG-ASSISTED WRITING ====================
     path('api/chat/general/', views.ai_chat_general, name='ai_chat_general'),
-    path('api/generate-scene/', views.ai_generate_scene, name='ai_generate_scene'),
+    path('api/chat/general/stream/', views.ai_chat_general_stream, name='ai_chat_general_stream'),
+    path('api/chat/general/history/', views.ai_chat_history, name='ai_chat_history'),
+    path('api/chat/general/reset/', views.ai_chat_reset, name='ai_chat_reset'),
+    path('api/generate-scene/<int:scene_id>/', views.ai_generate_scene, name='ai_generate_scene'),
+    path('api/generate-scene/<int:scene_id>/stream/', views.ai_generate_scene_stream, name='ai_generate_scene_stream'),
     path('api/generate-character/', views.ai_generate_character, name='ai_generate_character'),
+    path('metrics', views.metrics, name='metrics'),
 ]
@@ -1,11 +1,11 @@
 import os
-from django.shortcuts import render, redirect, get_object_or_404
+from django.shortcuts import render, redirect, get_object_or_404, aget_object_or_404
 from django.contrib.auth import login, logout
 from django.contrib.contenttypes.models import ContentType
 from django.db.models import Q
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
-from django.http import JsonResponse, HttpResponseForbidden, HttpResponse
+from django.http import JsonResponse, HttpResponseForbidden, HttpResponse, StreamingHttpResponse
 from django.views.decorators.http import require_POST
 from django.conf import settings
 from django.conf.urls.static import static
@@ -31,6 +31,10 @@ from .forms import (
 )
 
 from .rag_service import rag_service
+from . import rag_memory
+from .rag_metrics import registry as metrics_registry, server_timing, server_timing_header, start_timings
+from .rag_mentions import appearances
+from .rag_limits import ai_rate_limited
 from django.views.decorators.csrf import csrf_exempt
 
 # ==================== AUTHENTICATION & PROFILE (from myapp) ====================
@@ -450,7 +454,7 @@ def character_edit(request, pk):
 @login_required
 def character_detail(request, pk):
     character = get_object_or_404(Character, id=pk)
-    return render(request, 'worldbuilding/character_detail.html', {'character': character})
+    return render(request, 'worldbuilding/character_detail.html', {'character': character, 'appearances': appearances(character)})
 
 
 @login_required
@@ -495,7 +499,7 @@ def location_list(request):
 @login_required
 def location_detail(request, pk):
     location = get_object_or_404(Location, id=pk)
-    return render(request, 'worldbuilding/location_detail.html', {'location': location})
+    return render(request, 'worldbuilding/location_detail.html', {'location': location, 'appearances': appearances(location)})
 
 
 @login_required
@@ -572,7 +576,7 @@ def item_list(request):
 @login_required
 def item_detail(request, pk):
     item = get_object_or_404(Item, id=pk)
-    return render(request, 'worldbuilding/item_detail.html', {'item': item})
+    return render(request, 'worldbuilding/item_detail.html', {'item': item, 'appearances': appearances(item)})
 
 
 @login_required
@@ -1205,42 +1209,52 @@ def bookmark_list(request):
     })
 
 # ==================== RAG SERVICE INTEGRATION ====================
+# View ของ AI เป็น async ทั้งหมด: ระหว่างรอ Gemini ตอบ process ไม่ถูกจองไว้ทั้งตัว
+# (ต้องรันผ่าน ASGI เช่น gunicorn + UvicornWorker ดู README) งาน Embed/Chroma ไปทำใน thread pool ของ rag_service
 
 @csrf_exempt
 @login_required
-def ai_generate_scene(request, scene_id):
+@ai_rate_limited
+@server_timing
+async def ai_generate_scene(request, scene_id):
     """ API สำหรับกดปุ่ม 'Generate Draft' """
     if request.method == "POST":
+        user = await request.auser()
         # 1. ดึงข้อมูล Scene มา (ต้องเป็นเจ้าของเท่านั้น)
         # ใน models.py Scene ไม่ได้ผูกกับ User โดยตรง แต่ผูกผ่าน Project -> Owner
         # ดังนั้นต้องเช็คผ่าน project__owner
-        scene = get_object_or_404(Scene, pk=scene_id, project__author=request.user)
+        scene = await aget_object_or_404(_ai_scene_queryset(), pk=scene_id, project__author=user)
         
-        # 2. เรียก AI ให้ร่างให้
-        draft_content = rag_service.generate_scene_draft(scene)
-        
-        # 3. ส่งเนื้อหากลับไป
         try:
-             draft_content = rag_service.generate_scene_draft(scene)
-             return JsonResponse({'draft': draft_content})
+            concept = json.loads(request.body or '{}').get('concept', '')
+        except ValueError:
+            concept = ''
+
+        # 2. เรียก AI ให้ร่างให้ (ครั้งเดียว) แล้วส่งเนื้อหากลับไป
+        try:
+            draft_content = await rag_service.agenerate_scene_draft(scene, concept, user_id=user.id)
+            return JsonResponse({'draft': draft_content})
         except Exception as e:
-             return JsonResponse({'error': str(e)}, status=500)
+            return JsonResponse({'error': str(e)}, status=500)
 
     return JsonResponse({'error': 'Invalid method'}, status=405)
 
 @csrf_exempt
 @login_required
-def ai_chat_general(request):
+@ai_rate_limited
+@server_timing
+async def ai_chat_general(request):
     if request.method == "POST":
         try:
+            user = await request.auser()
             data = json.loads(request.body)
             user_message = data.get('message', '')
             novel_id = data.get('novel_id')
             
-            reply = rag_service.chat_with_editor(
+            reply = await rag_service.achat_with_editor(
                 user_message, 
                 novel_id=novel_id, 
-                user_id=request.user.id
+                user_id=user.id
             )
             
             return JsonResponse({'reply': reply})
@@ -1249,17 +1263,107 @@ def ai_chat_general(request):
     
     return JsonResponse({'error': 'Method not allowed'}, status=405)
 
+def _ai_scene_queryset():
+    """ ดึงทุกอย่างที่ Prompt ร่างฉากต้องใช้มาครั้งเดียว (async view แตะ lazy relation ไม่ได้) """
+    return Scene.objects.select_related('pov_character', 'location').prefetch_related('characters')
+
+def _sse_response(chunks):
+    """
+    แปลงข้อความที่ทยอยได้จาก LLM (async iterator) เป็น Server-Sent Events
+    - data: {"delta": "..."} ทีละท่อน แล้วปิดท้ายด้วย event: done
+    - ถ้า client ตัดการเชื่อมต่อ Django จะยกเลิก task นี้ -> chunks ถูกปิดตาม -> LLM หยุด gen
+    - header ถูกส่งไปก่อนเริ่มงาน จึงแนบเวลาแต่ละขั้น (แบบ Server-Timing) ไว้ใน event: done แทน
+    """
+    async def events():
+        timings = start_timings()
+        # ส่งอะไรออกไปก่อนทันที ให้ browser รู้ว่าเชื่อมต่อแล้ว ระหว่างที่ยังค้นบริบท/รอ token แรก
+        yield ": connected\n\n"
+        try:
+            async for text in chunks:
+                yield f"data: {json.dumps({'delta': text}, ensure_ascii=False)}\n\n"
+            done = {'server_timing': server_timing_header(timings)} if timings else {}
+            yield f"event: done\ndata: {json.dumps(done)}\n\n"
+        finally:
+            await chunks.aclose()
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'  # ไม่ให้ nginx พัก response ไว้ก่อนส่ง
+    return response
+
 @csrf_exempt
 @login_required
-def ai_generate_character(request):
+@ai_rate_limited
+async def ai_chat_general_stream(request):
+    """ API คุยกับพี่บก. แบบ Stream (ตัวอักษรทยอยขึ้นมาทีละท่อน) """
+    if request.method != "POST":
+        return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+
+    user = await request.auser()
+    return _sse_response(rag_service.astream_chat_with_editor(
+        data.get('message', ''),
+        novel_id=data.get('novel_id'),
+        user_id=user.id
+    ))
+
+@login_required
+def ai_chat_history(request):
+    """ ข้อความล่าสุดของแชทพี่บก. ในนิยายนี้ (ให้หน้าเว็บแสดงต่อจากที่คุยค้างไว้) """
+    session = rag_memory.get_session(request.user.id, request.GET.get('novel_id'), create=False)
+    if session is None:
+        return JsonResponse({'turns': [], 'has_summary': False})
+    return JsonResponse({
+        'turns': [{'role': turn.role, 'content': turn.content} for turn in rag_memory.recent_turns(session)],
+        'has_summary': bool(session.summary),
+    })
+
+@login_required
+@require_POST
+def ai_chat_reset(request):
+    """ ล้างความจำแชทพี่บก. ของนิยายนี้ (เริ่มคุยใหม่) """
+    try:
+        data = json.loads(request.body or '{}')
+    except ValueError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    rag_memory.reset(request.user.id, data.get('novel_id'))
+    return JsonResponse({'success': True})
+
+@csrf_exempt
+@login_required
+@ai_rate_limited
+async def ai_generate_scene_stream(request, scene_id):
+    """ API ร่างฉากแบบ Stream (เนื้อหาทยอยลงช่อง Content) """
+    if request.method != "POST":
+        return JsonResponse({'error': 'Invalid method'}, status=405)
+
+    user = await request.auser()
+    scene = await aget_object_or_404(_ai_scene_queryset(), pk=scene_id, project__author=user)
+    try:
+        concept = json.loads(request.body or '{}').get('concept', '')
+    except ValueError:
+        concept = ''
+
+    return _sse_response(rag_service.astream_scene_draft(scene, concept, user_id=user.id))
+
+@csrf_exempt
+@login_required
+@ai_rate_limited
+@server_timing
+async def ai_generate_character(request):
     """ API สำหรับ Gen ข้อมูลตัวละคร """
     if request.method == "POST":
         try:
+            user = await request.auser()
             data = json.loads(request.body)
             concept = data.get('concept', '')
             
             # เรียก AI
-            char_data = rag_service.generate_character_data(concept)
+            char_data = await rag_service.agenerate_character_data(concept, user_id=user.id)
             
             if char_data:
                 return JsonResponse({'success': True, 'data': char_data})
@@ -1269,4 +1373,15 @@ def ai_generate_character(request):
         except Exception as e:
             return JsonResponse({'error': str(e)}, status=500)
     
-    return JsonResponse({'error': 'Method not allowed'}, status=405)
\ No newline at end of file
+    return JsonResponse({'error': 'Method not allowed'}, status=405)
+
+def metrics(request):
+    """
+    ตัวเลขของ RAG/LLM แบบ Prometheus (รวมทุก worker process)
+    ถ้าตั้ง RAG_METRICS_TOKEN ต้องส่ง Authorization: Bearer <token> มา ไม่งั้นเฉพาะ staff ที่ login อยู่
+    """
+    token = getattr(settings, 'RAG_METRICS_TOKEN', '')
+    authorized = bool(token) and request.headers.get('Authorization', '') == f'Bearer {token}'
+    if not authorized and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')